@@ -3,6 +3,8 @@ const yearLabel = document.getElementById("year");
 
 const STORAGE_TOKEN_KEY = "ecostep_admin_token";
 const STORAGE_ADMIN_ID_KEY = "ecostep_admin_id";
+const STORAGE_BROADCAST_KEY = "ecostep_broadcast_job";
+const BROADCAST_POLL_MS = 2000;
 const API_BASE = `${window.location.origin}/api`;
 const MIN_TITLE_LENGTH = 3;
 const MIN_DESCRIPTION_LENGTH = 4;
@@ -11,6 +13,11 @@ const state = {
     token: localStorage.getItem(STORAGE_TOKEN_KEY),
     adminId: Number.parseInt(localStorage.getItem(STORAGE_ADMIN_ID_KEY) || "", 10) || null,
     telegramUser: null,
+    broadcastTimer: null,
+    reportsCursor: null,
+    reportsTotal: null,
+    reportsStream: null,
+    newReports: 0,
 };
 
 const telegram = window.Telegram?.WebApp;
@@ -33,6 +40,7 @@ function saveAuth(token, adminId) {
 }
 
 function clearAuth() {
+    closeReportsStream();
     state.token = null;
     localStorage.removeItem(STORAGE_TOKEN_KEY);
     localStorage.removeItem(STORAGE_ADMIN_ID_KEY);
@@ -137,8 +145,9 @@ async function apiFetch(path, options = {}) {
         headers.Authorization = `Bearer ${state.token}`;
     }
 
+    const { withHeaders, ...fetchOptions } = options;
     const response = await fetch(`${API_BASE}${path}`, {
-        ...options,
+        ...fetchOptions,
         headers,
     });
 
@@ -161,7 +170,8 @@ async function apiFetch(path, options = {}) {
     if (response.status === 204) {
         return null;
     }
-    return response.json();
+    const data = await response.json();
+    return options.withHeaders ? { data, headers: response.headers } : data;
 }
 
 function renderLogin() {
@@ -258,6 +268,11 @@ function renderAdminPanel() {
                     <textarea id="broadcast-message" rows="4" placeholder="Введите текст для рассылки"></textarea>
                     <button type="submit">Отправить всем пользователям</button>
                 </form>
+                <div id="broadcast-progress" class="hint" hidden>
+                    <p id="broadcast-status"></p>
+                    <button type="button" id="broadcast-cancel" class="secondary">Отменить</button>
+                    <button type="button" id="broadcast-resume" class="secondary">Продолжить</button>
+                </div>
             </div>
 
             <div class="panel-block">
@@ -273,7 +288,10 @@ function renderAdminPanel() {
                     <input id="challenge-points" type="number" min="1" max="500" value="5" required>
 
                     <label for="challenge-co2">Экономия CO₂</label>
-                    <input id="challenge-co2" type="text" placeholder="Например, 0.2 кг CO₂" required>
+                    <input id="challenge-co2" type="text" placeholder="Например, 0.2 кг CO₂">
+                    <label for="challenge-co2-kg">CO₂, кг</label>
+                    <input id="challenge-co2-kg" type="number" min="0" step="0.01" placeholder="Например, 0.2">
+                    <p class="hint small-hint">Достаточно одного поля: подпись построится из числа, число — из подписи.</p>
                     <div class="inline-option">
                         <input type="checkbox" id="challenge-co2-variable">
                         <label for="challenge-co2-variable" class="inline-label">CO₂ зависит от количества</label>
@@ -294,10 +312,12 @@ function renderAdminPanel() {
 
             <div class="panel-block">
                 <div class="panel-header">
-                    <h3>Отчёты на проверку</h3>
+                    <h3>Отчёты на проверку <span id="reports-total"></span></h3>
                     <button type="button" id="refresh-reports" class="secondary">Обновить</button>
                 </div>
+                <p id="reports-new" class="hint" hidden></p>
                 <div id="reports-list" class="list"></div>
+                <button type="button" id="reports-more" class="secondary" hidden>Показать ещё</button>
             </div>
 
             <div class="panel-block">
@@ -314,16 +334,26 @@ function renderAdminPanel() {
 
     document.getElementById("logout-btn").addEventListener("click", handleLogout);
     document.getElementById("broadcast-form").addEventListener("submit", handleBroadcast);
+    document.getElementById("broadcast-cancel").addEventListener("click", () => changeBroadcast("cancel"));
+    document.getElementById("broadcast-resume").addEventListener("click", () => changeBroadcast("resume"));
     document.getElementById("challenge-form").addEventListener("submit", handleAddChallenge);
     document.getElementById("refresh-user-stats").addEventListener("click", loadUserStats);
-    document.getElementById("refresh-reports").addEventListener("click", loadPendingReports);
+    document.getElementById("refresh-reports").addEventListener("click", () => loadPendingReports());
+    document.getElementById("reports-more").addEventListener("click", () => loadPendingReports({ append: true }));
+    document.getElementById("reports-list").addEventListener("click", handleReportAction);
     document.getElementById("refresh-challenges").addEventListener("click", loadChallenges);
     document.getElementById("refresh-logs").addEventListener("click", loadLogs);
 
     loadUserStats();
     loadPendingReports();
+    openReportsStream();
     loadChallenges();
     loadLogs();
+
+    const lastBroadcast = localStorage.getItem(STORAGE_BROADCAST_KEY);
+    if (lastBroadcast) {
+        pollBroadcast(lastBroadcast);
+    }
 }
 
 async function handleLogout() {
@@ -347,12 +377,72 @@ async function handleBroadcast(event) {
         return;
     }
     try {
-        const result = await apiFetch("/broadcast", {
+        const job = await apiFetch("/broadcast", {
             method: "POST",
             body: JSON.stringify({ message }),
         });
-        showMessage(`Рассылка завершена. Отправлено: ${result.sent}, ошибки: ${result.failed}.`);
+        showMessage(`Рассылка запущена: ${job.total} получателей.`);
         textarea.value = "";
+        localStorage.setItem(STORAGE_BROADCAST_KEY, String(job.id));
+        renderBroadcastProgress(job);
+        scheduleBroadcastPoll(job);
+    } catch (error) {
+        showMessage(error.message);
+    }
+}
+
+function renderBroadcastProgress(job) {
+    const container = document.getElementById("broadcast-progress");
+    if (!container) {
+        return;
+    }
+    const labels = {
+        queued: "в очереди",
+        running: "идёт",
+        cancelled: "отменена",
+        completed: "завершена",
+    };
+    const speed = job.throughput != null ? `, ${job.throughput} сообщ./с` : "";
+    container.hidden = false;
+    document.getElementById("broadcast-status").textContent =
+        `Рассылка #${job.id} ${labels[job.status] || job.status}: отправлено ${job.sent}, ` +
+        `ошибки ${job.failed}, осталось ${job.remaining}${speed}.`;
+    const active = job.status === "queued" || job.status === "running";
+    document.getElementById("broadcast-cancel").hidden = !active;
+    document.getElementById("broadcast-resume").hidden = job.status !== "cancelled";
+}
+
+function scheduleBroadcastPoll(job) {
+    clearTimeout(state.broadcastTimer);
+    state.broadcastTimer = null;
+    if (job.status === "queued" || job.status === "running") {
+        state.broadcastTimer = setTimeout(() => pollBroadcast(job.id), BROADCAST_POLL_MS);
+    }
+}
+
+async function pollBroadcast(jobId) {
+    if (!document.getElementById("broadcast-progress")) {
+        return;
+    }
+    try {
+        const job = await apiFetch(`/broadcast/${jobId}`);
+        renderBroadcastProgress(job);
+        scheduleBroadcastPoll(job);
+    } catch {
+        localStorage.removeItem(STORAGE_BROADCAST_KEY);
+        document.getElementById("broadcast-progress")?.setAttribute("hidden", "");
+    }
+}
+
+async function changeBroadcast(action) {
+    const jobId = localStorage.getItem(STORAGE_BROADCAST_KEY);
+    if (!jobId) {
+        return;
+    }
+    try {
+        const job = await apiFetch(`/broadcast/${jobId}/${action}`, { method: "POST" });
+        renderBroadcastProgress(job);
+        scheduleBroadcastPoll(job);
     } catch (error) {
         showMessage(error.message);
     }
@@ -364,9 +454,11 @@ async function handleAddChallenge(event) {
     const description = document.getElementById("challenge-description").value.trim();
     const points = Number.parseInt(document.getElementById("challenge-points").value, 10);
     const co2 = document.getElementById("challenge-co2").value.trim();
+    const co2KgRaw = document.getElementById("challenge-co2-kg").value.trim();
+    const co2Kg = co2KgRaw ? Number.parseFloat(co2KgRaw) : null;
     const co2QuantityBased = document.getElementById("challenge-co2-variable").checked;
 
-    if (!title || !description || !co2 || Number.isNaN(points) || points <= 0) {
+    if (!title || !description || (!co2 && co2Kg === null) || Number.isNaN(co2Kg) || Number.isNaN(points) || points <= 0) {
         showMessage("Проверьте корректность полей задания.");
         return;
     }
@@ -382,7 +474,14 @@ async function handleAddChallenge(event) {
     try {
         await apiFetch("/challenges", {
             method: "POST",
-            body: JSON.stringify({ title, description, points, co2, co2_quantity_based: co2QuantityBased }),
+            body: JSON.stringify({
+                title,
+                description,
+                points,
+                co2: co2 || null,
+                co2_kg: co2Kg,
+                co2_quantity_based: co2QuantityBased,
+            }),
         });
         showMessage("Задание добавлено и доступно пользователям.");
         document.getElementById("challenge-form").reset();
@@ -495,113 +594,200 @@ async function loadChallenges() {
     }
 }
 
-async function loadPendingReports() {
+async function loadPendingReports({ append = false } = {}) {
     const container = document.getElementById("reports-list");
-    container.textContent = "Загрузка...";
+    const moreButton = document.getElementById("reports-more");
+    if (!append) {
+        state.reportsCursor = null;
+        state.newReports = 0;
+        document.getElementById("reports-new").hidden = true;
+        container.textContent = "Загрузка...";
+    }
+    moreButton.disabled = true;
     try {
-        const reports = await apiFetch("/reports/pending");
-        if (!reports.length) {
+        const query = new URLSearchParams();
+        if (append && state.reportsCursor) {
+            query.set("cursor", state.reportsCursor);
+        }
+        const { data: reports, headers } = await apiFetch(`/reports/pending?${query}`, { withHeaders: true });
+        const total = Number.parseInt(headers.get("X-Total-Count") || "", 10);
+        state.reportsTotal = Number.isNaN(total) ? null : total;
+        renderReportsTotal();
+        state.reportsCursor = headers.get("X-Next-Cursor");
+        moreButton.hidden = !state.reportsCursor;
+
+        const cards = reports.map(renderReportCard).join("");
+        if (append) {
+            container.insertAdjacentHTML("beforeend", cards);
+        } else if (!reports.length) {
             container.textContent = "Нет отчётов, ожидающих проверки.";
-            return;
+        } else {
+            container.innerHTML = cards;
         }
-        container.innerHTML = reports
-            .map((report) => {
-                let attachmentBlock = "<p>Файл: -</p>";
-                if (report.file_url && report.attachment_type === "photo") {
-                    attachmentBlock = `
-                        <figure class="report-media">
-                            <img src="${report.file_url}" alt="Фото отчёта" class="report-preview" loading="lazy" />
-                            <figcaption>${report.attachment_name || "Фото"}</figcaption>
-                        </figure>
-                    `;
-                } else if (report.file_url) {
-                    const fileLabel = report.attachment_name || "Скачать файл";
-                    attachmentBlock = `
-                        <p class="report-download">
-                            <a href="${report.file_url}" target="_blank" rel="noopener" class="download-link">${fileLabel}</a>
-                        </p>
-                    `;
-                }
-                const commentText = report.caption || "-";
-                const usernameText = report.username ? `@${report.username}` : "-";
-                const co2Note = report.co2_quantity_based
-                    ? '<p class="note warning">CO₂ зависит от количества - проверь комментарий пользователя.</p>'
-                    : "";
-                const co2ValueAttr = Number.isFinite(report.co2_value) ? report.co2_value : "";
-                return `
-                    <article class="report-card" data-user="${report.user_id}" data-challenge="${report.challenge_id}" data-co2-value="${co2ValueAttr}" data-co2-quantity="${report.co2_quantity_based}">
-                        <header>
-                            <strong>${report.challenge_title}</strong>
-                            <span>${report.submitted_at}</span>
-                        </header>
-                        <p>Пользователь: ${report.first_name || "Без имени"} (${usernameText})</p>
-                        <p>Комментарий: ${commentText}</p>
-                        ${co2Note}
-                        ${attachmentBlock}
-                        <div class="actions">
-                            <button type="button" data-action="approve">Одобрить</button>
-                            <button type="button" data-action="reject" class="danger">Отклонить</button>
-                        </div>
-                    </article>
-                `;
-            })
-            .join("");
+    } catch (error) {
+        if (append) {
+            showMessage(error.message);
+        } else {
+            container.textContent = error.message;
+        }
+    } finally {
+        moreButton.disabled = false;
+    }
+}
 
-        container.querySelectorAll("button[data-action]").forEach((button) => {
-            button.addEventListener("click", async (event) => {
-                const card = event.target.closest(".report-card");
-                const userId = Number(card.dataset.user);
-                const challengeId = card.dataset.challenge;
-                const decision = event.target.dataset.action === "approve" ? "approved" : "rejected";
-                let comment = null;
-                let co2Saved = null;
-                if (decision === "rejected") {
-                    const input = prompt("Укажите причину отклонения (необязательно):", "");
-                    if (input === null) {
-                        return;
-                    }
-                    comment = input.trim();
-                } else {
-                    const perUnitValue = Number.parseFloat(card.dataset.co2Value || "");
-                    const isQuantityBased = card.dataset.co2Quantity === "true";
-                    if (isQuantityBased) {
-                        const quantityInput = prompt("Введите количество (в кг), указанное пользователем в отчёте:", "");
-                        if (quantityInput === null) {
-                            return;
-                        }
-                        const quantity = Number.parseFloat(quantityInput.replace(",", "."));
-                        if (Number.isNaN(quantity) || quantity <= 0) {
-                            showMessage("Укажите корректное количество в килограммах.");
-                            return;
-                        }
-                        if (!Number.isNaN(perUnitValue) && perUnitValue > 0) {
-                            co2Saved = Number((perUnitValue * quantity).toFixed(4));
-                        }
-                    } else if (!Number.isNaN(perUnitValue) && perUnitValue > 0) {
-                        co2Saved = Number(perUnitValue.toFixed(4));
-                    }
-                }
-                try {
-                    await apiFetch("/reports/resolve", {
-                        method: "POST",
-                        body: JSON.stringify({
-                            user_id: userId,
-                            challenge_id: challengeId,
-                            decision,
-                            comment: comment && comment.length ? comment : null,
-                            co2_saved: co2Saved,
-                        }),
-                    });
-                    showMessage("Отчёт обработан.");
-                    await loadPendingReports();
-                    await loadLogs();
-                } catch (error) {
-                    showMessage(error.message);
-                }
-            });
+function renderReportsTotal() {
+    const label = document.getElementById("reports-total");
+    if (label) {
+        label.textContent = state.reportsTotal === null ? "" : `(${state.reportsTotal})`;
+    }
+}
+
+function removeReportCard(userId, challengeId) {
+    const container = document.getElementById("reports-list");
+    const card = container?.querySelector(
+        `.report-card[data-user="${userId}"][data-challenge="${CSS.escape(challengeId)}"]`,
+    );
+    card?.remove();
+    if (container && !container.querySelector(".report-card") && !state.reportsCursor) {
+        container.textContent = "Нет отчётов, ожидающих проверки.";
+    }
+}
+
+function openReportsStream() {
+    closeReportsStream();
+    if (!state.token || !window.EventSource) {
+        return;
+    }
+    // EventSource не передаёт заголовки, поэтому токен идёт в параметре запроса
+    const stream = new EventSource(`${API_BASE}/reports/stream?token=${encodeURIComponent(state.token)}`);
+    stream.addEventListener("resolved", (event) => {
+        const data = JSON.parse(event.data);
+        removeReportCard(data.user_id, data.challenge_id);
+        if (state.reportsTotal !== null) {
+            state.reportsTotal = Math.max(0, state.reportsTotal - 1);
+            renderReportsTotal();
+        }
+    });
+    stream.addEventListener("added", () => {
+        state.newReports += 1;
+        if (state.reportsTotal !== null) {
+            state.reportsTotal += 1;
+            renderReportsTotal();
+        }
+        const notice = document.getElementById("reports-new");
+        if (notice) {
+            notice.textContent = `Новых отчётов: ${state.newReports}. Нажмите «Обновить», чтобы увидеть их.`;
+            notice.hidden = false;
+        }
+    });
+    state.reportsStream = stream;
+}
+
+function closeReportsStream() {
+    if (state.reportsStream) {
+        state.reportsStream.close();
+        state.reportsStream = null;
+    }
+}
+
+function renderReportCard(report) {
+    let attachmentBlock = "<p>Файл: -</p>";
+    if (report.file_url && report.attachment_type === "photo") {
+        attachmentBlock = `
+            <figure class="report-media">
+                <img src="${report.file_url}" alt="Фото отчёта" class="report-preview" loading="lazy" />
+                <figcaption>${report.attachment_name || "Фото"}</figcaption>
+            </figure>
+        `;
+    } else if (report.file_url) {
+        const fileLabel = report.attachment_name || "Скачать файл";
+        attachmentBlock = `
+            <p class="report-download">
+                <a href="${report.file_url}" target="_blank" rel="noopener" class="download-link">${fileLabel}</a>
+            </p>
+        `;
+    }
+    const commentText = report.caption || "-";
+    const usernameText = report.username ? `@${report.username}` : "-";
+    const co2Note = report.co2_quantity_based
+        ? '<p class="note warning">CO₂ зависит от количества - проверь комментарий пользователя.</p>'
+        : "";
+    const co2ValueAttr = Number.isFinite(report.co2_value) ? report.co2_value : "";
+    return `
+        <article class="report-card" data-user="${report.user_id}" data-challenge="${report.challenge_id}" data-co2-value="${co2ValueAttr}" data-co2-quantity="${report.co2_quantity_based}">
+            <header>
+                <strong>${report.challenge_title}</strong>
+                <span>${report.submitted_at}</span>
+            </header>
+            <p>Пользователь: ${report.first_name || "Без имени"} (${usernameText})</p>
+            <p>Комментарий: ${commentText}</p>
+            ${co2Note}
+            ${attachmentBlock}
+            <div class="actions">
+                <button type="button" data-action="approve">Одобрить</button>
+                <button type="button" data-action="reject" class="danger">Отклонить</button>
+            </div>
+        </article>
+    `;
+}
+
+async function handleReportAction(event) {
+    const button = event.target.closest("button[data-action]");
+    if (!button) {
+        return;
+    }
+    const card = button.closest(".report-card");
+    const userId = Number(card.dataset.user);
+    const challengeId = card.dataset.challenge;
+    const decision = button.dataset.action === "approve" ? "approved" : "rejected";
+    let comment = null;
+    let co2Saved = null;
+    if (decision === "rejected") {
+        const input = prompt("Укажите причину отклонения (необязательно):", "");
+        if (input === null) {
+            return;
+        }
+        comment = input.trim();
+    } else {
+        const perUnitValue = Number.parseFloat(card.dataset.co2Value || "");
+        const isQuantityBased = card.dataset.co2Quantity === "true";
+        if (isQuantityBased) {
+            const quantityInput = prompt("Введите количество (в кг), указанное пользователем в отчёте:", "");
+            if (quantityInput === null) {
+                return;
+            }
+            const quantity = Number.parseFloat(quantityInput.replace(",", "."));
+            if (Number.isNaN(quantity) || quantity <= 0) {
+                showMessage("Укажите корректное количество в килограммах.");
+                return;
+            }
+            if (!Number.isNaN(perUnitValue) && perUnitValue > 0) {
+                co2Saved = Number((perUnitValue * quantity).toFixed(4));
+            }
+        } else if (!Number.isNaN(perUnitValue) && perUnitValue > 0) {
+            co2Saved = Number(perUnitValue.toFixed(4));
+        }
+    }
+    try {
+        await apiFetch("/reports/resolve", {
+            method: "POST",
+            body: JSON.stringify({
+                user_id: userId,
+                challenge_id: challengeId,
+                decision,
+                comment: comment && comment.length ? comment : null,
+                co2_saved: co2Saved,
+            }),
         });
+        showMessage("Отчёт обработан.");
+        removeReportCard(userId, challengeId);
+        if (!state.reportsStream || state.reportsStream.readyState !== EventSource.OPEN) {
+            // Без ленты событий счётчик и очередь обновляем запросом
+            await loadPendingReports();
+        }
+        await loadLogs();
     } catch (error) {
-        container.textContent = error.message;
+        showMessage(error.message);
     }
 }
 
@@ -1,5 +1,8 @@
-import secrets
-from html import escape
+import base64
+import binascii
+import json
+import logging
+from datetime import date, timedelta
 from pathlib import Path
 from dotenv import load_dotenv
 from fastapi import (
@@ -7,21 +10,32 @@ from fastapi import (
     Depends,
     FastAPI,
     HTTPException,
+    Query,
+    Request,
+    Response,
     status,
 )
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from fastapi.staticfiles import StaticFiles
 
 from .schemas import (
     AdminLogEntry,
+    BroadcastJobResponse,
     BroadcastRequest,
     ChallengeCreateRequest,
     ChallengeResponse,
     ChallengeUpdateRequest,
+    LeaderboardEntry,
+    LeaderboardRank,
+    LeaderboardResponse,
     LoginRequest,
     LoginResponse,
     ReportActionRequest,
+    ReportBatchItemResult,
+    ReportBatchRequest,
+    ReportBatchResponse,
     ReportResponse,
 )
 from settings.admins import (
@@ -31,45 +45,60 @@ from settings.admins import (
     validate_admin_password,
 )
 from settings.challenges import get_all_challenges, get_challenge
-from bot_core import bot
+import database_aio as db
+from support_tools.admin_sessions import admin_sessions
+from support_tools.broadcasts import broadcast_runner, broadcast_throughput
+from support_tools.file_urls import file_url_resolver
+from support_tools.notifications import friend_completion, notification_worker, user_message
+from support_tools.report_events import report_event_hub
+from support_tools.send_queue import send_queue
 from database import (
-    create_custom_challenge,
-    delete_custom_challenge,
-    fetch_custom_challenges,
-    get_admin_logs,
-    get_all_user_ids,
-    get_friend_ids,
+    close_connections,
     get_custom_challenge,
-    get_pending_reports,
-    get_user_info,
-    get_user_registration_counts,
+    get_week_start_msk,
     init_db,
-    log_admin_action,
-    set_custom_challenge_active,
-    update_report_review,
 )
-from support_tools.co2 import parse_co2_value
 
 security = HTTPBearer(auto_error=False)
-active_tokens: dict[str, int] = {}
 
+PENDING_REPORTS_PAGE_SIZE = 50
 
-async def build_file_url(file_id: str | None) -> str | None:
-    if not file_id:
-        return None
+
+def encode_report_cursor(report: dict) -> str:
+    key = [report["submitted_at"], report["user_id"], report["challenge_id"]]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip("=")
+
+
+def decode_report_cursor(cursor: str) -> tuple[str, int, str]:
     try:
-        telegram_file = await bot.get_file(file_id)
-    except Exception:
-        return None
-    return f"https://api.telegram.org/file/bot{bot.token}/{telegram_file.file_path}"
+        padded = cursor + "=" * (-len(cursor) % 4)
+        submitted_at, user_id, challenge_id = json.loads(base64.urlsafe_b64decode(padded))
+        return str(submitted_at), int(user_id), str(challenge_id)
+    except (binascii.Error, ValueError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Некорректный курсор страницы.",
+        )
 
 
 def get_app() -> FastAPI:
     """Создать и настроить FastAPI-приложение."""
     load_dotenv()
+    logging.basicConfig(level=logging.INFO)
     init_db()
 
     app = FastAPI(title="EcoStep Admin API", version="0.1.0")
+    app.add_event_handler("startup", admin_sessions.start)
+    app.add_event_handler("startup", broadcast_runner.watch)
+    app.add_event_handler("startup", report_event_hub.start)
+    app.add_event_handler("startup", notification_worker.start)
+    app.add_event_handler("shutdown", admin_sessions.stop)
+    app.add_event_handler("shutdown", report_event_hub.stop)
+    app.add_event_handler("shutdown", broadcast_runner.stop)
+    app.add_event_handler("shutdown", notification_worker.stop)
+    app.add_event_handler("shutdown", send_queue.stop)
+    app.add_event_handler("shutdown", db.shutdown)
+    app.add_event_handler("shutdown", close_connections)
 
     app.add_middleware(
         CORSMiddleware,
@@ -77,6 +106,7 @@ def get_app() -> FastAPI:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["X-Total-Count", "X-Next-Cursor"],
     )
 
     api_router = APIRouter(prefix="/api")
@@ -101,9 +131,8 @@ def get_app() -> FastAPI:
                 detail="Неверный пароль.",
             )
 
-        token = secrets.token_urlsafe(32)
-        active_tokens[token] = data.admin_id
-        log_admin_action(data.admin_id, "login", "Вход в админ-панель")
+        token = await admin_sessions.create(data.admin_id)
+        await db.log_admin_action(data.admin_id, "login", "Вход в админ-панель")
         return LoginResponse(token=token, admin_id=data.admin_id)
 
     @api_router.post("/auth/logout")
@@ -111,19 +140,16 @@ def get_app() -> FastAPI:
         credentials: HTTPAuthorizationCredentials = Depends(security),
     ):
         if credentials:
-            active_tokens.pop(credentials.credentials, None)
+            await admin_sessions.revoke(credentials.credentials)
         return {"status": "ok"}
 
-    async def current_admin(
-        credentials: HTTPAuthorizationCredentials = Depends(security),
-    ) -> int:
-        if credentials is None:
+    async def admin_for_token(token: str | None) -> int:
+        if not token:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Токен не передан.",
             )
-        token = credentials.credentials
-        admin_id = active_tokens.get(token)
+        admin_id = await admin_sessions.validate(token)
         if not admin_id:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -136,18 +162,48 @@ def get_app() -> FastAPI:
             )
         return admin_id
 
+    async def current_admin(
+        credentials: HTTPAuthorizationCredentials = Depends(security),
+    ) -> int:
+        return await admin_for_token(credentials.credentials if credentials else None)
+
+    async def stream_admin(
+        token: str | None = Query(None, description="EventSource не умеет передавать заголовки"),
+    ) -> int:
+        return await admin_for_token(token)
+
     @api_router.get("/stats/users")
     async def user_stats(_: int = Depends(current_admin)):
-        counts = get_user_registration_counts()
+        counts = await db.get_user_registration_counts()
         return {
             "total_users": counts["total"],
             "weekly_users": counts["weekly"],
         }
 
+    @api_router.get("/leaderboard", response_model=LeaderboardResponse)
+    async def global_leaderboard(
+        period: str = Query("weekly", pattern="^(weekly|all)$"),
+        limit: int = Query(100, ge=1, le=100),
+        user_id: int | None = Query(None, description="Показать место этого пользователя"),
+        _: int = Depends(current_admin),
+    ):
+        week_start = get_week_start_msk() if period == "weekly" else None
+        entries = await db.get_global_leaderboard(period, limit, week_start)
+        user_rank = None
+        if user_id is not None:
+            rank = await db.get_global_rank(user_id, period, week_start)
+            user_rank = LeaderboardRank(user_id=user_id, **rank)
+        return LeaderboardResponse(
+            period=period,
+            week_start=week_start,
+            entries=[LeaderboardEntry(**entry) for entry in entries],
+            user_rank=user_rank,
+        )
+
     @api_router.get("/challenges", response_model=list[ChallengeResponse])
     async def list_challenges(_: int = Depends(current_admin)):
-        challenges = get_all_challenges()
-        custom = fetch_custom_challenges(active_only=False)
+        challenges = await db.run(get_all_challenges)
+        custom = await db.fetch_custom_challenges(active_only=False)
         response: list[ChallengeResponse] = []
         for challenge_id, data in challenges.items():
             if data.get("source") == "custom":
@@ -157,8 +213,9 @@ def get_app() -> FastAPI:
                     challenge_id=challenge_id,
                     title=data["title"],
                     description=data["description"],
-                    points=int(data.get("points_value", 0)),
+                    points=int(data.get("points", 0)),
                     co2=str(data["co2"]),
+                    co2_kg=data.get("co2_kg"),
                     source="default",
                     active=True,
                     co2_quantity_based=bool(data.get("co2_quantity_based", False)),
@@ -172,6 +229,7 @@ def get_app() -> FastAPI:
                     description=item["description"],
                     points=int(item["points"]),
                     co2=item["co2"],
+                    co2_kg=item["co2_kg"],
                     source="custom",
                     active=bool(item["active"]),
                     co2_quantity_based=bool(item.get("co2_quantity_based", False)),
@@ -184,14 +242,16 @@ def get_app() -> FastAPI:
         payload: ChallengeCreateRequest,
         admin_id: int = Depends(current_admin),
     ):
-        challenge_id = create_custom_challenge(
+        challenge_id = await db.create_custom_challenge(
             payload.title,
             payload.description,
             payload.points,
             payload.co2,
             payload.co2_quantity_based,
+            payload.co2_kg,
         )
-        log_admin_action(
+        created = await db.get_custom_challenge(challenge_id)
+        await db.log_admin_action(
             admin_id,
             "create_challenge",
             f"{challenge_id}: {payload.title}",
@@ -201,7 +261,8 @@ def get_app() -> FastAPI:
             title=payload.title,
             description=payload.description,
             points=payload.points,
-            co2=payload.co2,
+            co2=created["co2"] if created else payload.co2,
+            co2_kg=created["co2_kg"] if created else payload.co2_kg,
             source="custom",
             active=True,
             co2_quantity_based=payload.co2_quantity_based,
@@ -213,21 +274,21 @@ def get_app() -> FastAPI:
         payload: ChallengeUpdateRequest,
         admin_id: int = Depends(current_admin),
     ):
-        challenge = get_custom_challenge(challenge_id)
+        challenge = await db.get_custom_challenge(challenge_id)
         if not challenge:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Задание не найдено или недоступно для изменения.",
             )
 
-        updated = set_custom_challenge_active(challenge_id, payload.active)
+        updated = await db.set_custom_challenge_active(challenge_id, payload.active)
         if not updated:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Не удалось обновить состояние задания.",
             )
 
-        refreshed = get_custom_challenge(challenge_id)
+        refreshed = await db.get_custom_challenge(challenge_id)
         if not refreshed:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -235,7 +296,7 @@ def get_app() -> FastAPI:
             )
 
         action = "activate_challenge" if payload.active else "deactivate_challenge"
-        log_admin_action(
+        await db.log_admin_action(
             admin_id,
             action,
             f"{challenge_id}: {refreshed['title']}",
@@ -247,6 +308,7 @@ def get_app() -> FastAPI:
             description=refreshed["description"],
             points=int(refreshed["points"]),
             co2=str(refreshed["co2"]),
+            co2_kg=refreshed.get("co2_kg"),
             source="custom",
             active=bool(refreshed["active"]),
             co2_quantity_based=bool(refreshed.get("co2_quantity_based", False)),
@@ -257,56 +319,125 @@ def get_app() -> FastAPI:
         challenge_id: str,
         admin_id: int = Depends(current_admin),
     ):
-        challenge = get_custom_challenge(challenge_id)
+        challenge = await db.get_custom_challenge(challenge_id)
         if not challenge:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Удаляемое задание не найдено.",
             )
-        deleted = delete_custom_challenge(challenge_id)
+        deleted = await db.delete_custom_challenge(challenge_id)
         if not deleted:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Не удалось удалить задание.",
             )
-        log_admin_action(
+        await db.log_admin_action(
             admin_id,
             "delete_challenge",
             f"{challenge_id}: {challenge['title']}",
         )
         return {"status": "deleted"}
 
-    @api_router.post("/broadcast")
+    async def broadcast_job_or_404(job_id: int) -> dict:
+        job = await db.get_broadcast_job(job_id)
+        if not job:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Рассылка не найдена.",
+            )
+        return job
+
+    def broadcast_response(job: dict) -> BroadcastJobResponse:
+        return BroadcastJobResponse(
+            id=job["id"],
+            status=job["status"],
+            total=job["total"],
+            sent=job["sent"],
+            failed=job["failed"],
+            remaining=job["remaining"],
+            throughput=broadcast_throughput(job),
+            created_at=job["created_at"],
+            started_at=job["started_at"],
+            finished_at=job["finished_at"],
+        )
+
+    @api_router.post(
+        "/broadcast",
+        response_model=BroadcastJobResponse,
+        status_code=status.HTTP_202_ACCEPTED,
+    )
     async def broadcast(
         payload: BroadcastRequest,
         admin_id: int = Depends(current_admin),
     ):
-        user_ids = get_all_user_ids()
-        sent = 0
-        failed = 0
-        for user_id in user_ids:
-            try:
-                await bot.send_message(user_id, payload.message)
-                sent += 1
-            except Exception:
-                failed += 1
-        log_admin_action(
+        job_id = await db.create_broadcast_job(admin_id, payload.message)
+        broadcast_runner.start(job_id)
+        job = await broadcast_job_or_404(job_id)
+        await db.log_admin_action(
             admin_id,
             "broadcast",
-            f"sent={sent}, failed={failed}",
+            f"job={job_id}, total={job['total']}",
         )
-        return {"sent": sent, "failed": failed, "total": len(user_ids)}
+        return broadcast_response(job)
+
+    @api_router.get("/broadcast/{job_id}", response_model=BroadcastJobResponse)
+    async def broadcast_progress(job_id: int, _: int = Depends(current_admin)):
+        return broadcast_response(await broadcast_job_or_404(job_id))
+
+    @api_router.post("/broadcast/{job_id}/cancel", response_model=BroadcastJobResponse)
+    async def cancel_broadcast(job_id: int, admin_id: int = Depends(current_admin)):
+        await broadcast_job_or_404(job_id)
+        if not await db.set_broadcast_job_status(job_id, "cancelled", ("queued", "running")):
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Рассылка уже завершена или отменена.",
+            )
+        await db.log_admin_action(admin_id, "broadcast_cancel", f"job={job_id}")
+        return broadcast_response(await broadcast_job_or_404(job_id))
+
+    @api_router.post("/broadcast/{job_id}/resume", response_model=BroadcastJobResponse)
+    async def resume_broadcast(job_id: int, admin_id: int = Depends(current_admin)):
+        await broadcast_job_or_404(job_id)
+        if not await db.set_broadcast_job_status(job_id, "queued", ("cancelled",)):
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Возобновить можно только отменённую рассылку.",
+            )
+        broadcast_runner.start(job_id)
+        await db.log_admin_action(admin_id, "broadcast_resume", f"job={job_id}")
+        return broadcast_response(await broadcast_job_or_404(job_id))
 
     @api_router.get("/reports/pending", response_model=list[ReportResponse])
-    async def pending_reports(_: int = Depends(current_admin)):
-        reports = get_pending_reports()
+    async def pending_reports(
+        response: Response,
+        limit: int = Query(PENDING_REPORTS_PAGE_SIZE, ge=1, le=200),
+        cursor: str | None = Query(None, description="X-Next-Cursor предыдущей страницы"),
+        challenge_id: str | None = Query(None),
+        date_from: date | None = Query(None, description="Отправлены начиная с этого дня"),
+        date_to: date | None = Query(None, description="Отправлены не позже этого дня"),
+        _: int = Depends(current_admin),
+    ):
+        filters = {
+            "challenge_id": challenge_id,
+            "submitted_since": date_from.isoformat() if date_from else None,
+            "submitted_until": (date_to + timedelta(days=1)).isoformat() if date_to else None,
+        }
+        after = decode_report_cursor(cursor) if cursor else None
+        # Берём на одну запись больше, чтобы узнать, есть ли следующая страница
+        reports = await db.get_pending_reports(limit=limit + 1, after=after, **filters)
+        has_more = len(reports) > limit
+        reports = reports[:limit]
+        response.headers["X-Total-Count"] = str(await db.count_pending_reports(**filters))
+        if has_more:
+            response.headers["X-Next-Cursor"] = encode_report_cursor(reports[-1])
         responses: list[ReportResponse] = []
-        challenges_cache = get_all_challenges()
+        challenges_cache = await db.run(get_all_challenges)
+        file_urls = await file_url_resolver.resolve_reports(reports)
         for report in reports:
-            details = challenges_cache.get(report["challenge_id"]) or get_challenge(report["challenge_id"])
+            details = challenges_cache.get(report["challenge_id"]) or await db.run(get_challenge, report["challenge_id"])
             title = details["title"] if details else report["challenge_id"]
-            file_url = await build_file_url(report["photo_file_id"])
-            co2_value = parse_co2_value(details.get("co2")) if details else None
+            file_url = file_urls.get(report["photo_file_id"])
+            co2_value = details.get("co2_kg") if details else None
             responses.append(
                 ReportResponse(
                     user_id=report["user_id"],
@@ -327,111 +458,134 @@ def get_app() -> FastAPI:
             )
         return responses
 
-    async def _notify_user(
-        user_id: int,
-        message: str,
+    @api_router.get("/reports/stream")
+    async def reports_stream(
+        request: Request,
+        _: int = Depends(stream_admin),
     ):
-        try:
-            await bot.send_message(user_id, message)
-        except Exception:
-            pass
-
-    def _format_user_display(user_id: int) -> str:
-        info = get_user_info(user_id)
-        if not info:
-            return f"ID {user_id}"
-        _, username, first_name, *_ = info
-        first_name = (first_name or "").strip()
-        username = (username or "").strip()
-        if first_name and username:
-            return f"{first_name} (@{username})"
-        if first_name:
-            return first_name
-        if username:
-            return f"@{username}"
-        return f"ID {user_id}"
-
-    async def _notify_friends_about_completion(user_id: int, challenge_title: str, points: int | None):
-        friend_ids = get_friend_ids(user_id)
-        if not friend_ids:
-            return
-        friend_message = (
-            f"🎉 Ваш друг <b>{escape(_format_user_display(user_id))}</b> выполнил задание "
-            f"<b>{escape(challenge_title)}</b>."
+        last_event_id = request.headers.get("Last-Event-ID")
+        return StreamingResponse(
+            report_event_hub.stream(int(last_event_id) if last_event_id and last_event_id.isdigit() else None),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
         )
-        if points:
-            friend_message += f"\n🏅 Он заработал {points} баллов."
-        for friend_id in friend_ids:
-            if friend_id == user_id:
-                continue
-            await _notify_user(friend_id, friend_message)
 
     def _get_challenge_points_value(challenge_id: str) -> int:
-        details = get_challenge(challenge_id)
-        if details and isinstance(details.get("points_value"), int):
-            return int(details["points_value"])
-        if details and isinstance(details.get("points"), int):
-            return int(details["points"])
-        for item in fetch_custom_challenges(active_only=False):
-            if item["challenge_id"] == challenge_id:
-                try:
-                    return int(item["points"])
-                except (TypeError, ValueError):
-                    return 0
-        return 0
+        # Отключённые челленджи в каталоге не видны, но отчёты по ним ещё проверяют
+        details = get_challenge(challenge_id) or get_custom_challenge(challenge_id)
+        return int(details["points"]) if details else 0
+
+    def _review_values(items: list[ReportActionRequest]) -> list[dict]:
+        """Баллы, CO₂ и название задания для решений (по одному поиску на челлендж)."""
+        catalog: dict[str, tuple[dict | None, int]] = {}
+        values = []
+        for item in items:
+            if item.challenge_id not in catalog:
+                catalog[item.challenge_id] = (
+                    get_challenge(item.challenge_id),
+                    _get_challenge_points_value(item.challenge_id),
+                )
+            challenge, points = catalog[item.challenge_id]
+            co2_amount = item.co2_saved
+            if co2_amount is None and challenge:
+                co2_amount = challenge.get("co2_kg")
+            review = {
+                "user_id": item.user_id,
+                "challenge_id": item.challenge_id,
+                "review_status": item.decision,
+                "review_comment": item.comment,
+                "awarded_points": points if item.decision == "approved" else None,
+                "co2_saved": co2_amount,
+                "challenge_title": challenge["title"] if challenge else item.challenge_id,
+            }
+            review["notifications"] = _resolution_notifications(review)
+            values.append(review)
+        return values
+
+    def _resolution_notifications(review: dict) -> list[tuple]:
+        """Уведомления по решению: автору отчёта и (при одобрении) его друзьям."""
+        decision = review["review_status"]
+        points_value = review["awarded_points"]
+        decision_text = "одобрен" if decision == "approved" else "отклонён"
+        text = (
+            f"📄 Отчёт по заданию <b>{review['challenge_title']}</b> {decision_text}."
+        )
+        if decision == "approved" and points_value:
+            text += f"\n🏅 Начислено баллов: {points_value}"
+        if review["review_comment"]:
+            text += f"\n💬 Комментарий модератора: {review['review_comment']}"
+        if decision == "rejected":
+            text += "\n🔁 Задание снова доступно для принятия."
+        notifications = [user_message(review["user_id"], text)]
+        if decision == "approved":
+            notifications.append(
+                friend_completion(review["user_id"], review["challenge_title"], points_value)
+            )
+        return notifications
 
     @api_router.post("/reports/resolve")
     async def resolve_report(
         payload: ReportActionRequest,
         admin_id: int = Depends(current_admin),
     ):
-        decision = payload.decision
-        points_value = _get_challenge_points_value(payload.challenge_id) if decision == "approved" else None
-        challenge = get_challenge(payload.challenge_id)
-        co2_amount = payload.co2_saved
-        if co2_amount is None and challenge:
-            co2_amount = parse_co2_value(challenge.get("co2"))
-        updated = update_report_review(
-            payload.user_id,
-            payload.challenge_id,
-            decision,
-            payload.comment,
-            points_value,
-            co2_amount,
-        )
+        reviews = await db.run(_review_values, [payload])
+        # Решение, запись в журнал и уведомления — одна транзакция
+        (updated,) = await db.resolve_reports_batch(admin_id, reviews)
         if not updated:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Отчёт не найден или уже обработан.",
             )
-        challenge_title = challenge["title"] if challenge else payload.challenge_id
-        decision_text = "одобрен" if decision == "approved" else "отклонён"
-        log_admin_action(
-            admin_id,
-            "resolve_report",
-            f"{payload.user_id}:{payload.challenge_id}:{decision}",
-        )
-        user_message = (
-            f"📄 Отчёт по заданию <b>{challenge_title}</b> {decision_text}."
-        )
-        if decision == "approved" and points_value:
-            user_message += f"\n🏅 Начислено баллов: {points_value}"
-        if payload.comment:
-            user_message += f"\n💬 Комментарий модератора: {payload.comment}"
-        if decision == "rejected":
-            user_message += "\n🔁 Задание снова доступно для принятия."
-        await _notify_user(payload.user_id, user_message)
-        if decision == "approved":
-            await _notify_friends_about_completion(
-                payload.user_id,
-                challenge_title,
-                points_value,
-            )
+        notification_worker.wake()
         return {"status": "ok"}
 
+    @api_router.post("/reports/resolve-batch", response_model=ReportBatchResponse)
+    async def resolve_reports_batch(
+        payload: ReportBatchRequest,
+        admin_id: int = Depends(current_admin),
+    ):
+        seen: set[tuple[int, str]] = set()
+        unique: list[ReportActionRequest] = []
+        duplicates: set[int] = set()
+        for index, item in enumerate(payload.items):
+            key = (item.user_id, item.challenge_id)
+            if key in seen:
+                duplicates.add(index)
+            else:
+                seen.add(key)
+                unique.append(item)
+
+        reviews = await db.run(_review_values, unique)
+        applied = await db.resolve_reports_batch(admin_id, reviews)
+
+        resolved = sum(applied)
+        if resolved:
+            notification_worker.wake()
+
+        applied_iter = iter(applied)
+        results = []
+        for index, item in enumerate(payload.items):
+            if index in duplicates:
+                item_status = "duplicate"
+            else:
+                item_status = "ok" if next(applied_iter) else "not_found"
+            results.append(
+                ReportBatchItemResult(
+                    user_id=item.user_id,
+                    challenge_id=item.challenge_id,
+                    decision=item.decision,
+                    status=item_status,
+                )
+            )
+        return ReportBatchResponse(
+            resolved=resolved,
+            failed=len(results) - resolved,
+            results=results,
+        )
+
     @api_router.get("/logs", response_model=list[AdminLogEntry])
     async def admin_logs(_: int = Depends(current_admin)):
-        logs = get_admin_logs(limit=None)
+        logs = await db.get_admin_logs(limit=None)
         return [
             AdminLogEntry(
                 id=entry["id"],
@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from pydantic import BaseModel, Field, field_validator
+from pydantic import BaseModel, Field, field_validator, model_validator
 
 
 class LoginRequest(BaseModel):
@@ -17,13 +17,35 @@ class BroadcastRequest(BaseModel):
     message: str = Field(..., min_length=1, max_length=4096)
 
 
+class BroadcastJobResponse(BaseModel):
+    id: int
+    status: str
+    total: int
+    sent: int
+    failed: int
+    remaining: int
+    throughput: float | None = Field(None, description="Получателей в секунду")
+    created_at: str
+    started_at: str | None = None
+    finished_at: str | None = None
+
+
 class ChallengeCreateRequest(BaseModel):
     title: str = Field(..., min_length=3, max_length=120)
     description: str = Field(..., min_length=4, max_length=1024)
     points: int = Field(..., ge=1, le=500)
-    co2: str = Field(..., min_length=1, max_length=64)
+    co2: str | None = Field(None, max_length=64, description="Подпись для пользователей; по умолчанию строится из co2_kg")
+    co2_kg: float | None = Field(None, ge=0, description="Экономия CO₂ в кг; по умолчанию берётся из co2")
     co2_quantity_based: bool = Field(False, description="CO₂ зависит от количества")
 
+    @model_validator(mode="after")
+    def require_co2(self):
+        if self.co2:
+            self.co2 = self.co2.strip() or None
+        if not self.co2 and self.co2_kg is None:
+            raise ValueError("Укажите подпись CO₂ или значение co2_kg")
+        return self
+
 
 class ChallengeUpdateRequest(BaseModel):
     active: bool
@@ -35,6 +57,7 @@ class ChallengeResponse(BaseModel):
     description: str
     points: int
     co2: str
+    co2_kg: float | None = None
     source: str
     active: bool = True
     co2_quantity_based: bool = False
@@ -48,6 +71,23 @@ class ReportActionRequest(BaseModel):
     co2_saved: float | None = Field(None, ge=0)
 
 
+class ReportBatchRequest(BaseModel):
+    items: list[ReportActionRequest] = Field(..., min_length=1, max_length=500)
+
+
+class ReportBatchItemResult(BaseModel):
+    user_id: int
+    challenge_id: str
+    decision: str
+    status: str = Field(..., description="ok, not_found или duplicate")
+
+
+class ReportBatchResponse(BaseModel):
+    resolved: int
+    failed: int
+    results: list[ReportBatchItemResult]
+
+
 class ReportResponse(BaseModel):
     user_id: int
     username: str | None
@@ -65,6 +105,28 @@ class ReportResponse(BaseModel):
     co2_quantity_based: bool = False
 
 
+class LeaderboardEntry(BaseModel):
+    rank: int
+    user_id: int
+    username: str | None
+    first_name: str | None
+    points: int
+
+
+class LeaderboardRank(BaseModel):
+    user_id: int
+    rank: int
+    points: int
+    participants: int
+
+
+class LeaderboardResponse(BaseModel):
+    period: str
+    week_start: str | None
+    entries: list[LeaderboardEntry]
+    user_rank: LeaderboardRank | None = None
+
+
 class AdminLogEntry(BaseModel):
     id: int
     admin_id: int | None
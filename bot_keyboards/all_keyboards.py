@@ -128,7 +128,7 @@ def get_admin_panel_keyboard(url: str):
     )
 
 
-def get_friend_actions_keyboard(has_friends: bool):
+def get_friend_actions_keyboard(has_friends: bool, friend_digest: bool = False):
     """Кнопки действий в разделе друзей."""
     inline_keyboard = [
         [InlineKeyboardButton(text="➕ Добавить друга", callback_data="friends:add")],
@@ -140,9 +140,34 @@ def get_friend_actions_keyboard(has_friends: bool):
     inline_keyboard.append(
         [InlineKeyboardButton(text="🔁 Обновить рейтинг", callback_data="friends:refresh")]
     )
+    inline_keyboard.append(
+        [InlineKeyboardButton(text="🌍 Общий рейтинг", callback_data="leaderboard:weekly")]
+    )
+    digest_toggle = (
+        InlineKeyboardButton(text="🔔 Успехи друзей: сразу", callback_data="friends:digest:off")
+        if friend_digest
+        else InlineKeyboardButton(text="📬 Успехи друзей: сводкой", callback_data="friends:digest:on")
+    )
+    inline_keyboard.append([digest_toggle])
     return InlineKeyboardMarkup(inline_keyboard=inline_keyboard)
 
 
+def get_global_leaderboard_keyboard(period: str):
+    """Переключение периода общего рейтинга и возврат к друзьям."""
+    toggle = (
+        InlineKeyboardButton(text="🏆 За всё время", callback_data="leaderboard:all")
+        if period == "weekly"
+        else InlineKeyboardButton(text="📆 За неделю", callback_data="leaderboard:weekly")
+    )
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [toggle],
+            [InlineKeyboardButton(text="🔁 Обновить", callback_data=f"leaderboard:{period}")],
+            [InlineKeyboardButton(text="⬅️ К рейтингу друзей", callback_data="friends:refresh")],
+        ]
+    )
+
+
 def get_friend_confirmation_keyboard(friend_id: int):
     """Клавиатура подтверждения добавления друга."""
     return InlineKeyboardMarkup(
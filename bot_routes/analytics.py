@@ -1,32 +1,20 @@
-from datetime import datetime, timedelta
 from html import escape
 from typing import Any
 
 from aiogram import F, Router
 from aiogram.filters import Command
-from aiogram.types import CallbackQuery, FSInputFile, Message
+from aiogram.types import CallbackQuery, Message
 
 from settings.admins import has_admin_panel, is_admin
-from settings.challenges import get_all_challenges, get_challenge
+from settings.challenges import format_points, get_all_challenges, get_challenge
+import database_aio as db
 from database import (
-    accept_challenge,
-    add_friend,
-    create_friend_request,
-    decline_challenge,
-    find_user_by_username,
-    get_accepted_challenges,
-    get_friend_ids,
-    get_friend_request,
-    get_friends,
-    get_reviewed_challenges,
-    get_submitted_challenges,
-    get_user_challenge_statuses,
-    get_user_awarded_points,
-    get_user_review_summary,
-    get_users_by_ids,
-    mark_challenge_submitted,
-    remove_friend,
-    update_friend_request_status,
+    GLOBAL_LEADERBOARD_PERIODS,
+    get_friends_leaderboard,
+    get_global_leaderboard,
+    get_global_rank,
+    get_leaderboard_version,
+    get_week_start_msk,
 )
 from bot_keyboards.all_keyboards import (
     get_back_button,
@@ -36,109 +24,25 @@ from bot_keyboards.all_keyboards import (
     get_friend_confirmation_keyboard,
     get_friend_remove_keyboard,
     get_friend_request_keyboard,
+    get_global_leaderboard_keyboard,
     get_main_menu,
     get_report_challenges_keyboard,
     get_report_confirmation_keyboard,
     get_tasks_keyboard,
 )
 from support_tools.admin_panel import send_admin_panel_prompt
-from support_tools.co2 import parse_co2_value
+from support_tools.assets import asset_registry
+from support_tools.co2 import format_co2_amount
+from support_tools.leaderboard_cache import friends_leaderboard_cache
+from support_tools.send_queue import send_queue
+from support_tools.state_store import state_store
 
 router = Router()
 
-# Временное хранилище выбранных заданий для отчёта
-pending_reports: dict[int, str] = {}
-# Временное хранилище данных отправленного файла до подтверждения
-pending_report_payloads: dict[int, tuple[str, str | None, str, str | None]] = {}
-# Временное состояние диалогов в разделе друзей
-friend_states: dict[int, dict[str, Any]] = {}
-
-
-def _get_week_start_msk() -> datetime:
-    now_msk = datetime.utcnow() + timedelta(hours=3)
-    start_date = now_msk.date() - timedelta(days=now_msk.weekday())
-    start_dt = datetime.combine(start_date, datetime.min.time()) + timedelta(minutes=1)
-    if now_msk < start_dt:
-        start_dt -= timedelta(days=7)
-    return start_dt
-
-
-def _resolve_points_value(
-    challenge_id: str,
-    stored_points: int | None,
-    challenges_cache: dict[str, dict],
-) -> int:
-    if stored_points is not None:
-        try:
-            return int(stored_points)
-        except (TypeError, ValueError):
-            return 0
-    details = challenges_cache.get(challenge_id) or get_challenge(challenge_id)
-    if not details:
-        return 0
-    value = details.get("points_value")
-    if isinstance(value, int):
-        return value
-    points_field = details.get("points")
-    if isinstance(points_field, int):
-        return points_field
-    if isinstance(points_field, str):
-        digits = "".join(ch for ch in points_field if ch.isdigit())
-        if digits:
-            try:
-                return int(digits)
-            except ValueError:
-                return 0
-    return 0
-
-
-def _resolve_co2_value(
-    challenge_id: str,
-    stored_value: float | None,
-    challenges_cache: dict[str, dict],
-) -> float:
-    if stored_value is not None:
-        try:
-            return float(stored_value)
-        except (TypeError, ValueError):
-            return 0.0
-    details = challenges_cache.get(challenge_id) or get_challenge(challenge_id)
-    if not details:
-        return 0.0
-    parsed = parse_co2_value(details.get("co2"))
-    if parsed is None:
-        return 0.0
-    return parsed
-
-
-def _calculate_user_progress(user_id: int, challenges_cache: dict[str, dict]) -> tuple[int, int, float]:
-    awarded = get_user_awarded_points(user_id)
-    week_start = _get_week_start_msk()
-    total_points = 0
-    weekly_points = 0
-    total_co2 = 0.0
-    for challenge_id, points_value, reviewed_at, stored_co2 in awarded:
-        points = _resolve_points_value(challenge_id, points_value, challenges_cache)
-        co2_value = _resolve_co2_value(challenge_id, stored_co2, challenges_cache)
-        total_points += points
-        total_co2 += co2_value
-        if reviewed_at:
-            try:
-                reviewed_dt = datetime.strptime(reviewed_at, '%Y-%m-%d %H:%M:%S')
-            except ValueError:
-                reviewed_dt = None
-            if reviewed_dt and reviewed_dt >= week_start:
-                weekly_points += points
-    return total_points, weekly_points, total_co2
-
-
-def _format_co2_total(value: float) -> str:
-    if value <= 0:
-        return "0"
-    formatted = f"{value:.2f}"
-    if "." in formatted:
-        formatted = formatted.rstrip("0").rstrip(".")
-    return formatted
+# Состояние отчёта: {"challenge_id": ..., "payload": None или данные файла до подтверждения}
+REPORT_STATE = "report"
+# Состояние диалогов в разделе друзей: {"stage": ..., ...}
+FRIEND_STATE = "friend"
 
 
 def _build_display_label(record: dict[str, Any] | None, fallback_id: int) -> str:
@@ -177,65 +81,95 @@ def _render_leaderboard_section(
     return f"{title}\n" + "\n".join(lines)
 
 
-def _build_friends_panel(user_id: int) -> tuple[str, bool]:
-    friends = get_friends(user_id)
-    participants = [user_id] + [friend["user_id"] for friend in friends]
-    challenges_cache = get_all_challenges()
-    users_map = get_users_by_ids(participants)
-    entries: list[dict[str, Any]] = []
-    for participant_id in participants:
-        total_points, weekly_points, _ = _calculate_user_progress(participant_id, challenges_cache)
-        label = _build_display_label(users_map.get(participant_id), participant_id)
-        entries.append(
-            {
-                "user_id": participant_id,
-                "label": label,
-                "weekly": weekly_points,
-                "total": total_points,
-            }
-        )
+def _render_friends_panel(user_id: int, week_start: str | None = None) -> tuple[str, bool]:
+    rows = get_friends_leaderboard(user_id, week_start)
+    friends_count = len(rows) - 1
+    entries: list[dict[str, Any]] = [
+        {
+            "user_id": row["user_id"],
+            "label": _build_display_label(row, row["user_id"]),
+            "weekly": row["weekly"],
+            "total": row["total"],
+        }
+        for row in rows
+    ]
 
     weekly_block = _render_leaderboard_section(entries, user_id, "weekly", "📆 <b>Баллы за неделю</b>")
     total_block = _render_leaderboard_section(entries, user_id, "total", "🏆 <b>Баллы за всё время</b>")
     hint = (
         "\n\nДобавьте друзей, чтобы сравнивать прогресс!"
-        if not friends
+        if not friends_count
         else ""
     )
     content = (
         "🏅 <b>Рейтинг между друзьями</b>\n"
-        f"Друзей: {len(friends)}\n\n"
+        f"Друзей: {friends_count}\n\n"
         f"{weekly_block}\n\n{total_block}{hint}"
     )
-    return content, bool(friends)
+    return content, bool(friends_count)
 
 
-def _friends_panel_payload(user_id: int):
-    text, has_friends = _build_friends_panel(user_id)
-    keyboard = get_friend_actions_keyboard(has_friends)
+def _build_friends_panel(user_id: int) -> tuple[str, bool]:
+    """Панель рейтинга друзей из кэша; перестраивается при смене версии данных или недели."""
+    week_start = get_week_start_msk()
+    key = (get_leaderboard_version(user_id), week_start)
+    cached = friends_leaderboard_cache.get(user_id, key)
+    if cached is not None:
+        return cached
+    panel = _render_friends_panel(user_id, week_start)
+    friends_leaderboard_cache.put(user_id, key, panel)
+    return panel
+
+
+async def _friends_panel_payload(user_id: int):
+    text, has_friends = await db.run(_build_friends_panel, user_id)
+    keyboard = get_friend_actions_keyboard(has_friends, await db.get_friend_digest(user_id))
     return text, keyboard
 
 
-def _get_user_label(user_id: int) -> str:
+# Сколько строк общего рейтинга помещаем в сообщение бота (полный топ — в админке)
+GLOBAL_LEADERBOARD_BOT_LIMIT = 20
+
+
+def _build_global_leaderboard(user_id: int, period: str) -> str:
+    week_start = get_week_start_msk()
+    top = get_global_leaderboard(period, GLOBAL_LEADERBOARD_BOT_LIMIT, week_start)
+    own = get_global_rank(user_id, period, week_start)
+    title = (
+        "📆 <b>Общий рейтинг за неделю</b>"
+        if period == "weekly"
+        else "🏆 <b>Общий рейтинг за всё время</b>"
+    )
+    lines = [
+        f"{entry['rank']}. {escape(_build_display_label(entry, entry['user_id']))} — {entry['points']}"
+        + (" <i>(это ты)</i>" if entry["user_id"] == user_id else "")
+        for entry in top
+    ]
+    body = "\n".join(lines) if lines else "Пока никто не набрал баллов."
+    if own["points"]:
+        footer = f"Твоё место: {own['rank']} из {own['participants']} ({own['points']} баллов)"
+    else:
+        footer = "Ты пока не в рейтинге — выполни задание, чтобы набрать баллы!"
+    return f"{title}\n\n{body}\n\n{footer}"
+
+
+async def _get_user_label(user_id: int) -> str:
     """Получить отображаемое имя пользователя."""
-    record = get_users_by_ids([user_id]).get(user_id)
+    record = (await db.get_users_by_ids([user_id])).get(user_id)
     return _build_display_label(record, user_id)
 
 
-async def _send_friend_request_prompt(bot, target_id: int, requester_label: str, request_id: int):
+def _send_friend_request_prompt(target_id: int, requester_label: str, request_id: int):
     """Отправить уведомление о новой заявке в друзья."""
     text = (
         f"🤝 <b>{escape(requester_label)}</b> хочет добавить вас в друзья.\n"
         "Примите или отклоните запрос ниже."
     )
-    try:
-        await bot.send_message(
-            target_id,
-            text,
-            reply_markup=get_friend_request_keyboard(request_id),
-        )
-    except Exception:
-        pass
+    send_queue.enqueue(
+        target_id,
+        text,
+        reply_markup=get_friend_request_keyboard(request_id),
+    )
 
 
 @router.message(Command("admin"))
@@ -264,20 +198,21 @@ async def back_to_menu(message: Message):
 async def show_tasks(message: Message):
     """Показать список доступных заданий."""
     user_id = message.from_user.id
-    challenges = get_all_challenges()
-    statuses = get_user_challenge_statuses(user_id)
+    challenges = await db.run(get_all_challenges)
+    statuses = await db.get_user_challenge_statuses(user_id)
 
     available: list[tuple[str, str]] = []
     for challenge_id, data in challenges.items():
         if statuses.get(challenge_id) is None:
-            available.append((challenge_id, f"{data['title']} ({data['points']})"))
+            available.append((challenge_id, f"{data['title']} ({format_points(data['points'])})"))
 
     accepted = [cid for cid, status in statuses.items() if status == "accepted"]
     submitted = [cid for cid, status in statuses.items() if status == "submitted"]
 
     if available:
-        await message.answer_photo(
-            photo=FSInputFile("assets/tasks_banner.jpg"),
+        await asset_registry.answer_photo(
+            message,
+            "assets/tasks_banner.jpg",
             caption=(
                 "📋 <b>Доступные задания:</b>\n\n"
                 "Выбери задание, чтобы узнать подробности и начать челлендж."
@@ -312,13 +247,13 @@ async def show_tasks(message: Message):
 async def task_details(callback: CallbackQuery):
     """Показать детали выбранного задания."""
     challenge_id = callback.data.split(":", maxsplit=1)[1]
-    challenge = get_challenge(challenge_id)
+    challenge = await db.run(get_challenge, challenge_id)
 
     if not challenge:
         await callback.answer("Задание не найдено", show_alert=True)
         return
 
-    statuses = get_user_challenge_statuses(callback.from_user.id)
+    statuses = await db.get_user_challenge_statuses(callback.from_user.id)
     if statuses.get(challenge_id) is not None:
         await callback.answer("Это задание тебе уже недоступно.", show_alert=True)
         return
@@ -332,7 +267,7 @@ async def task_details(callback: CallbackQuery):
     await callback.message.answer(
         f"<b>{challenge['title']}</b>\n\n"
         f"📝 <b>Описание:</b>\n{challenge['description']}\n\n"
-        f"🏆 <b>Награда:</b> {challenge['points']}\n"
+        f"🏆 <b>Награда:</b> {format_points(challenge['points'])}\n"
         f"🌍 <b>Экономия CO₂:</b> {challenge['co2']}{extra_note}\n\n"
         f"Если готов — принимай задание и выполняй!",
         reply_markup=get_challenge_actions_keyboard(challenge_id),
@@ -345,13 +280,13 @@ async def accept_task(callback: CallbackQuery):
     """Обработка принятия задания."""
     challenge_id = callback.data.split(":", maxsplit=1)[1]
     user_id = callback.from_user.id
-    challenge = get_challenge(challenge_id)
+    challenge = await db.run(get_challenge, challenge_id)
 
     if not challenge:
         await callback.answer("Задание не найдено", show_alert=True)
         return
 
-    accepted = accept_challenge(user_id, challenge_id)
+    accepted = await db.accept_challenge(user_id, challenge_id)
     await callback.message.edit_reply_markup(reply_markup=None)
 
     if not accepted:
@@ -373,10 +308,10 @@ async def decline_task(callback: CallbackQuery):
     challenge_id = callback.data.split(":", maxsplit=1)[1]
     await callback.message.edit_reply_markup(reply_markup=None)
     user_id = callback.from_user.id
-    decline_challenge(user_id, challenge_id)
-    if pending_reports.get(user_id) == challenge_id:
-        pending_reports.pop(user_id, None)
-        pending_report_payloads.pop(user_id, None)
+    await db.decline_challenge(user_id, challenge_id)
+    report_state = await state_store.get(REPORT_STATE, user_id)
+    if report_state and report_state["challenge_id"] == challenge_id:
+        await state_store.pop(REPORT_STATE, user_id)
     await callback.message.answer(
         "Окей, выбери другое задание, когда будешь готов.",
         reply_markup=get_back_button(),
@@ -388,26 +323,24 @@ async def decline_task(callback: CallbackQuery):
 async def show_report_menu(message: Message):
     """Показать задания, по которым ждём отчёты."""
     user_id = message.from_user.id
-    accepted_challenges = get_accepted_challenges(user_id)
+    accepted_challenges = await db.get_accepted_challenges(user_id)
 
     if not accepted_challenges:
-        pending_reports.pop(user_id, None)
-        pending_report_payloads.pop(user_id, None)
+        await state_store.pop(REPORT_STATE, user_id)
         await message.answer(
             "Вы пока не приняли ни одного задания.",
             reply_markup=get_main_menu(),
         )
         return
 
-    challenges = get_all_challenges()
+    challenges = await db.run(get_all_challenges)
     keyboard_items = [
         (challenge_id, challenges[challenge_id]["title"])
         for challenge_id in accepted_challenges
         if challenge_id in challenges
     ]
 
-    pending_reports.pop(user_id, None)
-    pending_report_payloads.pop(user_id, None)
+    await state_store.pop(REPORT_STATE, user_id)
     await message.answer(
         "📮 <b>Ниже задания, которые вы приняли.</b>\n"
         "Выберите челлендж, чтобы отправить отчёт.",
@@ -420,19 +353,18 @@ async def request_report(callback: CallbackQuery):
     """Запросить отчёт по выбранному заданию."""
     user_id = callback.from_user.id
     challenge_id = callback.data.split(":", maxsplit=1)[1]
-    challenge = get_challenge(challenge_id)
+    challenge = await db.run(get_challenge, challenge_id)
 
     if not challenge:
         await callback.answer("Задание не найдено", show_alert=True)
         return
 
-    accepted_challenges = get_accepted_challenges(user_id)
+    accepted_challenges = await db.get_accepted_challenges(user_id)
     if challenge_id not in accepted_challenges:
         await callback.answer("Сначала прими это задание.", show_alert=True)
         return
 
-    pending_reports[user_id] = challenge_id
-    pending_report_payloads.pop(user_id, None)
+    await state_store.set(REPORT_STATE, user_id, {"challenge_id": challenge_id, "payload": None})
     extra_hint = ""
     if challenge.get("co2_quantity_based"):
         extra_hint = "\nНе забудьте указать фактическое количество (кг) в описании отчёта."
@@ -450,7 +382,8 @@ async def request_report(callback: CallbackQuery):
 async def handle_photo_report(message: Message):
     """Обработать фото-отчёт от пользователя."""
     user_id = message.from_user.id
-    challenge_id = pending_reports.get(user_id)
+    report_state = await state_store.get(REPORT_STATE, user_id)
+    challenge_id = report_state["challenge_id"] if report_state else None
     if not challenge_id:
         await message.answer(
             "Чтобы отправить отчёт, выберите задание во вкладке 📮 Отчёт.",
@@ -458,10 +391,22 @@ async def handle_photo_report(message: Message):
         )
         return
 
-    challenge = get_challenge(challenge_id)
+    challenge = await db.run(get_challenge, challenge_id)
     photo_file_id = message.photo[-1].file_id
     caption = message.caption if message.caption else None
-    pending_report_payloads[user_id] = (photo_file_id, caption, "photo", None)
+    await state_store.set(
+        REPORT_STATE,
+        user_id,
+        {
+            "challenge_id": challenge_id,
+            "payload": {
+                "file_id": photo_file_id,
+                "caption": caption,
+                "attachment_type": "photo",
+                "attachment_name": None,
+            },
+        },
+    )
 
     title_text = escape(challenge["title"]) if challenge else escape(challenge_id)
     if caption:
@@ -486,7 +431,8 @@ async def handle_photo_report(message: Message):
 async def handle_document_report(message: Message):
     """Обработать документ-отчёт от пользователя."""
     user_id = message.from_user.id
-    challenge_id = pending_reports.get(user_id)
+    report_state = await state_store.get(REPORT_STATE, user_id)
+    challenge_id = report_state["challenge_id"] if report_state else None
     if not challenge_id:
         await message.answer(
             "Чтобы отправить отчёт, выберите задание во вкладке 📮 Отчёт.",
@@ -494,11 +440,23 @@ async def handle_document_report(message: Message):
         )
         return
 
-    challenge = get_challenge(challenge_id)
+    challenge = await db.run(get_challenge, challenge_id)
     document_file_id = message.document.file_id
     document_name = message.document.file_name or "Файл"
     caption = message.caption if message.caption else None
-    pending_report_payloads[user_id] = (document_file_id, caption, "document", document_name)
+    await state_store.set(
+        REPORT_STATE,
+        user_id,
+        {
+            "challenge_id": challenge_id,
+            "payload": {
+                "file_id": document_file_id,
+                "caption": caption,
+                "attachment_type": "document",
+                "attachment_name": document_name,
+            },
+        },
+    )
 
     title_text = escape(challenge["title"]) if challenge else escape(challenge_id)
     if caption:
@@ -523,31 +481,30 @@ async def handle_document_report(message: Message):
 async def confirm_report(callback: CallbackQuery):
     """Подтвердить отправку отчёта."""
     user_id = callback.from_user.id
-    payload = pending_report_payloads.get(user_id)
-    challenge_id = pending_reports.get(user_id)
+    report_state = await state_store.get(REPORT_STATE, user_id)
+    challenge_id = report_state["challenge_id"] if report_state else None
+    payload = report_state["payload"] if report_state else None
 
     if not challenge_id or not payload:
         await callback.answer("Нет отчёта для подтверждения.", show_alert=True)
         return
 
-    file_id, caption, attachment_type, attachment_name = payload
-    submitted = mark_challenge_submitted(
+    submitted = await db.mark_challenge_submitted(
         user_id,
         challenge_id,
-        file_id,
-        caption,
-        attachment_type,
-        attachment_name,
+        payload["file_id"],
+        payload["caption"],
+        payload["attachment_type"],
+        payload["attachment_name"],
     )
     if not submitted:
         await callback.answer("Не удалось сохранить отчёт. Попробуй отправить снова.", show_alert=True)
         return
 
-    pending_reports.pop(user_id, None)
-    pending_report_payloads.pop(user_id, None)
+    await state_store.pop(REPORT_STATE, user_id)
     await callback.message.edit_reply_markup(reply_markup=None)
 
-    challenge = get_challenge(challenge_id)
+    challenge = await db.run(get_challenge, challenge_id)
     title_display = challenge["title"] if challenge else challenge_id
     await callback.message.answer(
         "✅ <b>Отчёт отправлен!</b>\n\n"
@@ -562,13 +519,14 @@ async def confirm_report(callback: CallbackQuery):
 async def edit_report(callback: CallbackQuery):
     """Вернуться к повторной отправке отчёта."""
     user_id = callback.from_user.id
-    challenge_id = pending_reports.get(user_id)
+    report_state = await state_store.get(REPORT_STATE, user_id)
+    challenge_id = report_state["challenge_id"] if report_state else None
     if not challenge_id:
         await callback.answer("Сначала выбери задание во вкладке 📮 Отчёт.", show_alert=True)
         return
 
-    challenge = get_challenge(challenge_id)
-    pending_report_payloads.pop(user_id, None)
+    challenge = await db.run(get_challenge, challenge_id)
+    await state_store.set(REPORT_STATE, user_id, {"challenge_id": challenge_id, "payload": None})
     await callback.message.edit_reply_markup(reply_markup=None)
     await callback.message.answer(
         f"📸 Отправьте отчёт по заданию <b>{challenge['title']}</b>.\n"
@@ -582,16 +540,17 @@ async def edit_report(callback: CallbackQuery):
 async def show_progress(message: Message):
     """Показать прогресс пользователя."""
     user_id = message.from_user.id
-    accepted = get_accepted_challenges(user_id)
-    pending_submissions = get_submitted_challenges(user_id, only_pending=True)
-    summary = get_user_review_summary(user_id)
-    approved_count = summary.get('approved', 0)
-    rejected_count = summary.get('rejected', 0)
-    pending_count = summary.get('pending', len(pending_submissions))
-
-    challenges = get_all_challenges()
-    total_points, weekly_points, total_co2 = _calculate_user_progress(user_id, challenges)
-    co2_display = _format_co2_total(total_co2)
+    accepted = await db.get_accepted_challenges(user_id)
+    pending_submissions = await db.get_submitted_challenges(user_id, only_pending=True)
+    stats = await db.get_user_stats(user_id)
+    approved_count = stats["approved"]
+    rejected_count = stats["rejected"]
+    pending_count = stats["pending"] or len(pending_submissions)
+    total_points = stats["total_points"]
+    weekly_points = await db.get_user_weekly_points(user_id)
+
+    challenges = await db.run(get_all_challenges)
+    co2_display = format_co2_amount(stats["total_co2"])
 
     if pending_submissions:
         pending_lines = "\n".join(
@@ -602,8 +561,9 @@ async def show_progress(message: Message):
     else:
         pending_text = "⏳ Отчёты в обработке: нет"
 
-    await message.answer_photo(
-        photo=FSInputFile("assets/progress_banner.jpg"),
+    await asset_registry.answer_photo(
+        message,
+        "assets/progress_banner.jpg",
         caption=(
             "📈 <b>Твой прогресс:</b>\n\n"
             f"📝 Принято заданий: {len(accepted)}\n"
@@ -622,7 +582,7 @@ async def show_progress(message: Message):
 async def show_friends(message: Message):
     """Показать рейтинг среди друзей."""
     user_id = message.from_user.id
-    text, keyboard = _friends_panel_payload(user_id)
+    text, keyboard = await _friends_panel_payload(user_id)
     await message.answer(text, reply_markup=keyboard)
 
 
@@ -640,8 +600,9 @@ async def show_help(message: Message):
         "<b>4. Не вижу новых заданий.</b>\n"
         "Если все текущие челленджи выполнены, дождись обновления — мы пришлём новые!"
     )
-    await message.answer_photo(
-        photo=FSInputFile("assets/help_banner.jpg"),
+    await asset_registry.answer_photo(
+        message,
+        "assets/help_banner.jpg",
         caption=help_text,
         reply_markup=get_main_menu(),
     )
@@ -651,7 +612,7 @@ async def show_help(message: Message):
 async def refresh_friends(callback: CallbackQuery):
     """Обновить показатели рейтинга."""
     user_id = callback.from_user.id
-    text, keyboard = _friends_panel_payload(user_id)
+    text, keyboard = await _friends_panel_payload(user_id)
     try:
         await callback.message.edit_text(text, reply_markup=keyboard)
     except Exception:
@@ -659,11 +620,43 @@ async def refresh_friends(callback: CallbackQuery):
     await callback.answer("Рейтинг обновлён")
 
 
+@router.callback_query(F.data.startswith("friends:digest:"))
+async def toggle_friend_digest(callback: CallbackQuery):
+    """Переключить уведомления о заданиях друзей: сразу или сводкой."""
+    user_id = callback.from_user.id
+    enabled = callback.data.split(":")[-1] == "on"
+    await db.set_friend_digest(user_id, enabled)
+    text, keyboard = await _friends_panel_payload(user_id)
+    try:
+        await callback.message.edit_text(text, reply_markup=keyboard)
+    except Exception:
+        await callback.message.answer(text, reply_markup=keyboard)
+    await callback.answer(
+        "Успехи друзей будут приходить одной сводкой" if enabled else "Успехи друзей будут приходить сразу"
+    )
+
+
+@router.callback_query(F.data.startswith("leaderboard:"))
+async def show_global_leaderboard(callback: CallbackQuery):
+    """Показать общий рейтинг всех участников и место пользователя."""
+    period = callback.data.split(":", 1)[1]
+    if period not in GLOBAL_LEADERBOARD_PERIODS:
+        await callback.answer()
+        return
+    text = await db.run(_build_global_leaderboard, callback.from_user.id, period)
+    keyboard = get_global_leaderboard_keyboard(period)
+    try:
+        await callback.message.edit_text(text, reply_markup=keyboard)
+    except Exception:
+        await callback.message.answer(text, reply_markup=keyboard)
+    await callback.answer()
+
+
 @router.callback_query(F.data == "friends:add")
 async def prompt_friend_username(callback: CallbackQuery):
     """Запросить username друга."""
     user_id = callback.from_user.id
-    friend_states[user_id] = {"stage": "await_username"}
+    await state_store.set(FRIEND_STATE, user_id, {"stage": "await_username"})
     await callback.message.answer(
         "Введите username друга (без @). Отправьте «отмена», чтобы прервать.",
         reply_markup=get_friend_cancel_keyboard(),
@@ -675,7 +668,7 @@ async def prompt_friend_username(callback: CallbackQuery):
 async def prompt_friend_removal(callback: CallbackQuery):
     """Показать список друзей для удаления."""
     user_id = callback.from_user.id
-    friends = get_friends(user_id)
+    friends = await db.get_friends(user_id)
     if not friends:
         await callback.answer("Список друзей пуст.", show_alert=True)
         return
@@ -699,13 +692,13 @@ async def remove_friend_callback(callback: CallbackQuery):
     except ValueError:
         await callback.answer("Некорректный выбор.", show_alert=True)
         return
-    removed = remove_friend(user_id, friend_id)
+    removed = await db.remove_friend(user_id, friend_id)
     response_text = "Друг удалён." if removed else "Этого пользователя уже нет в списке друзей."
     try:
         await callback.message.edit_text(response_text, reply_markup=None)
     except Exception:
         await callback.message.answer(response_text)
-    text, keyboard = _friends_panel_payload(user_id)
+    text, keyboard = await _friends_panel_payload(user_id)
     await callback.message.answer(text, reply_markup=keyboard)
     await callback.answer()
 
@@ -719,11 +712,11 @@ async def confirm_friend_add(callback: CallbackQuery):
     except ValueError:
         await callback.answer("Некорректный пользователь.", show_alert=True)
         return
-    state = friend_states.get(user_id)
+    state = await state_store.get(FRIEND_STATE, user_id)
     if not state or state.get("friend_id") != friend_id:
         await callback.answer("Нет кандидата для добавления.", show_alert=True)
         return
-    friend_states.pop(user_id, None)
+    await state_store.pop(FRIEND_STATE, user_id)
     friend_record = state.get("friend_record") or {"user_id": friend_id}
     friend_label = _build_display_label(friend_record, friend_id)
     requester_label = _build_display_label(
@@ -733,7 +726,7 @@ async def confirm_friend_add(callback: CallbackQuery):
         },
         user_id,
     )
-    result = create_friend_request(user_id, friend_id)
+    result = await db.create_friend_request(user_id, friend_id)
     status = result.get("status")
 
     if status == "self":
@@ -748,19 +741,16 @@ async def confirm_friend_add(callback: CallbackQuery):
     elif status == "auto_accepted":
         response_text = f"{escape(friend_label)} уже оставил заявку — дружба подтверждена."
         alert_text = "Заявка совпала"
-        try:
-            await callback.bot.send_message(
-                friend_id,
-                f"👍 <b>{escape(requester_label)}</b> принял(а) вашу заявку. Вы теперь друзья.",
-            )
-        except Exception:
-            pass
+        send_queue.enqueue(
+            friend_id,
+            f"👍 <b>{escape(requester_label)}</b> принял(а) вашу заявку. Вы теперь друзья.",
+        )
     elif status == "created":
         response_text = "Заявка отправлена. Мы сообщим, когда друг подтвердит."
         alert_text = "Заявка отправлена"
         request_id = result.get("request_id")
         if request_id:
-            await _send_friend_request_prompt(callback.bot, friend_id, requester_label, request_id)
+            _send_friend_request_prompt(friend_id, requester_label, request_id)
     else:
         response_text = "Не удалось отправить заявку. Попробуйте позже."
         alert_text = "Ошибка"
@@ -769,7 +759,7 @@ async def confirm_friend_add(callback: CallbackQuery):
         await callback.message.edit_text(response_text, reply_markup=None)
     except Exception:
         await callback.message.answer(response_text)
-    text, keyboard = _friends_panel_payload(user_id)
+    text, keyboard = await _friends_panel_payload(user_id)
     await callback.message.answer(text, reply_markup=keyboard)
     await callback.answer(alert_text)
 
@@ -778,7 +768,7 @@ async def confirm_friend_add(callback: CallbackQuery):
 async def cancel_friend_flow(callback: CallbackQuery):
     """Отменить начатое действие с друзьями."""
     user_id = callback.from_user.id
-    friend_states.pop(user_id, None)
+    await state_store.pop(FRIEND_STATE, user_id)
     try:
         await callback.message.edit_reply_markup(reply_markup=None)
     except Exception:
@@ -796,7 +786,7 @@ async def accept_friend_request_callback(callback: CallbackQuery):
         await callback.answer("Некорректная заявка.", show_alert=True)
         return
 
-    request = get_friend_request(request_id)
+    request = await db.get_friend_request(request_id)
     if not request:
         await callback.answer("Заявка не найдена.", show_alert=True)
         return
@@ -807,14 +797,13 @@ async def accept_friend_request_callback(callback: CallbackQuery):
         await callback.answer("Заявка уже обработана.", show_alert=True)
         return
 
-    updated = update_friend_request_status(request_id, "accepted")
+    updated = await db.update_friend_request_status(request_id, "accepted")
     if not updated:
         await callback.answer("Не удалось принять заявку.", show_alert=True)
         return
 
-    add_friend(request["requester_id"], request["target_id"])
-    requester_label = _get_user_label(request["requester_id"])
-    target_label = _get_user_label(user_id)
+    await db.add_friend(request["requester_id"], request["target_id"])
+    target_label = await _get_user_label(user_id)
     try:
         await callback.message.edit_text(
             "Заявка принята. Вы добавлены в список друзей.",
@@ -822,15 +811,12 @@ async def accept_friend_request_callback(callback: CallbackQuery):
         )
     except Exception:
         await callback.message.answer("Заявка принята. Вы добавлены в список друзей.")
-    text, keyboard = _friends_panel_payload(user_id)
+    text, keyboard = await _friends_panel_payload(user_id)
     await callback.message.answer(text, reply_markup=keyboard)
-    try:
-        await callback.bot.send_message(
-            request["requester_id"],
-            f"🎉 <b>{escape(target_label)}</b> принял(а) вашу заявку в друзья.",
-        )
-    except Exception:
-        pass
+    send_queue.enqueue(
+        request["requester_id"],
+        f"🎉 <b>{escape(target_label)}</b> принял(а) вашу заявку в друзья.",
+    )
     await callback.answer("Друг добавлен")
 
 
@@ -844,7 +830,7 @@ async def decline_friend_request_callback(callback: CallbackQuery):
         await callback.answer("Некорректная заявка.", show_alert=True)
         return
 
-    request = get_friend_request(request_id)
+    request = await db.get_friend_request(request_id)
     if not request:
         await callback.answer("Заявка не найдена.", show_alert=True)
         return
@@ -855,7 +841,7 @@ async def decline_friend_request_callback(callback: CallbackQuery):
         await callback.answer("Заявка уже обработана.", show_alert=True)
         return
 
-    updated = update_friend_request_status(request_id, "declined")
+    updated = await db.update_friend_request_status(request_id, "declined")
     if not updated:
         await callback.answer("Не удалось отклонить заявку.", show_alert=True)
         return
@@ -864,20 +850,25 @@ async def decline_friend_request_callback(callback: CallbackQuery):
         await callback.message.edit_text("Заявка отклонена.", reply_markup=None)
     except Exception:
         await callback.message.answer("Заявка отклонена.")
-    text, keyboard = _friends_panel_payload(user_id)
+    text, keyboard = await _friends_panel_payload(user_id)
     await callback.message.answer(text, reply_markup=keyboard)
-    target_label = _get_user_label(user_id)
-    try:
-        await callback.bot.send_message(
-            request["requester_id"],
-            f"⚠️ <b>{escape(target_label)}</b> отклонил(а) вашу заявку в друзья.",
-        )
-    except Exception:
-        pass
+    target_label = await _get_user_label(user_id)
+    send_queue.enqueue(
+        request["requester_id"],
+        f"⚠️ <b>{escape(target_label)}</b> отклонил(а) вашу заявку в друзья.",
+    )
     await callback.answer("Заявка отклонена")
 
 
-@router.message(lambda message: friend_states.get(message.from_user.id, {}).get("stage") == "await_username")
+async def _awaiting_friend_username(message: Message) -> bool:
+    """Фильтр: пользователь вводит username друга."""
+    if not message.from_user:
+        return False
+    state = await state_store.get(FRIEND_STATE, message.from_user.id)
+    return bool(state) and state.get("stage") == "await_username"
+
+
+@router.message(_awaiting_friend_username)
 async def collect_friend_username(message: Message):
     """Получить username друга от пользователя."""
     user_id = message.from_user.id
@@ -886,7 +877,7 @@ async def collect_friend_username(message: Message):
         await message.answer("Введите username друга (без @).")
         return
     if entered.lower() in {"отмена", "cancel"}:
-        friend_states.pop(user_id, None)
+        await state_store.pop(FRIEND_STATE, user_id)
         await message.answer("Добавление отменено.")
         return
 
@@ -895,7 +886,7 @@ async def collect_friend_username(message: Message):
         await message.answer("Введите корректный username.")
         return
 
-    candidate = find_user_by_username(username)
+    candidate = await db.find_user_by_username(username)
     if not candidate:
         await message.answer(
             "Пользователь с таким username не найден. Убедитесь, что друг запускал бота.",
@@ -907,7 +898,7 @@ async def collect_friend_username(message: Message):
         await message.answer("Нельзя добавить себя в друзья.")
         return
 
-    existing = {friend["user_id"] for friend in get_friends(user_id)}
+    existing = {friend["user_id"] for friend in await db.get_friends(user_id)}
     if friend_id in existing:
         await message.answer("Этот пользователь уже есть в списке друзей.")
         return
@@ -917,11 +908,15 @@ async def collect_friend_username(message: Message):
         "username": candidate[1],
         "first_name": candidate[2],
     }
-    friend_states[user_id] = {
-        "stage": "confirm_add",
-        "friend_id": friend_id,
-        "friend_record": friend_record,
-    }
+    await state_store.set(
+        FRIEND_STATE,
+        user_id,
+        {
+            "stage": "confirm_add",
+            "friend_id": friend_id,
+            "friend_record": friend_record,
+        },
+    )
     label = escape(_build_display_label(friend_record, friend_id))
     await message.answer(
         f"Отправить заявку {label}? Мы попросим друга подтвердить дружбу.",
@@ -1,9 +1,10 @@
 from aiogram import Router
 from aiogram.filters import CommandStart
-from aiogram.types import FSInputFile, Message
+from aiogram.types import Message
 
 from bot_keyboards.all_keyboards import get_main_menu
 from support_tools.admin_panel import send_admin_panel_prompt
+from support_tools.assets import asset_registry
 
 router = Router()
 
@@ -21,9 +22,9 @@ async def cmd_start(message: Message):
     )
     
     # Отправка фото с текстом и кнопками
-    photo = FSInputFile("assets/start_banner.jpg")
-    await message.answer_photo(
-        photo=photo,
+    await asset_registry.answer_photo(
+        message,
+        "assets/start_banner.jpg",
         caption=caption_text,
         reply_markup=get_main_menu()
     )
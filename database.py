@@ -1,20 +1,218 @@
+import atexit
+import json
+import logging
 import os
 import sqlite3
-from collections.abc import Sequence
+import threading
+import time
+from collections.abc import Callable, Iterator, Sequence
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from pathlib import Path
 
+from support_tools.co2 import format_co2, parse_co2_value
+
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name: str, default: int) -> int:
+    raw = os.getenv(name, "").strip()
+    if not raw:
+        return default
+    try:
+        return int(raw)
+    except ValueError:
+        logger.warning("Некорректное значение %s=%r, используется %s", name, raw, default)
+        return default
+
+
+def _env_choice(name: str, default: str, allowed: set[str]) -> str:
+    raw = os.getenv(name, "").strip().upper()
+    if not raw:
+        return default
+    if raw not in allowed:
+        logger.warning("Некорректное значение %s=%r, используется %s", name, raw, default)
+        return default
+    return raw
+
+
 DB_NAME = os.getenv("ECOSTEP_DB_PATH", "ecostep.db")
+# Профиль хранения: применяется к каждому новому подключению.
+# WAL позволяет боту и админке писать в один файл без "database is locked".
+STORAGE_PROFILE: dict[str, str | int] = {
+    "journal_mode": _env_choice(
+        "ECOSTEP_DB_JOURNAL_MODE", "WAL", {"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"}
+    ),
+    "synchronous": _env_choice("ECOSTEP_DB_SYNCHRONOUS", "NORMAL", {"OFF", "NORMAL", "FULL", "EXTRA"}),
+    "busy_timeout": max(0, _env_int("ECOSTEP_DB_BUSY_TIMEOUT_MS", 5000)),
+    # Отрицательное значение cache_size SQLite трактует как размер в КиБ
+    "cache_size": -abs(_env_int("ECOSTEP_DB_CACHE_SIZE_KB", 16384)),
+    "mmap_size": max(0, _env_int("ECOSTEP_DB_MMAP_SIZE", 128 * 1024 * 1024)),
+    "temp_store": _env_choice("ECOSTEP_DB_TEMP_STORE", "MEMORY", {"DEFAULT", "FILE", "MEMORY"}),
+}
+# Сколько простаивающих подключений держать на один файл БД
+DB_POOL_SIZE = max(1, int(os.getenv("ECOSTEP_DB_POOL_SIZE", "4")))
+# Через сколько секунд простоя подключение перепроверяется перед выдачей
+DB_POOL_PING_SECONDS = float(os.getenv("ECOSTEP_DB_POOL_PING_SECONDS", "30"))
 
 
 def _get_connection() -> sqlite3.Connection:
-    """Создать подключение к базе."""
+    """Создать отдельное подключение к базе (закрывает вызывающий)."""
     db_path = _resolve_db_path()
     db_path.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(db_path)
+    return _open_connection(db_path)
+
+
+def _open_connection(db_path: Path) -> sqlite3.Connection:
+    """Открыть подключение, которое можно передавать между потоками."""
+    conn = sqlite3.connect(
+        db_path,
+        timeout=int(STORAGE_PROFILE["busy_timeout"]) / 1000,
+        check_same_thread=False,
+    )
+    _apply_storage_profile(conn)
     return conn
 
 
+_SYNCHRONOUS_NAMES = {0: "OFF", 1: "NORMAL", 2: "FULL", 3: "EXTRA"}
+_TEMP_STORE_NAMES = {0: "DEFAULT", 1: "FILE", 2: "MEMORY"}
+
+
+def _apply_storage_profile(conn: sqlite3.Connection):
+    # Значения прошли проверку в _env_choice/_env_int, поэтому их можно подставлять в PRAGMA
+    for pragma in ("journal_mode", "synchronous", "busy_timeout", "cache_size", "mmap_size", "temp_store"):
+        conn.execute(f"PRAGMA {pragma} = {STORAGE_PROFILE[pragma]}").fetchall()
+
+
+def get_storage_report() -> dict[str, str | int]:
+    """Вернуть фактические настройки хранения, с которыми работает подключение."""
+    with _connection() as conn:
+        report: dict[str, str | int] = {"path": get_db_path()}
+        for pragma in ("journal_mode", "synchronous", "busy_timeout", "cache_size", "mmap_size", "temp_store"):
+            report[pragma] = conn.execute(f"PRAGMA {pragma}").fetchone()[0]
+    report["synchronous"] = _SYNCHRONOUS_NAMES.get(report["synchronous"], report["synchronous"])
+    report["temp_store"] = _TEMP_STORE_NAMES.get(report["temp_store"], report["temp_store"])
+    return report
+
+
+def _file_identity(db_path: Path) -> tuple[int, int] | None:
+    try:
+        stat = db_path.stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_dev, stat.st_ino
+
+
+class _PooledConnection:
+    __slots__ = ("conn", "file_identity", "released_at")
+
+    def __init__(self, conn: sqlite3.Connection, file_identity: tuple[int, int] | None):
+        self.conn = conn
+        self.file_identity = file_identity
+        self.released_at = time.monotonic()
+
+
+class _ConnectionPool:
+    """
+    Пул переиспользуемых подключений к одному файлу БД.
+
+    Подключение выдаётся одному потоку за раз и возвращается после запроса.
+    Если свободных нет — открывается новое, а лишние при возврате закрываются,
+    поэтому вложенные вызовы не блокируют друг друга.
+    """
+
+    def __init__(self, db_path: Path, size: int):
+        self.db_path = db_path
+        self.size = size
+        self._idle: list[_PooledConnection] = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def acquire(self) -> _PooledConnection:
+        while True:
+            with self._lock:
+                entry = self._idle.pop() if self._idle else None
+            if entry is None:
+                conn = _open_connection(self.db_path)
+                return _PooledConnection(conn, _file_identity(self.db_path))
+            if self._is_healthy(entry):
+                return entry
+            entry.conn.close()
+
+    def release(self, entry: _PooledConnection):
+        if entry.conn.in_transaction:
+            entry.conn.rollback()
+        if entry.file_identity is None:
+            # Файл мог появиться только во время запроса (первое подключение)
+            entry.file_identity = _file_identity(self.db_path)
+        entry.released_at = time.monotonic()
+        with self._lock:
+            if not self._closed and len(self._idle) < self.size:
+                self._idle.append(entry)
+                return
+        entry.conn.close()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for entry in idle:
+            entry.conn.close()
+
+    def _is_healthy(self, entry: _PooledConnection) -> bool:
+        # Файл удалили или подменили (восстановление из бэкапа, тесты)
+        if _file_identity(self.db_path) != entry.file_identity:
+            return False
+        if time.monotonic() - entry.released_at < DB_POOL_PING_SECONDS:
+            return True
+        try:
+            entry.conn.execute("SELECT 1").fetchone()
+        except sqlite3.Error:
+            return False
+        return True
+
+
+_pools: dict[Path, _ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def _get_pool() -> _ConnectionPool:
+    db_path = _resolve_db_path()
+    pool = _pools.get(db_path)
+    if pool is not None:
+        return pool
+    with _pools_lock:
+        pool = _pools.get(db_path)
+        if pool is None:
+            db_path.parent.mkdir(parents=True, exist_ok=True)
+            pool = _ConnectionPool(db_path, DB_POOL_SIZE)
+            _pools[db_path] = pool
+    return pool
+
+
+@contextmanager
+def _connection() -> Iterator[sqlite3.Connection]:
+    """Взять подключение из пула на время одного вызова."""
+    pool = _get_pool()
+    entry = pool.acquire()
+    try:
+        yield entry.conn
+    finally:
+        pool.release(entry)
+
+
+def close_connections():
+    """Закрыть все подключения пула (при остановке процесса)."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+atexit.register(close_connections)
+
+
 def _resolve_db_path() -> Path:
     """
     Определить абсолютный путь до БД.
@@ -33,10 +231,8 @@ def get_db_path() -> str:
     return str(_resolve_db_path())
 
 
-def init_db():
-    """Инициализировать таблицы и недостающие поля."""
-    conn = _get_connection()
-    cursor = conn.cursor()
+def _migrate_base_tables(cursor: sqlite3.Cursor):
+    """Базовые таблицы."""
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
             user_id INTEGER PRIMARY KEY,
@@ -106,464 +302,932 @@ def init_db():
         )
     ''')
 
+
+def _migrate_report_review_columns(cursor: sqlite3.Cursor):
+    """Поля модерации и вложений в user_challenges."""
     cursor.execute("PRAGMA table_info(user_challenges)")
     existing_columns = {row[1] for row in cursor.fetchall()}
-    if 'review_status' not in existing_columns:
-        cursor.execute("ALTER TABLE user_challenges ADD COLUMN review_status TEXT")
-    if 'review_comment' not in existing_columns:
-        cursor.execute("ALTER TABLE user_challenges ADD COLUMN review_comment TEXT")
-    if 'reviewed_at' not in existing_columns:
-        cursor.execute("ALTER TABLE user_challenges ADD COLUMN reviewed_at TEXT")
-    if 'attachment_type' not in existing_columns:
-        cursor.execute("ALTER TABLE user_challenges ADD COLUMN attachment_type TEXT")
-    if 'attachment_name' not in existing_columns:
-        cursor.execute("ALTER TABLE user_challenges ADD COLUMN attachment_name TEXT")
-    if 'points_awarded' not in existing_columns:
-        cursor.execute("ALTER TABLE user_challenges ADD COLUMN points_awarded INTEGER")
-    if 'co2_saved' not in existing_columns:
-        cursor.execute("ALTER TABLE user_challenges ADD COLUMN co2_saved REAL")
+    new_columns = (
+        ("review_status", "TEXT"),
+        ("review_comment", "TEXT"),
+        ("reviewed_at", "TEXT"),
+        ("attachment_type", "TEXT"),
+        ("attachment_name", "TEXT"),
+        ("points_awarded", "INTEGER"),
+        ("co2_saved", "REAL"),
+    )
+    for column, column_type in new_columns:
+        if column not in existing_columns:
+            cursor.execute(f"ALTER TABLE user_challenges ADD COLUMN {column} {column_type}")
     cursor.execute(
-        "UPDATE user_challenges SET review_status = COALESCE(review_status, 'pending')"
+        "UPDATE user_challenges SET review_status = 'pending' WHERE review_status IS NULL"
     )
     cursor.execute(
-        "UPDATE user_challenges SET attachment_type = COALESCE(attachment_type, 'photo')"
+        "UPDATE user_challenges SET attachment_type = 'photo' WHERE attachment_type IS NULL"
     )
+
+
+def _migrate_custom_challenge_quantity(cursor: sqlite3.Cursor):
+    """Флаг co2_quantity_based у кастомных челленджей."""
     cursor.execute("PRAGMA table_info(custom_challenges)")
     custom_columns = {row[1] for row in cursor.fetchall()}
     if 'co2_quantity_based' not in custom_columns:
         cursor.execute(
             "ALTER TABLE custom_challenges ADD COLUMN co2_quantity_based INTEGER NOT NULL DEFAULT 0"
         )
-    conn.commit()
-    conn.close()
 
 
-def register_user(user_id: int, username: str, first_name: str):
-    """Зарегистрировать пользователя (если ещё нет)."""
-    conn = _get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,))
-    if cursor.fetchone():
-        conn.close()
-        return False
-
+def _migrate_hot_query_indexes(cursor: sqlite3.Cursor):
+    """Индексы для частых запросов."""
+    # Очередь модерации: частичный индекс содержит только ожидающие отчёты
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_user_challenges_pending
+        ON user_challenges (submitted_at)
+        WHERE status = 'submitted' AND (review_status IS NULL OR review_status = 'pending')
+    ''')
     cursor.execute(
-        '''
-        INSERT INTO users (user_id, username, first_name, registration_date)
-        VALUES (?, ?, ?, ?)
-        ''',
-        (user_id, username, first_name, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        "CREATE INDEX IF NOT EXISTS idx_users_username_lower ON users (LOWER(username))"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_users_registration_date ON users (registration_date)"
+    )
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_friend_requests_pair
+        ON friend_requests (requester_id, target_id, status)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_friend_requests_target
+        ON friend_requests (target_id, status)
+    ''')
+    # Совпадает с сортировкой get_admin_logs, включая порядок записей внутри одной секунды
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_admin_logs_created_at ON admin_logs (created_at DESC, id ASC)"
     )
-    conn.commit()
-    conn.close()
-    return True
 
 
-def get_user_info(user_id: int) -> tuple | None:
-    """Получить информацию о пользователе."""
-    conn = _get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-    user = cursor.fetchone()
-    conn.close()
-    return user
+def _migrate_user_stats(cursor: sqlite3.Cursor):
+    """Материализованная сводка баллов и CO₂ пользователя."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id INTEGER PRIMARY KEY,
+            total_points INTEGER NOT NULL DEFAULT 0,
+            total_co2 REAL NOT NULL DEFAULT 0,
+            approved_count INTEGER NOT NULL DEFAULT 0,
+            rejected_count INTEGER NOT NULL DEFAULT 0,
+            pending_count INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT
+        )
+    ''')
+    _rebuild_user_stats(cursor)
 
 
-def get_all_user_ids() -> list[int]:
-    """Вернуть список ID всех пользователей."""
-    conn = _get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT user_id FROM users")
-    ids = [row[0] for row in cursor.fetchall()]
-    conn.close()
-    return ids
+def _migrate_user_weekly_points(cursor: sqlite3.Cursor):
+    """Недельные корзины баллов пользователя."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_weekly_points (
+            user_id INTEGER NOT NULL,
+            week_start TEXT NOT NULL,
+            points INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, week_start)
+        )
+    ''')
+    _rebuild_user_weekly_points(cursor)
 
 
-def get_user_registration_counts() -> dict[str, int]:
-    """Получить количество пользователей за всё время и за последние 7 дней."""
-    conn = _get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*) FROM users")
-    total = cursor.fetchone()[0] or 0
-    threshold = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d %H:%M:%S')
-    cursor.execute(
-        '''
-        SELECT COUNT(*) FROM users
-        WHERE registration_date IS NOT NULL
-          AND registration_date >= ?
-        ''',
-        (threshold,)
-    )
-    weekly = cursor.fetchone()[0] or 0
-    conn.close()
-    return {
-        "total": total,
-        "weekly": weekly,
-    }
+def _migrate_leaderboard_versions(cursor: sqlite3.Cursor):
+    """Версии данных рейтинга друзей для инвалидации кэша."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS leaderboard_versions (
+            user_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
 
 
-def find_user_by_username(username: str) -> tuple[int, str | None, str | None] | None:
-    """Найти пользователя по username (без учёта регистра)."""
-    if not username:
-        return None
-    conn = _get_connection()
-    cursor = conn.cursor()
+def _migrate_global_ranking_indexes(cursor: sqlite3.Cursor):
+    """Отсортированные индексы общего рейтинга."""
     cursor.execute(
-        """
-        SELECT user_id, username, first_name
-        FROM users
-        WHERE LOWER(username) = LOWER(?)
-        LIMIT 1
-        """,
-        (username,)
+        "CREATE INDEX IF NOT EXISTS idx_user_stats_ranking "
+        "ON user_stats (total_points DESC, user_id ASC)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_user_weekly_points_ranking "
+        "ON user_weekly_points (week_start, points DESC, user_id ASC)"
     )
-    row = cursor.fetchone()
-    conn.close()
-    return row
 
 
-def add_friend(user_id: int, friend_id: int) -> bool:
-    """Добавить друга (двусторонняя запись)."""
-    if user_id == friend_id:
-        return False
+def _migrate_data_versions(cursor: sqlite3.Cursor):
+    """Счётчики версий общих данных (каталог челленджей)."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS data_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
 
-    conn = _get_connection()
-    cursor = conn.cursor()
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    cursor.execute(
-        '''
-        INSERT OR IGNORE INTO user_friends (user_id, friend_id, created_at)
-        VALUES (?, ?, ?)
-        ''',
-        (user_id, friend_id, timestamp)
-    )
-    inserted_primary = cursor.rowcount > 0
-    cursor.execute(
-        '''
-        INSERT OR IGNORE INTO user_friends (user_id, friend_id, created_at)
-        VALUES (?, ?, ?)
-        ''',
-        (friend_id, user_id, timestamp)
+
+def _migrate_custom_challenge_co2_kg(cursor: sqlite3.Cursor):
+    """Числовое поле co2_kg у кастомных челленджей."""
+    cursor.execute("PRAGMA table_info(custom_challenges)")
+    columns = {row[1] for row in cursor.fetchall()}
+    if "co2_kg" not in columns:
+        cursor.execute("ALTER TABLE custom_challenges ADD COLUMN co2_kg REAL")
+    # Текст разбираем один раз здесь; дальше значение пишется при создании челленджа
+    cursor.execute("SELECT id, co2 FROM custom_challenges WHERE co2_kg IS NULL")
+    cursor.executemany(
+        "UPDATE custom_challenges SET co2_kg = ? WHERE id = ?",
+        [(parse_co2_value(co2), challenge_id) for challenge_id, co2 in cursor.fetchall()]
     )
-    conn.commit()
-    conn.close()
-    return inserted_primary
+    _backfill_approved_rewards(cursor)
+    _rebuild_user_stats(cursor)
+    _rebuild_user_weekly_points(cursor)
 
 
-def remove_friend(user_id: int, friend_id: int) -> bool:
-    """Удалить дружбу в обе стороны."""
-    conn = _get_connection()
-    cursor = conn.cursor()
+def _migrate_conversation_state(cursor: sqlite3.Cursor):
+    """Состояние диалогов бота (SQLite-бэкенд хранилища состояний)."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS conversation_state (
+            namespace TEXT NOT NULL,
+            key INTEGER NOT NULL,
+            value TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY (namespace, key)
+        ) WITHOUT ROWID
+    ''')
     cursor.execute(
-        '''
-        DELETE FROM user_friends
-        WHERE (user_id = ? AND friend_id = ?)
-           OR (user_id = ? AND friend_id = ?)
-        ''',
-        (user_id, friend_id, friend_id, user_id)
+        "CREATE INDEX IF NOT EXISTS idx_conversation_state_expires ON conversation_state (expires_at)"
     )
-    deleted = cursor.rowcount > 0
-    conn.commit()
-    conn.close()
-    return deleted
 
 
-def get_friends(user_id: int) -> list[dict]:
-    """Вернуть список друзей пользователя."""
-    conn = _get_connection()
-    cursor = conn.cursor()
+def _migrate_media_assets(cursor: sqlite3.Cursor):
+    """file_id загруженных в Telegram баннеров по хэшу содержимого."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS media_assets (
+            content_hash TEXT PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            path TEXT,
+            uploaded_at TEXT
+        )
+    ''')
+
+
+def _migrate_outbound_dead_letters(cursor: sqlite3.Cursor):
+    """Сообщения бота, которые не удалось доставить."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS outbound_dead_letters (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            priority INTEGER NOT NULL,
+            attempts INTEGER NOT NULL,
+            error TEXT,
+            created_at TEXT NOT NULL
+        )
+    ''')
+
+
+def _migrate_broadcast_jobs(cursor: sqlite3.Cursor):
+    """Фоновые рассылки с курсором по users.user_id."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_id INTEGER,
+            message TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            total INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            cursor_user_id INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL,
+            started_at TEXT,
+            updated_at TEXT,
+            finished_at TEXT
+        )
+    ''')
     cursor.execute(
-        '''
-        SELECT u.user_id, u.username, u.first_name, uf.created_at
-        FROM user_friends AS uf
-        JOIN users AS u ON u.user_id = uf.friend_id
-        WHERE uf.user_id = ?
-        ORDER BY u.first_name ASC
-        ''',
-        (user_id,)
+        "CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_status ON broadcast_jobs (status)"
     )
-    rows = cursor.fetchall()
-    conn.close()
-    return [
-        {
-            "user_id": row[0],
-            "username": row[1],
-            "first_name": row[2],
-            "since": row[3],
-        }
-        for row in rows
-    ]
 
 
-def get_friend_ids(user_id: int) -> list[int]:
-    """Вернуть список ID друзей пользователя."""
-    conn = _get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        '''
-        SELECT friend_id
-        FROM user_friends
-        WHERE user_id = ?
-        ORDER BY friend_id ASC
-        ''',
-        (user_id,)
+def _migrate_report_file_paths(cursor: sqlite3.Cursor):
+    """Сохранённый путь файла отчёта на серверах Telegram."""
+    cursor.execute("PRAGMA table_info(user_challenges)")
+    existing_columns = {row[1] for row in cursor.fetchall()}
+    for column, column_type in (("photo_file_path", "TEXT"), ("photo_file_path_at", "REAL")):
+        if column not in existing_columns:
+            cursor.execute(f"ALTER TABLE user_challenges ADD COLUMN {column} {column_type}")
+
+
+def _pending_report_condition(alias: str = "") -> str:
+    """Условие «отчёт ждёт проверки» — совпадает с условием частичных индексов очереди."""
+    return (
+        f"{alias}status = 'submitted' "
+        f"AND ({alias}review_status IS NULL OR {alias}review_status = 'pending')"
     )
-    rows = cursor.fetchall()
-    conn.close()
-    return [row[0] for row in rows]
 
 
-def get_users_by_ids(user_ids: Sequence[int]) -> dict[int, dict[str, str | int | None]]:
-    """Вернуть информацию о пользователях по списку ID."""
-    unique_ids = list(dict.fromkeys(uid for uid in user_ids if isinstance(uid, int)))
-    if not unique_ids:
-        return {}
-    placeholders = ",".join("?" * len(unique_ids))
-    conn = _get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        f'''
-        SELECT user_id, username, first_name
-        FROM users
-        WHERE user_id IN ({placeholders})
-        ''',
-        unique_ids,
+def _migrate_pending_report_keyset(cursor: sqlite3.Cursor):
+    """Постраничная очередь модерации и счётчик ожидающих отчётов."""
+    cursor.execute("DROP INDEX IF EXISTS idx_user_challenges_pending")
+    cursor.execute(f'''
+        CREATE INDEX IF NOT EXISTS idx_user_challenges_pending_keyset
+        ON user_challenges (submitted_at, user_id, challenge_id)
+        WHERE {_pending_report_condition()}
+    ''')
+    cursor.execute(f'''
+        CREATE INDEX IF NOT EXISTS idx_user_challenges_pending_challenge
+        ON user_challenges (challenge_id, submitted_at, user_id)
+        WHERE {_pending_report_condition()}
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS pending_report_counts (
+            challenge_id TEXT PRIMARY KEY,
+            pending INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute("DELETE FROM pending_report_counts")
+    cursor.execute(f'''
+        INSERT INTO pending_report_counts (challenge_id, pending)
+        SELECT challenge_id, COUNT(*) FROM user_challenges
+        WHERE {_pending_report_condition()}
+        GROUP BY challenge_id
+    ''')
+    # Счётчик ведут триггеры: отчёт попадает в очередь и покидает её во многих местах кода
+    old_pending = _pending_report_condition("OLD.")
+    new_pending = _pending_report_condition("NEW.")
+    increment = '''
+        INSERT INTO pending_report_counts (challenge_id, pending) VALUES (NEW.challenge_id, 1)
+        ON CONFLICT(challenge_id) DO UPDATE SET pending = pending + 1;
+    '''
+    decrement = '''
+        UPDATE pending_report_counts SET pending = pending - 1 WHERE challenge_id = OLD.challenge_id;
+    '''
+    triggers = (
+        ("trg_pending_reports_insert", "AFTER INSERT", new_pending, increment),
+        ("trg_pending_reports_delete", "AFTER DELETE", old_pending, decrement),
+        ("trg_pending_reports_leave", "AFTER UPDATE", old_pending, decrement),
+        ("trg_pending_reports_enter", "AFTER UPDATE", new_pending, increment),
     )
-    rows = cursor.fetchall()
-    conn.close()
-    return {
-        row[0]: {
-            "user_id": row[0],
-            "username": row[1],
-            "first_name": row[2],
-        }
-        for row in rows
-    }
+    for name, event, condition, action in triggers:
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {name} {event} ON user_challenges
+            WHEN {condition}
+            BEGIN {action} END
+        ''')
 
 
-def _are_friends(user_id: int, friend_id: int) -> bool:
-    conn = _get_connection()
-    cursor = conn.cursor()
+def _migrate_report_events(cursor: sqlite3.Cursor):
+    """Лента изменений очереди модерации для админ-панели."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS report_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            challenge_id TEXT NOT NULL,
+            review_status TEXT,
+            submitted_at TEXT,
+            created_at TEXT NOT NULL
+        )
+    ''')
+
+
+def _migrate_admin_sessions(cursor: sqlite3.Cursor):
+    """Сессии админ-панели, общие для всех воркеров."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS admin_sessions (
+            token_hash TEXT PRIMARY KEY,
+            admin_id INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID
+    ''')
     cursor.execute(
-        '''
-        SELECT 1
-        FROM user_friends
-        WHERE user_id = ? AND friend_id = ?
-        LIMIT 1
-        ''',
-        (user_id, friend_id)
+        "CREATE INDEX IF NOT EXISTS idx_admin_sessions_expires ON admin_sessions (expires_at)"
     )
-    result = cursor.fetchone() is not None
-    conn.close()
-    return result
 
 
-def _get_pending_friend_request_between(requester_id: int, target_id: int) -> dict | None:
-    conn = _get_connection()
-    cursor = conn.cursor()
+def _migrate_notification_outbox(cursor: sqlite3.Cursor):
+    """Очередь уведомлений пользователям, которую разбирает фоновый обработчик."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS notification_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            chat_id INTEGER,
+            payload TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            available_at REAL NOT NULL,
+            created_at REAL NOT NULL
+        )
+    ''')
     cursor.execute(
-        '''
-        SELECT id, requester_id, target_id, status, created_at, responded_at
-        FROM friend_requests
-        WHERE requester_id = ? AND target_id = ? AND status = 'pending'
-        ORDER BY id DESC
-        LIMIT 1
-        ''',
-        (requester_id, target_id)
+        "CREATE INDEX IF NOT EXISTS idx_notification_outbox_available "
+        "ON notification_outbox (available_at, id)"
     )
-    row = cursor.fetchone()
-    conn.close()
-    if not row:
-        return None
-    return {
-        "id": row[0],
-        "requester_id": row[1],
-        "target_id": row[2],
-        "status": row[3],
-        "created_at": row[4],
-        "responded_at": row[5],
-    }
 
 
-def get_friend_request(request_id: int) -> dict | None:
-    """Получить данные по заявке в друзья."""
-    conn = _get_connection()
-    cursor = conn.cursor()
+def _migrate_friend_digest(cursor: sqlite3.Cursor):
+    """Сводка о заданиях друзей: настройка пользователя и накопленные события."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS notification_settings (
+            user_id INTEGER PRIMARY KEY,
+            friend_digest INTEGER NOT NULL DEFAULT 0,
+            updated_at REAL NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS friend_digest_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            recipient_id INTEGER NOT NULL,
+            payload TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+    ''')
     cursor.execute(
-        '''
-        SELECT id, requester_id, target_id, status, created_at, responded_at
-        FROM friend_requests
-        WHERE id = ?
-        ''',
-        (request_id,)
+        "CREATE INDEX IF NOT EXISTS idx_friend_digest_events_recipient "
+        "ON friend_digest_events (recipient_id, id)"
+    )
+    # Одна строка на получателя с накопленными событиями: когда отправить сводку
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS friend_digest_due (
+            recipient_id INTEGER PRIMARY KEY,
+            flush_at REAL NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_friend_digest_due_flush "
+        "ON friend_digest_due (flush_at)"
     )
-    row = cursor.fetchone()
-    conn.close()
-    if not row:
-        return None
-    return {
-        "id": row[0],
-        "requester_id": row[1],
-        "target_id": row[2],
-        "status": row[3],
-        "created_at": row[4],
-        "responded_at": row[5],
-    }
 
 
-def update_friend_request_status(request_id: int, status: str) -> bool:
-    """Обновить статус заявки в друзья."""
-    responded_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    conn = _get_connection()
-    cursor = conn.cursor()
+def _migrate_broadcast_job_lease(cursor: sqlite3.Cursor):
+    """Владелец рассылки и срок его аренды: задание выполняет один воркер."""
+    cursor.execute("PRAGMA table_info(broadcast_jobs)")
+    existing_columns = {row[1] for row in cursor.fetchall()}
+    for column, column_type in (("owner", "TEXT"), ("lease_until", "REAL")):
+        if column not in existing_columns:
+            cursor.execute(f"ALTER TABLE broadcast_jobs ADD COLUMN {column} {column_type}")
+
+
+def _migrate_send_rate_buckets(cursor: sqlite3.Cursor):
+    """Общие для всех процессов корзины токенов лимитов отправки Telegram."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS send_rate_buckets (
+            bucket TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL
+        ) WITHOUT ROWID
+    ''')
     cursor.execute(
-        '''
-        UPDATE friend_requests
-        SET status = ?, responded_at = ?
-        WHERE id = ? AND status = 'pending'
-        ''',
-        (status, responded_at, request_id)
+        "CREATE INDEX IF NOT EXISTS idx_send_rate_buckets_updated "
+        "ON send_rate_buckets (updated_at)"
     )
-    updated = cursor.rowcount > 0
-    conn.commit()
-    conn.close()
-    return updated
 
 
-def create_friend_request(requester_id: int, target_id: int) -> dict:
-    """Создать заявку в друзья или принять существующую."""
-    if requester_id == target_id:
-        return {"status": "self"}
-    if _are_friends(requester_id, target_id):
-        return {"status": "already_friends"}
+def _migrate_local_chat_send_buckets(cursor: sqlite3.Cursor):
+    """Корзины чатов живут в памяти процесса: в send_rate_buckets остаётся только общая корзина бота."""
+    cursor.execute("DELETE FROM send_rate_buckets WHERE bucket <> 'global'")
+    cursor.execute("DROP INDEX IF EXISTS idx_send_rate_buckets_updated")
+
+
+# Миграции схемы по порядку. Номер версии = позиция в списке (PRAGMA user_version).
+# Уже выпущенные шаги не меняем — только добавляем новые в конец.
+MIGRATIONS: list[Callable[[sqlite3.Cursor], None]] = [
+    _migrate_base_tables,
+    _migrate_report_review_columns,
+    _migrate_custom_challenge_quantity,
+    _migrate_hot_query_indexes,
+    _migrate_user_stats,
+    _migrate_user_weekly_points,
+    _migrate_leaderboard_versions,
+    _migrate_global_ranking_indexes,
+    _migrate_data_versions,
+    _migrate_custom_challenge_co2_kg,
+    _migrate_conversation_state,
+    _migrate_media_assets,
+    _migrate_outbound_dead_letters,
+    _migrate_broadcast_jobs,
+    _migrate_report_file_paths,
+    _migrate_pending_report_keyset,
+    _migrate_report_events,
+    _migrate_admin_sessions,
+    _migrate_notification_outbox,
+    _migrate_friend_digest,
+    _migrate_broadcast_job_lease,
+    _migrate_send_rate_buckets,
+    _migrate_local_chat_send_buckets,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_schema_version() -> int:
+    """Вернуть текущую версию схемы БД."""
+    with _connection() as conn:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def _apply_migrations(conn: sqlite3.Connection):
+    for version, migration in enumerate(MIGRATIONS, start=1):
+        # IMMEDIATE берёт блокировку записи сразу: если бот и админка стартуют
+        # одновременно, второй процесс дождётся первого и увидит новую версию.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            current = conn.execute("PRAGMA user_version").fetchone()[0]
+            if current >= version:
+                conn.rollback()
+                continue
+            migration(conn.cursor())
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logger.info("Применена миграция БД %s: %s", version, migration.__doc__)
 
-    reverse = _get_pending_friend_request_between(target_id, requester_id)
-    if reverse:
-        update_friend_request_status(reverse["id"], "accepted")
-        add_friend(requester_id, target_id)
-        return {"status": "auto_accepted", "request_id": reverse["id"]}
 
-    existing = _get_pending_friend_request_between(requester_id, target_id)
+def init_db():
+    """Применить недостающие миграции схемы."""
+    with _connection() as conn:
+        current = conn.execute("PRAGMA user_version").fetchone()[0]
+        if current < SCHEMA_VERSION:
+            _apply_migrations(conn)
+    logger.info(
+        "SQLite storage profile: %s",
+        ", ".join(f"{key}={value}" for key, value in get_storage_report().items()),
+    )
+
+
+def register_user(user_id: int, username: str, first_name: str):
+    """Зарегистрировать пользователя (если ещё нет)."""
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,))
+        if cursor.fetchone():
+            return False
+
+        cursor.execute(
+            '''
+            INSERT INTO users (user_id, username, first_name, registration_date)
+            VALUES (?, ?, ?, ?)
+            ''',
+            (user_id, username, first_name, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        )
+        conn.commit()
+        return True
+
+
+def upsert_users(profiles: Sequence[tuple[int, str, str]]) -> int:
+    """
+    Записать пачку профилей (user_id, username, first_name) одной транзакцией.
+
+    Новые пользователи регистрируются, у известных обновляются username и имя;
+    дата регистрации не меняется. Возвращает число новых или изменённых записей.
+    """
+    latest = {user_id: (username, first_name) for user_id, username, first_name in profiles}
+    if not latest:
+        return 0
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT user_id, username, first_name FROM users "
+            "WHERE user_id IN (SELECT value FROM json_each(?))",
+            (json.dumps(list(latest)),)
+        )
+        stored = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+        changed = [
+            (user_id, username, first_name)
+            for user_id, (username, first_name) in latest.items()
+            if stored.get(user_id) != (username, first_name)
+        ]
+        if not changed:
+            return 0
+        registration_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        cursor.executemany(
+            '''
+            INSERT INTO users (user_id, username, first_name, registration_date)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                username = excluded.username,
+                first_name = excluded.first_name
+            ''',
+            [(user_id, username, first_name, registration_date) for user_id, username, first_name in changed]
+        )
+        renamed = [user_id for user_id, *_ in changed if user_id in stored]
+        if renamed:
+            # Имена показываются в рейтингах друзей
+            _bump_leaderboard_versions(cursor, renamed, include_friends=True)
+        conn.commit()
+        return len(changed)
+
+
+def get_recent_user_profiles(limit: int) -> list[tuple[int, str, str]]:
+    """Профили последних зарегистрированных пользователей (для прогрева кэша)."""
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            SELECT user_id, username, first_name
+            FROM users
+            ORDER BY registration_date DESC
+            LIMIT ?
+            ''',
+            (limit,)
+        )
+        return cursor.fetchall()
+
+
+def get_user_info(user_id: int) -> tuple | None:
+    """Получить информацию о пользователе."""
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
+        user = cursor.fetchone()
+        return user
+
+
+def get_all_user_ids() -> list[int]:
+    """Вернуть список ID всех пользователей."""
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT user_id FROM users")
+        ids = [row[0] for row in cursor.fetchall()]
+        return ids
+
+
+def get_user_registration_counts() -> dict[str, int]:
+    """Получить количество пользователей за всё время и за последние 7 дней."""
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM users")
+        total = cursor.fetchone()[0] or 0
+        threshold = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d %H:%M:%S')
+        cursor.execute(
+            '''
+            SELECT COUNT(*) FROM users
+            WHERE registration_date IS NOT NULL
+              AND registration_date >= ?
+            ''',
+            (threshold,)
+        )
+        weekly = cursor.fetchone()[0] or 0
+        return {
+            "total": total,
+            "weekly": weekly,
+        }
+
+
+def find_user_by_username(username: str) -> tuple[int, str | None, str | None] | None:
+    """Найти пользователя по username (без учёта регистра)."""
+    if not username:
+        return None
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT user_id, username, first_name
+            FROM users
+            WHERE LOWER(username) = LOWER(?)
+            LIMIT 1
+            """,
+            (username,)
+        )
+        row = cursor.fetchone()
+        return row
+
+
+def add_friend(user_id: int, friend_id: int) -> bool:
+    """Добавить друга (двусторонняя запись)."""
+    if user_id == friend_id:
+        return False
+
+    with _connection() as conn:
+        cursor = conn.cursor()
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        cursor.execute(
+            '''
+            INSERT OR IGNORE INTO user_friends (user_id, friend_id, created_at)
+            VALUES (?, ?, ?)
+            ''',
+            (user_id, friend_id, timestamp)
+        )
+        inserted_primary = cursor.rowcount > 0
+        cursor.execute(
+            '''
+            INSERT OR IGNORE INTO user_friends (user_id, friend_id, created_at)
+            VALUES (?, ?, ?)
+            ''',
+            (friend_id, user_id, timestamp)
+        )
+        _bump_leaderboard_versions(cursor, [user_id, friend_id])
+        conn.commit()
+        return inserted_primary
+
+
+def remove_friend(user_id: int, friend_id: int) -> bool:
+    """Удалить дружбу в обе стороны."""
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            DELETE FROM user_friends
+            WHERE (user_id = ? AND friend_id = ?)
+               OR (user_id = ? AND friend_id = ?)
+            ''',
+            (user_id, friend_id, friend_id, user_id)
+        )
+        deleted = cursor.rowcount > 0
+        if deleted:
+            _bump_leaderboard_versions(cursor, [user_id, friend_id])
+        conn.commit()
+        return deleted
+
+
+def get_friends(user_id: int) -> list[dict]:
+    """Вернуть список друзей пользователя."""
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            SELECT u.user_id, u.username, u.first_name, uf.created_at
+            FROM user_friends AS uf
+            JOIN users AS u ON u.user_id = uf.friend_id
+            WHERE uf.user_id = ?
+            ORDER BY u.first_name ASC
+            ''',
+            (user_id,)
+        )
+        rows = cursor.fetchall()
+        return [
+            {
+                "user_id": row[0],
+                "username": row[1],
+                "first_name": row[2],
+                "since": row[3],
+            }
+            for row in rows
+        ]
+
+
+def get_friend_ids(user_id: int) -> list[int]:
+    """Вернуть список ID друзей пользователя."""
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            SELECT friend_id
+            FROM user_friends
+            WHERE user_id = ?
+            ORDER BY friend_id ASC
+            ''',
+            (user_id,)
+        )
+        rows = cursor.fetchall()
+        return [row[0] for row in rows]
+
+
+def get_users_by_ids(user_ids: Sequence[int]) -> dict[int, dict[str, str | int | None]]:
+    """Вернуть информацию о пользователях по списку ID."""
+    unique_ids = list(dict.fromkeys(uid for uid in user_ids if isinstance(uid, int)))
+    if not unique_ids:
+        return {}
+    placeholders = ",".join("?" * len(unique_ids))
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f'''
+            SELECT user_id, username, first_name
+            FROM users
+            WHERE user_id IN ({placeholders})
+            ''',
+            unique_ids,
+        )
+        rows = cursor.fetchall()
+        return {
+            row[0]: {
+                "user_id": row[0],
+                "username": row[1],
+                "first_name": row[2],
+            }
+            for row in rows
+        }
+
+
+def _are_friends(user_id: int, friend_id: int) -> bool:
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            SELECT 1
+            FROM user_friends
+            WHERE user_id = ? AND friend_id = ?
+            LIMIT 1
+            ''',
+            (user_id, friend_id)
+        )
+        result = cursor.fetchone() is not None
+        return result
+
+
+def _get_pending_friend_request_between(requester_id: int, target_id: int) -> dict | None:
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            SELECT id, requester_id, target_id, status, created_at, responded_at
+            FROM friend_requests
+            WHERE requester_id = ? AND target_id = ? AND status = 'pending'
+            ORDER BY id DESC
+            LIMIT 1
+            ''',
+            (requester_id, target_id)
+        )
+        row = cursor.fetchone()
+        if not row:
+            return None
+        return {
+            "id": row[0],
+            "requester_id": row[1],
+            "target_id": row[2],
+            "status": row[3],
+            "created_at": row[4],
+            "responded_at": row[5],
+        }
+
+
+def get_friend_request(request_id: int) -> dict | None:
+    """Получить данные по заявке в друзья."""
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            SELECT id, requester_id, target_id, status, created_at, responded_at
+            FROM friend_requests
+            WHERE id = ?
+            ''',
+            (request_id,)
+        )
+        row = cursor.fetchone()
+        if not row:
+            return None
+        return {
+            "id": row[0],
+            "requester_id": row[1],
+            "target_id": row[2],
+            "status": row[3],
+            "created_at": row[4],
+            "responded_at": row[5],
+        }
+
+
+def update_friend_request_status(request_id: int, status: str) -> bool:
+    """Обновить статус заявки в друзья."""
+    responded_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            UPDATE friend_requests
+            SET status = ?, responded_at = ?
+            WHERE id = ? AND status = 'pending'
+            ''',
+            (status, responded_at, request_id)
+        )
+        updated = cursor.rowcount > 0
+        conn.commit()
+        return updated
+
+
+def create_friend_request(requester_id: int, target_id: int) -> dict:
+    """Создать заявку в друзья или принять существующую."""
+    if requester_id == target_id:
+        return {"status": "self"}
+    if _are_friends(requester_id, target_id):
+        return {"status": "already_friends"}
+
+    reverse = _get_pending_friend_request_between(target_id, requester_id)
+    if reverse:
+        update_friend_request_status(reverse["id"], "accepted")
+        add_friend(requester_id, target_id)
+        return {"status": "auto_accepted", "request_id": reverse["id"]}
+
+    existing = _get_pending_friend_request_between(requester_id, target_id)
     if existing:
         return {"status": "already_pending", "request_id": existing["id"]}
 
-    conn = _get_connection()
-    cursor = conn.cursor()
-    created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    cursor.execute(
-        '''
-        INSERT INTO friend_requests (requester_id, target_id, status, created_at)
-        VALUES (?, ?, 'pending', ?)
-        ''',
-        (requester_id, target_id, created_at)
-    )
-    request_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    return {"status": "created", "request_id": request_id}
+    with _connection() as conn:
+        cursor = conn.cursor()
+        created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        cursor.execute(
+            '''
+            INSERT INTO friend_requests (requester_id, target_id, status, created_at)
+            VALUES (?, ?, 'pending', ?)
+            ''',
+            (requester_id, target_id, created_at)
+        )
+        request_id = cursor.lastrowid
+        conn.commit()
+        return {"status": "created", "request_id": request_id}
 
 
 def get_user_challenge_statuses(user_id: int) -> dict[str, str]:
     """Статусы челленджей пользователя."""
-    conn = _get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        '''
-        SELECT challenge_id, status
-        FROM user_challenges
-        WHERE user_id = ?
-        ''',
-        (user_id,)
-    )
-    rows = cursor.fetchall()
-    conn.close()
-    return {challenge_id: status for challenge_id, status in rows}
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            SELECT challenge_id, status
+            FROM user_challenges
+            WHERE user_id = ?
+            ''',
+            (user_id,)
+        )
+        rows = cursor.fetchall()
+        return {challenge_id: status for challenge_id, status in rows}
 
 
 def get_user_review_statuses(user_id: int) -> dict[str, str]:
     """Вернуть статусы модерации челленджей пользователя."""
-    conn = _get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        '''
-        SELECT challenge_id, COALESCE(review_status, 'pending')
-        FROM user_challenges
-        WHERE user_id = ?
-        ''',
-        (user_id,)
-    )
-    rows = cursor.fetchall()
-    conn.close()
-    return {challenge_id: status for challenge_id, status in rows}
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            SELECT challenge_id, COALESCE(review_status, 'pending')
+            FROM user_challenges
+            WHERE user_id = ?
+            ''',
+            (user_id,)
+        )
+        rows = cursor.fetchall()
+        return {challenge_id: status for challenge_id, status in rows}
 
 
 def accept_challenge(user_id: int, challenge_id: str) -> bool:
     """Записать факт принятия челленджа пользователем."""
-    conn = _get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        '''
-        SELECT status
-        FROM user_challenges
-        WHERE user_id = ? AND challenge_id = ?
-        ''',
-        (user_id, challenge_id)
-    )
-    existing = cursor.fetchone()
-    accepted_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    if existing:
-        if existing[0] == 'submitted':
-            conn.close()
-            return False
+    with _connection() as conn:
+        cursor = conn.cursor()
         cursor.execute(
             '''
-            UPDATE user_challenges
-            SET status = 'accepted',
-                accepted_at = ?,
-                submitted_at = NULL,
-                photo_file_id = NULL,
-                caption = NULL,
-                review_status = 'pending',
-                review_comment = NULL,
-                reviewed_at = NULL,
-                attachment_type = NULL,
-                attachment_name = NULL,
-                points_awarded = NULL
+            SELECT status
+            FROM user_challenges
             WHERE user_id = ? AND challenge_id = ?
             ''',
-            (accepted_at, user_id, challenge_id)
+            (user_id, challenge_id)
         )
-    else:
-        cursor.execute(
-            '''
-            INSERT INTO user_challenges (
-                user_id, challenge_id, status, accepted_at, review_status,
-                attachment_type, attachment_name, points_awarded
+        existing = cursor.fetchone()
+        accepted_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        if existing:
+            if existing[0] == 'submitted':
+                return False
+            cursor.execute(
+                '''
+                UPDATE user_challenges
+                SET status = 'accepted',
+                    accepted_at = ?,
+                    submitted_at = NULL,
+                    photo_file_id = NULL,
+                    photo_file_path = NULL,
+                    caption = NULL,
+                    review_status = 'pending',
+                    review_comment = NULL,
+                    reviewed_at = NULL,
+                    attachment_type = NULL,
+                    attachment_name = NULL,
+                    points_awarded = NULL
+                WHERE user_id = ? AND challenge_id = ?
+                ''',
+                (accepted_at, user_id, challenge_id)
             )
-            VALUES (?, ?, 'accepted', ?, 'pending', NULL, NULL, NULL)
-            ''',
-            (user_id, challenge_id, accepted_at)
-        )
-    conn.commit()
-    conn.close()
-    return True
+        else:
+            cursor.execute(
+                '''
+                INSERT INTO user_challenges (
+                    user_id, challenge_id, status, accepted_at, review_status,
+                    attachment_type, attachment_name, points_awarded
+                )
+                VALUES (?, ?, 'accepted', ?, 'pending', NULL, NULL, NULL)
+                ''',
+                (user_id, challenge_id, accepted_at)
+            )
+        _refresh_user_stats(cursor, user_id)
+        conn.commit()
+        return True
 
 
 def decline_challenge(user_id: int, challenge_id: str) -> bool:
     """Удалить принятый челлендж, если пользователь отказался."""
-    conn = _get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        '''
-        DELETE FROM user_challenges
-        WHERE user_id = ? AND challenge_id = ? AND status = 'accepted'
-        ''',
-        (user_id, challenge_id)
-    )
-    deleted = cursor.rowcount > 0
-    conn.commit()
-    conn.close()
-    return deleted
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            DELETE FROM user_challenges
+            WHERE user_id = ? AND challenge_id = ? AND status = 'accepted'
+            ''',
+            (user_id, challenge_id)
+        )
+        deleted = cursor.rowcount > 0
+        if deleted:
+            _refresh_user_stats(cursor, user_id)
+        conn.commit()
+        return deleted
 
 
 def mark_challenge_submitted(
@@ -575,42 +1239,43 @@ def mark_challenge_submitted(
     attachment_name: str | None = None
 ) -> bool:
     """Пометить челлендж как отправленный на проверку."""
-    conn = _get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        '''
-        SELECT status
-        FROM user_challenges
-        WHERE user_id = ? AND challenge_id = ?
-        ''',
-        (user_id, challenge_id)
-    )
-    existing = cursor.fetchone()
-    if not existing:
-        conn.close()
-        return False
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            SELECT status
+            FROM user_challenges
+            WHERE user_id = ? AND challenge_id = ?
+            ''',
+            (user_id, challenge_id)
+        )
+        existing = cursor.fetchone()
+        if not existing:
+            return False
 
-    submitted_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    cursor.execute(
-        '''
-        UPDATE user_challenges
-        SET status = 'submitted',
-            submitted_at = ?,
-            photo_file_id = ?,
-            caption = ?,
-            review_status = 'pending',
-            review_comment = NULL,
-            reviewed_at = NULL,
-            attachment_type = ?,
-            attachment_name = ?,
-            points_awarded = NULL
-        WHERE user_id = ? AND challenge_id = ?
-        ''',
-        (submitted_at, file_id, caption, attachment_type, attachment_name, user_id, challenge_id)
-    )
-    conn.commit()
-    conn.close()
-    return True
+        submitted_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        cursor.execute(
+            '''
+            UPDATE user_challenges
+            SET status = 'submitted',
+                submitted_at = ?,
+                photo_file_id = ?,
+                photo_file_path = NULL,
+                caption = ?,
+                review_status = 'pending',
+                review_comment = NULL,
+                reviewed_at = NULL,
+                attachment_type = ?,
+                attachment_name = ?,
+                points_awarded = NULL
+            WHERE user_id = ? AND challenge_id = ?
+            ''',
+            (submitted_at, file_id, caption, attachment_type, attachment_name, user_id, challenge_id)
+        )
+        _refresh_user_stats(cursor, user_id)
+        _record_report_event(cursor, REPORT_EVENT_ADDED, user_id, challenge_id, 'pending', submitted_at)
+        conn.commit()
+        return True
 
 
 def get_user_challenges_by_status(
@@ -622,107 +1287,104 @@ def get_user_challenges_by_status(
         return []
 
     placeholders = ",".join("?" * len(statuses))
-    conn = _get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        f'''
-        SELECT challenge_id, status, submitted_at, photo_file_id, caption,
-               review_status, review_comment, reviewed_at,
-               attachment_type, attachment_name
-        FROM user_challenges
-        WHERE user_id = ? AND status IN ({placeholders})
-        ORDER BY accepted_at ASC
-        ''',
-        (user_id, *statuses)
-    )
-    rows = cursor.fetchall()
-    conn.close()
-    return rows
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f'''
+            SELECT challenge_id, status, submitted_at, photo_file_id, caption,
+                   review_status, review_comment, reviewed_at,
+                   attachment_type, attachment_name
+            FROM user_challenges
+            WHERE user_id = ? AND status IN ({placeholders})
+            ORDER BY accepted_at ASC
+            ''',
+            (user_id, *statuses)
+        )
+        rows = cursor.fetchall()
+        return rows
 
 
 def get_submitted_challenges(user_id: int, only_pending: bool = True) -> list[tuple]:
     """Вернуть отправленные отчёты пользователя."""
-    conn = _get_connection()
-    cursor = conn.cursor()
-    query = '''
-        SELECT challenge_id, status, submitted_at, photo_file_id, caption,
-               review_status, review_comment, reviewed_at,
-               attachment_type, attachment_name
-        FROM user_challenges
-        WHERE user_id = ? AND status = 'submitted'
-    '''
-    params: list = [user_id]
-    if only_pending:
-        query += " AND (review_status IS NULL OR review_status = 'pending')"
-    query += " ORDER BY submitted_at ASC"
-    cursor.execute(query, params)
-    rows = cursor.fetchall()
-    conn.close()
-    return rows
+    with _connection() as conn:
+        cursor = conn.cursor()
+        query = '''
+            SELECT challenge_id, status, submitted_at, photo_file_id, caption,
+                   review_status, review_comment, reviewed_at,
+                   attachment_type, attachment_name
+            FROM user_challenges
+            WHERE user_id = ? AND status = 'submitted'
+        '''
+        params: list = [user_id]
+        if only_pending:
+            query += " AND (review_status IS NULL OR review_status = 'pending')"
+        query += " ORDER BY submitted_at ASC"
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        return rows
 
 
 def get_reviewed_challenges(user_id: int) -> list[tuple]:
     """Вернуть отчёты пользователя, где есть решение модератора."""
-    conn = _get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        '''
-        SELECT challenge_id, status, submitted_at, photo_file_id, caption,
-               review_status, review_comment, reviewed_at,
-               attachment_type, attachment_name
-        FROM user_challenges
-        WHERE user_id = ?
-          AND status = 'submitted'
-          AND review_status IN ('approved', 'rejected')
-        ORDER BY reviewed_at DESC
-        ''',
-        (user_id,)
-    )
-    rows = cursor.fetchall()
-    conn.close()
-    return rows
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            SELECT challenge_id, status, submitted_at, photo_file_id, caption,
+                   review_status, review_comment, reviewed_at,
+                   attachment_type, attachment_name
+            FROM user_challenges
+            WHERE user_id = ?
+              AND status = 'submitted'
+              AND review_status IN ('approved', 'rejected')
+            ORDER BY reviewed_at DESC
+            ''',
+            (user_id,)
+        )
+        rows = cursor.fetchall()
+        return rows
 
 
 def get_accepted_challenges(user_id: int) -> list[str]:
     """Вернуть принятые (но не сданные) челленджи."""
-    conn = _get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        '''
-        SELECT challenge_id
-        FROM user_challenges
-        WHERE user_id = ? AND status = 'accepted'
-        ORDER BY accepted_at ASC
-        ''',
-        (user_id,)
-    )
-    rows = cursor.fetchall()
-    conn.close()
-    return [challenge_id for (challenge_id,) in rows]
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            SELECT challenge_id
+            FROM user_challenges
+            WHERE user_id = ? AND status = 'accepted'
+            ORDER BY accepted_at ASC
+            ''',
+            (user_id,)
+        )
+        rows = cursor.fetchall()
+        return [challenge_id for (challenge_id,) in rows]
 
 
 def clear_challenge_state(user_id: int, challenge_id: str):
     """Сбросить состояние (используется при отклонении)."""
-    conn = _get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        '''
-        UPDATE user_challenges
-        SET status = 'accepted',
-            submitted_at = NULL,
-            photo_file_id = NULL,
-            caption = NULL,
-            review_status = 'pending',
-            review_comment = NULL,
-            reviewed_at = NULL,
-            attachment_type = NULL,
-            attachment_name = NULL
-        WHERE user_id = ? AND challenge_id = ? AND status != 'submitted'
-        ''',
-        (user_id, challenge_id)
-    )
-    conn.commit()
-    conn.close()
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            UPDATE user_challenges
+            SET status = 'accepted',
+                submitted_at = NULL,
+                photo_file_id = NULL,
+                photo_file_path = NULL,
+                caption = NULL,
+                review_status = 'pending',
+                review_comment = NULL,
+                reviewed_at = NULL,
+                attachment_type = NULL,
+                attachment_name = NULL
+            WHERE user_id = ? AND challenge_id = ? AND status != 'submitted'
+            ''',
+            (user_id, challenge_id)
+        )
+        _refresh_user_stats(cursor, user_id)
+        conn.commit()
 
 
 def _decode_custom_id(challenge_id: str) -> int | None:
@@ -734,35 +1396,59 @@ def _decode_custom_id(challenge_id: str) -> int | None:
         return None
 
 
+# Имя версии каталога челленджей в data_versions
+CHALLENGE_CATALOG_VERSION = "challenge_catalog"
+
+
+def _bump_data_version(cursor: sqlite3.Cursor, name: str):
+    """Увеличить версию общих данных в текущей транзакции."""
+    cursor.execute(
+        '''
+        INSERT INTO data_versions (name, version) VALUES (?, 1)
+        ON CONFLICT(name) DO UPDATE SET version = version + 1
+        ''',
+        (name,)
+    )
+
+
+def get_data_version(name: str) -> int:
+    """Текущая версия общих данных; читатели сверяют её со своим кэшем."""
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT version FROM data_versions WHERE name = ?", (name,))
+        row = cursor.fetchone()
+    return row[0] if row else 0
+
+
 def fetch_custom_challenges(active_only: bool = True) -> list[dict]:
     """Получить список кастомных челленджей."""
-    conn = _get_connection()
-    cursor = conn.cursor()
-    query = '''
-        SELECT id, title, description, points, co2, co2_quantity_based, active
-        FROM custom_challenges
-    '''
-    if active_only:
-        query += " WHERE active = 1"
-    query += " ORDER BY id ASC"
-    cursor.execute(query)
-    rows = cursor.fetchall()
-    conn.close()
-    result: list[dict] = []
-    for row in rows:
-        challenge_id = f"custom_{row[0]}"
-        result.append(
-            {
-                "challenge_id": challenge_id,
-                "title": row[1],
-                "description": row[2],
-                "points": row[3],
-                "co2": row[4],
-                "co2_quantity_based": bool(row[5]),
-                "active": bool(row[6]),
-            }
-        )
-    return result
+    with _connection() as conn:
+        cursor = conn.cursor()
+        query = '''
+            SELECT id, title, description, points, co2, co2_quantity_based, active, co2_kg
+            FROM custom_challenges
+        '''
+        if active_only:
+            query += " WHERE active = 1"
+        query += " ORDER BY id ASC"
+        cursor.execute(query)
+        rows = cursor.fetchall()
+        result: list[dict] = []
+        for row in rows:
+            challenge_id = f"custom_{row[0]}"
+            result.append(
+                {
+                    "challenge_id": challenge_id,
+                    "title": row[1],
+                    "description": row[2],
+                    "points": row[3],
+                    "co2": row[4],
+                    "co2_kg": row[7],
+                    "co2_quantity_based": bool(row[5]),
+                    "active": bool(row[6]),
+                }
+            )
+        return result
 
 
 def get_custom_challenge(challenge_id: str) -> dict | None:
@@ -770,52 +1456,63 @@ def get_custom_challenge(challenge_id: str) -> dict | None:
     internal_id = _decode_custom_id(challenge_id)
     if internal_id is None:
         return None
-    conn = _get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        '''
-        SELECT id, title, description, points, co2, co2_quantity_based, active
-        FROM custom_challenges
-        WHERE id = ?
-        ''',
-        (internal_id,)
-    )
-    row = cursor.fetchone()
-    conn.close()
-    if not row:
-        return None
-    return {
-        "challenge_id": f"custom_{row[0]}",
-        "title": row[1],
-        "description": row[2],
-        "points": row[3],
-        "co2": row[4],
-        "co2_quantity_based": bool(row[5]),
-        "active": bool(row[6]),
-    }
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            SELECT id, title, description, points, co2, co2_quantity_based, active, co2_kg
+            FROM custom_challenges
+            WHERE id = ?
+            ''',
+            (internal_id,)
+        )
+        row = cursor.fetchone()
+        if not row:
+            return None
+        return {
+            "challenge_id": f"custom_{row[0]}",
+            "title": row[1],
+            "description": row[2],
+            "points": row[3],
+            "co2": row[4],
+            "co2_kg": row[7],
+            "co2_quantity_based": bool(row[5]),
+            "active": bool(row[6]),
+        }
 
 
 def create_custom_challenge(
     title: str,
     description: str,
     points: int,
-    co2: str,
+    co2: str | None,
     co2_quantity_based: bool = False,
+    co2_kg: float | None = None,
 ) -> str:
-    """Создать новый кастомный челлендж и вернуть его идентификатор."""
-    conn = _get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        '''
-        INSERT INTO custom_challenges (title, description, points, co2, co2_quantity_based, active)
-        VALUES (?, ?, ?, ?, ?, 1)
-        ''',
-        (title, description, points, co2, 1 if co2_quantity_based else 0)
-    )
-    challenge_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    return f"custom_{challenge_id}"
+    """
+    Создать новый кастомный челлендж и вернуть его идентификатор.
+
+    ``co2`` — подпись для пользователей, ``co2_kg`` — число для расчётов.
+    Если число не передано, оно один раз извлекается из подписи; если не
+    передана подпись, она строится из числа по шаблону ``format_co2``.
+    """
+    if co2_kg is None:
+        co2_kg = parse_co2_value(co2)
+    if not co2:
+        co2 = format_co2(co2_kg, co2_quantity_based)
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            INSERT INTO custom_challenges (title, description, points, co2, co2_kg, co2_quantity_based, active)
+            VALUES (?, ?, ?, ?, ?, ?, 1)
+            ''',
+            (title, description, points, co2, co2_kg, 1 if co2_quantity_based else 0)
+        )
+        challenge_id = cursor.lastrowid
+        _bump_data_version(cursor, CHALLENGE_CATALOG_VERSION)
+        conn.commit()
+        return f"custom_{challenge_id}"
 
 
 def set_custom_challenge_active(challenge_id: str, active: bool) -> bool:
@@ -823,20 +1520,21 @@ def set_custom_challenge_active(challenge_id: str, active: bool) -> bool:
     internal_id = _decode_custom_id(challenge_id)
     if internal_id is None:
         return False
-    conn = _get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        '''
-        UPDATE custom_challenges
-        SET active = ?
-        WHERE id = ?
-        ''',
-        (1 if active else 0, internal_id)
-    )
-    updated = cursor.rowcount > 0
-    conn.commit()
-    conn.close()
-    return updated
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            UPDATE custom_challenges
+            SET active = ?
+            WHERE id = ?
+            ''',
+            (1 if active else 0, internal_id)
+        )
+        updated = cursor.rowcount > 0
+        if updated:
+            _bump_data_version(cursor, CHALLENGE_CATALOG_VERSION)
+        conn.commit()
+        return updated
 
 
 def delete_custom_challenge(challenge_id: str) -> bool:
@@ -844,102 +1542,203 @@ def delete_custom_challenge(challenge_id: str) -> bool:
     internal_id = _decode_custom_id(challenge_id)
     if internal_id is None:
         return False
-    conn = _get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        '''
-        DELETE FROM custom_challenges
-        WHERE id = ?
-        ''',
-        (internal_id,)
-    )
-    deleted = cursor.rowcount > 0
-    conn.commit()
-    conn.close()
-    return deleted
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            DELETE FROM custom_challenges
+            WHERE id = ?
+            ''',
+            (internal_id,)
+        )
+        deleted = cursor.rowcount > 0
+        if deleted:
+            _bump_data_version(cursor, CHALLENGE_CATALOG_VERSION)
+        conn.commit()
+        return deleted
 
 
 def log_admin_action(admin_id: int, action: str, details: str | None = None):
     """Сохранить действие администратора."""
-    conn = _get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        '''
-        INSERT INTO admin_logs (admin_id, action, details, created_at)
-        VALUES (?, ?, ?, ?)
-        ''',
-        (admin_id, action, details, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-    )
-    conn.commit()
-    conn.close()
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            INSERT INTO admin_logs (admin_id, action, details, created_at)
+            VALUES (?, ?, ?, ?)
+            ''',
+            (admin_id, action, details, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        )
+        conn.commit()
 
 
 def get_admin_logs(limit: int | None = 50) -> list[dict]:
     """Получить последние действия админов."""
-    conn = _get_connection()
-    cursor = conn.cursor()
-    query = '''
-        SELECT id, admin_id, action, details, created_at
-        FROM admin_logs
-        ORDER BY created_at DESC
-    '''
-    params: tuple = ()
+    with _connection() as conn:
+        cursor = conn.cursor()
+        query = '''
+            SELECT id, admin_id, action, details, created_at
+            FROM admin_logs
+            ORDER BY created_at DESC, id ASC
+        '''
+        params: tuple = ()
+        if limit is not None:
+            query += " LIMIT ?"
+            params = (limit,)
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        return [
+            {
+                "id": row[0],
+                "admin_id": row[1],
+                "action": row[2],
+                "details": row[3],
+                "created_at": row[4],
+            }
+            for row in rows
+        ]
+
+
+def get_pending_reports(
+    limit: int | None = None,
+    after: tuple[str, int, str] | None = None,
+    challenge_id: str | None = None,
+    submitted_since: str | None = None,
+    submitted_until: str | None = None,
+) -> list[dict]:
+    """
+    Вернуть отчёты, которые ждут проверки, в порядке отправки.
+
+    Постраничное чтение: ``after`` — ключ (submitted_at, user_id, challenge_id)
+    последнего отчёта предыдущей страницы. Фильтры: челлендж и интервал
+    ``submitted_since <= submitted_at < submitted_until``.
+    """
+    conditions = [_pending_report_condition("uc.")]
+    params: list = []
+    if challenge_id is not None:
+        conditions.append("uc.challenge_id = ?")
+        params.append(challenge_id)
+    if submitted_since is not None:
+        conditions.append("uc.submitted_at >= ?")
+        params.append(submitted_since)
+    if submitted_until is not None:
+        conditions.append("uc.submitted_at < ?")
+        params.append(submitted_until)
+    if after is not None:
+        conditions.append("(uc.submitted_at, uc.user_id, uc.challenge_id) > (?, ?, ?)")
+        params.extend(after)
+    limit_clause = ""
     if limit is not None:
-        query += " LIMIT ?"
-        params = (limit,)
-    cursor.execute(query, params)
-    rows = cursor.fetchall()
-    conn.close()
-    return [
-        {
-            "id": row[0],
-            "admin_id": row[1],
-            "action": row[2],
-            "details": row[3],
-            "created_at": row[4],
-        }
-        for row in rows
-    ]
+        limit_clause = "LIMIT ?"
+        params.append(limit)
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f'''
+            SELECT uc.user_id,
+                   u.username,
+                   u.first_name,
+                   uc.challenge_id,
+                   uc.submitted_at,
+                   uc.photo_file_id,
+                   uc.caption,
+                   uc.attachment_type,
+                   uc.attachment_name,
+                   uc.photo_file_path,
+                   uc.photo_file_path_at
+            FROM user_challenges uc
+            LEFT JOIN users u ON u.user_id = uc.user_id
+            WHERE {" AND ".join(conditions)}
+            ORDER BY uc.submitted_at ASC, uc.user_id ASC, uc.challenge_id ASC
+            {limit_clause}
+            ''',
+            params
+        )
+        rows = cursor.fetchall()
+        return [
+            {
+                "user_id": row[0],
+                "username": row[1],
+                "first_name": row[2],
+                "challenge_id": row[3],
+                "submitted_at": row[4],
+                "photo_file_id": row[5],
+                "caption": row[6],
+                "attachment_type": row[7] or 'photo',
+                "attachment_name": row[8],
+                "photo_file_path": row[9],
+                "photo_file_path_at": row[10],
+            }
+            for row in rows
+        ]
 
 
-def get_pending_reports() -> list[dict]:
-    """Вернуть отчёты, которые ждут проверки."""
-    conn = _get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        '''
-        SELECT uc.user_id,
-               u.username,
-               u.first_name,
-               uc.challenge_id,
-               uc.submitted_at,
-               uc.photo_file_id,
-               uc.caption,
-               uc.attachment_type,
-               uc.attachment_name
-        FROM user_challenges uc
-        LEFT JOIN users u ON u.user_id = uc.user_id
-        WHERE uc.status = 'submitted'
-          AND (uc.review_status IS NULL OR uc.review_status = 'pending')
-        ORDER BY uc.submitted_at ASC
-        '''
-    )
-    rows = cursor.fetchall()
-    conn.close()
-    return [
-        {
-            "user_id": row[0],
-            "username": row[1],
-            "first_name": row[2],
-            "challenge_id": row[3],
-            "submitted_at": row[4],
-            "photo_file_id": row[5],
-            "caption": row[6],
-            "attachment_type": row[7] or 'photo',
-            "attachment_name": row[8],
-        }
-        for row in rows
-    ]
+def count_pending_reports(
+    challenge_id: str | None = None,
+    submitted_since: str | None = None,
+    submitted_until: str | None = None,
+) -> int:
+    """
+    Число отчётов в очереди модерации.
+
+    Без интервала дат значение берётся из счётчика ``pending_report_counts``;
+    с интервалом — считается по частичному индексу только в его пределах.
+    """
+    with _connection() as conn:
+        cursor = conn.cursor()
+        if submitted_since is None and submitted_until is None:
+            if challenge_id is None:
+                cursor.execute("SELECT COALESCE(SUM(pending), 0) FROM pending_report_counts")
+            else:
+                cursor.execute(
+                    "SELECT COALESCE(SUM(pending), 0) FROM pending_report_counts WHERE challenge_id = ?",
+                    (challenge_id,)
+                )
+            return cursor.fetchone()[0]
+
+        conditions = [_pending_report_condition()]
+        params: list = []
+        if challenge_id is not None:
+            conditions.append("challenge_id = ?")
+            params.append(challenge_id)
+        if submitted_since is not None:
+            conditions.append("submitted_at >= ?")
+            params.append(submitted_since)
+        if submitted_until is not None:
+            conditions.append("submitted_at < ?")
+            params.append(submitted_until)
+        cursor.execute(
+            f"SELECT COUNT(*) FROM user_challenges WHERE {' AND '.join(conditions)}",
+            params
+        )
+        return cursor.fetchone()[0]
+
+
+def save_report_file_paths(entries: Sequence[tuple[int, str, str, str]]) -> int:
+    """
+    Запомнить пути файлов отчётов: (user_id, challenge_id, file_id, file_path).
+
+    Путь записывается, только если у отчёта всё ещё тот же file_id.
+    """
+    if not entries:
+        return 0
+    resolved_at = time.time()
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany(
+            '''
+            UPDATE user_challenges
+            SET photo_file_path = ?, photo_file_path_at = ?
+            WHERE user_id = ? AND challenge_id = ? AND photo_file_id = ?
+            ''',
+            [
+                (file_path, resolved_at, user_id, challenge_id, file_id)
+                for user_id, challenge_id, file_id, file_path in entries
+            ]
+        )
+        updated = cursor.rowcount
+        conn.commit()
+        return updated
 
 
 def update_report_review(
@@ -951,11 +1750,91 @@ def update_report_review(
     co2_saved: float | None = None,
 ) -> bool:
     """Обновить статус проверки отчёта."""
-    conn = _get_connection()
-    cursor = conn.cursor()
+    with _connection() as conn:
+        cursor = conn.cursor()
+        updated = _apply_report_review(
+            cursor,
+            user_id,
+            challenge_id,
+            review_status,
+            review_comment,
+            awarded_points,
+            co2_saved,
+            datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        )
+        conn.commit()
+        return updated
+
+
+def resolve_reports_batch(admin_id: int, decisions: Sequence[dict]) -> list[bool]:
+    """
+    Применить решения по нескольким отчётам одной транзакцией.
+
+    Каждое решение — словарь с ключами user_id, challenge_id, review_status и
+    необязательными review_comment, awarded_points, co2_saved, notifications
+    (уведомления для ``notification_outbox``, пишутся только если решение
+    применено). Для применённых решений в admin_logs пишется по записи
+    ``resolve_report`` одним executemany. Возвращает признак применения для
+    каждого решения по порядку.
+    """
     reviewed_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    results: list[bool] = []
+    notifications: list[tuple[str, int | None, dict]] = []
+    with _connection() as conn:
+        cursor = conn.cursor()
+        for decision in decisions:
+            applied = _apply_report_review(
+                cursor,
+                decision["user_id"],
+                decision["challenge_id"],
+                decision["review_status"],
+                decision.get("review_comment"),
+                decision.get("awarded_points"),
+                decision.get("co2_saved"),
+                reviewed_at,
+            )
+            results.append(applied)
+            if applied:
+                notifications.extend(decision.get("notifications") or ())
+        _enqueue_notifications(cursor, notifications)
+        cursor.executemany(
+            '''
+            INSERT INTO admin_logs (admin_id, action, details, created_at)
+            VALUES (?, 'resolve_report', ?, ?)
+            ''',
+            [
+                (
+                    admin_id,
+                    f"{decision['user_id']}:{decision['challenge_id']}:{decision['review_status']}",
+                    reviewed_at,
+                )
+                for decision, applied in zip(decisions, results)
+                if applied
+            ]
+        )
+        conn.commit()
+    return results
+
+
+def _apply_report_review(
+    cursor: sqlite3.Cursor,
+    user_id: int,
+    challenge_id: str,
+    review_status: str,
+    review_comment: str | None,
+    awarded_points: int | None,
+    co2_saved: float | None,
+    reviewed_at: str,
+) -> bool:
+    """Записать решение по отчёту в текущей транзакции вместе со всеми сводками."""
     points_value = awarded_points if review_status == 'approved' else None
     co2_value = co2_saved if review_status == 'approved' else None
+    cursor.execute(
+        "SELECT review_status FROM user_challenges WHERE user_id = ? AND challenge_id = ?",
+        (user_id, challenge_id)
+    )
+    previous = cursor.fetchone()
+    previous_status = previous[0] if previous else None
     cursor.execute(
         '''
         UPDATE user_challenges
@@ -985,6 +1864,7 @@ def update_report_review(
                 accepted_at = NULL,
                 submitted_at = NULL,
                 photo_file_id = NULL,
+                photo_file_path = NULL,
                 caption = NULL,
                 attachment_type = NULL,
                 attachment_name = NULL,
@@ -994,65 +1874,1211 @@ def update_report_review(
             ''',
             (user_id, challenge_id)
         )
-    conn.commit()
-    conn.close()
+    if updated:
+        _refresh_user_stats(cursor, user_id)
+        _refresh_user_weekly_points(cursor, user_id)
+        if 'approved' in (previous_status, review_status):
+            # Баллы пользователя изменились — устарели рейтинги его и друзей
+            _bump_leaderboard_versions(cursor, [user_id], include_friends=True)
+        _record_report_event(cursor, REPORT_EVENT_RESOLVED, user_id, challenge_id, review_status)
     return updated
 
 
-def get_user_review_summary(user_id: int) -> dict[str, int]:
-    """Сводка по статусам проверок пользователя."""
-    conn = _get_connection()
-    cursor = conn.cursor()
+REPORT_EVENT_ADDED = "added"
+REPORT_EVENT_RESOLVED = "resolved"
+
+
+def _record_report_event(
+    cursor: sqlite3.Cursor,
+    kind: str,
+    user_id: int,
+    challenge_id: str,
+    review_status: str | None = None,
+    submitted_at: str | None = None,
+):
+    """Записать событие очереди модерации в той же транзакции, что и само изменение."""
     cursor.execute(
         '''
-        SELECT status, COALESCE(review_status, 'pending')
-        FROM user_challenges
+        INSERT INTO report_events (kind, user_id, challenge_id, review_status, submitted_at, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ''',
+        (
+            kind,
+            user_id,
+            challenge_id,
+            review_status,
+            submitted_at,
+            datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        )
+    )
+
+
+def get_report_events(after_id: int, limit: int = 100) -> list[dict]:
+    """События очереди модерации с ID больше ``after_id`` по порядку."""
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            SELECT id, kind, user_id, challenge_id, review_status, submitted_at, created_at
+            FROM report_events
+            WHERE id > ?
+            ORDER BY id
+            LIMIT ?
+            ''',
+            (after_id, limit)
+        )
+        return [
+            {
+                "id": row[0],
+                "kind": row[1],
+                "user_id": row[2],
+                "challenge_id": row[3],
+                "review_status": row[4],
+                "submitted_at": row[5],
+                "created_at": row[6],
+            }
+            for row in cursor.fetchall()
+        ]
+
+
+def get_last_report_event_id() -> int:
+    """ID последнего события очереди модерации (0, если событий нет)."""
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM report_events")
+        return cursor.fetchone()[0]
+
+
+def purge_report_events(keep_last: int) -> int:
+    """Оставить только ``keep_last`` последних событий ленты."""
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "DELETE FROM report_events WHERE id <= (SELECT COALESCE(MAX(id), 0) FROM report_events) - ?",
+            (keep_last,)
+        )
+        deleted = cursor.rowcount
+        conn.commit()
+        return deleted
+
+
+# Агрегаты по отчётам пользователя; те же правила, что в get_user_review_summary
+_USER_STATS_SELECT = '''
+    SELECT user_id,
+           COALESCE(SUM(CASE WHEN review_status = 'approved' THEN points_awarded END), 0),
+           COALESCE(SUM(CASE WHEN review_status = 'approved' THEN co2_saved END), 0),
+           COUNT(CASE WHEN review_status = 'approved' THEN 1 END),
+           COUNT(CASE WHEN review_status = 'rejected' THEN 1 END),
+           COUNT(CASE WHEN status = 'submitted'
+                       AND (review_status IS NULL OR review_status = 'pending') THEN 1 END),
+           ?
+    FROM user_challenges
+'''
+
+
+def _refresh_user_stats(cursor: sqlite3.Cursor, user_id: int):
+    """Пересчитать сводку пользователя в текущей транзакции."""
+    updated_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    cursor.execute(
+        f'''
+        INSERT INTO user_stats (
+            user_id, total_points, total_co2, approved_count,
+            rejected_count, pending_count, updated_at
+        )
+        {_USER_STATS_SELECT}
         WHERE user_id = ?
+        GROUP BY user_id
+        ON CONFLICT(user_id) DO UPDATE SET
+            total_points = excluded.total_points,
+            total_co2 = excluded.total_co2,
+            approved_count = excluded.approved_count,
+            rejected_count = excluded.rejected_count,
+            pending_count = excluded.pending_count,
+            updated_at = excluded.updated_at
         ''',
-        (user_id,)
+        (updated_at, user_id)
     )
-    rows = cursor.fetchall()
-    conn.close()
-    summary: dict[str, int] = {}
-    for status, review_status in rows:
-        if review_status in (None, 'pending'):
-            if status == 'submitted':
-                summary['pending'] = summary.get('pending', 0) + 1
-        elif review_status in ('approved', 'rejected'):
-            summary[review_status] = summary.get(review_status, 0) + 1
-    return summary
+    if cursor.rowcount == 0:
+        # У пользователя не осталось записей — сводка обнуляется
+        cursor.execute(
+            '''
+            UPDATE user_stats
+            SET total_points = 0, total_co2 = 0, approved_count = 0,
+                rejected_count = 0, pending_count = 0, updated_at = ?
+            WHERE user_id = ?
+            ''',
+            (updated_at, user_id)
+        )
 
 
-def get_user_awarded_points(user_id: int) -> list[tuple[str, int | None, str | None, float | None]]:
-    """Вернуть список одобренных отчётов с начисленными баллами и CO₂."""
-    conn = _get_connection()
-    cursor = conn.cursor()
+def _backfill_approved_rewards(cursor: sqlite3.Cursor):
+    """Старые одобренные отчёты могли сохраниться без баллов/CO₂ — берём их из каталога."""
     cursor.execute(
         '''
-        SELECT challenge_id, points_awarded, reviewed_at, co2_saved
+        UPDATE user_challenges
+        SET points_awarded = COALESCE(points_awarded, (
+                SELECT cc.points FROM custom_challenges cc
+                WHERE 'custom_' || cc.id = user_challenges.challenge_id
+            )),
+            co2_saved = COALESCE(co2_saved, (
+                SELECT cc.co2_kg FROM custom_challenges cc
+                WHERE 'custom_' || cc.id = user_challenges.challenge_id
+            ))
+        WHERE review_status = 'approved'
+          AND (points_awarded IS NULL OR co2_saved IS NULL)
+        '''
+    )
+
+
+def _rebuild_user_stats(cursor: sqlite3.Cursor) -> int:
+    cursor.execute("DELETE FROM user_stats")
+    cursor.execute(
+        f'''
+        INSERT INTO user_stats (
+            user_id, total_points, total_co2, approved_count,
+            rejected_count, pending_count, updated_at
+        )
+        {_USER_STATS_SELECT}
+        GROUP BY user_id
+        ''',
+        (datetime.now().strftime('%Y-%m-%d %H:%M:%S'),)
+    )
+    return cursor.rowcount
+
+
+def rebuild_user_stats() -> int:
+    """Пересобрать user_stats и недельные корзины по всем отчётам. Вернуть число пользователей."""
+    with _connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = conn.cursor()
+            _backfill_approved_rewards(cursor)
+            count = _rebuild_user_stats(cursor)
+            _rebuild_user_weekly_points(cursor)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return count
+
+
+# Неделя начинается в понедельник в 00:01 по Мск. reviewed_at хранится в том же
+# времени, поэтому корзина считается прямо в SQL: сдвигаем на минуту назад
+# и берём ближайший понедельник не позже этой даты.
+_WEEK_START_SQL = "date(reviewed_at, '-1 minute', '-6 days', 'weekday 1')"
+
+
+def get_week_start_msk(now_msk: datetime | None = None) -> str:
+    """Вернуть дату начала текущей недели (Мск) в формате YYYY-MM-DD."""
+    if now_msk is None:
+        now_msk = datetime.utcnow() + timedelta(hours=3)
+    start_date = now_msk.date() - timedelta(days=now_msk.weekday())
+    start_dt = datetime.combine(start_date, datetime.min.time()) + timedelta(minutes=1)
+    if now_msk < start_dt:
+        start_dt -= timedelta(days=7)
+    return start_dt.date().isoformat()
+
+
+def _refresh_user_weekly_points(cursor: sqlite3.Cursor, user_id: int):
+    """Пересчитать недельные корзины пользователя в текущей транзакции."""
+    cursor.execute("DELETE FROM user_weekly_points WHERE user_id = ?", (user_id,))
+    cursor.execute(
+        f'''
+        INSERT INTO user_weekly_points (user_id, week_start, points)
+        SELECT user_id, {_WEEK_START_SQL}, COALESCE(SUM(points_awarded), 0)
         FROM user_challenges
-        WHERE user_id = ? AND review_status = 'approved'
+        WHERE user_id = ? AND review_status = 'approved' AND reviewed_at IS NOT NULL
+        GROUP BY user_id, {_WEEK_START_SQL}
         ''',
         (user_id,)
     )
-    rows = cursor.fetchall()
-    conn.close()
-    return rows
 
 
-def get_user_challenge(user_id: int, challenge_id: str) -> tuple | None:
-    """Получить запись челленджа конкретного пользователя."""
-    conn = _get_connection()
-    cursor = conn.cursor()
+def _rebuild_user_weekly_points(cursor: sqlite3.Cursor):
+    cursor.execute("DELETE FROM user_weekly_points")
     cursor.execute(
-        '''
-        SELECT user_id, challenge_id, status, accepted_at, submitted_at,
-               photo_file_id, caption, review_status, review_comment, reviewed_at
+        f'''
+        INSERT INTO user_weekly_points (user_id, week_start, points)
+        SELECT user_id, {_WEEK_START_SQL}, COALESCE(SUM(points_awarded), 0)
         FROM user_challenges
-        WHERE user_id = ? AND challenge_id = ?
-        ''',
-        (user_id, challenge_id)
+        WHERE review_status = 'approved' AND reviewed_at IS NOT NULL
+        GROUP BY user_id, {_WEEK_START_SQL}
+        '''
     )
-    row = cursor.fetchone()
-    conn.close()
-    return row
+
+
+def get_user_weekly_points(user_id: int, week_start: str | None = None) -> int:
+    """Баллы пользователя за неделю (по умолчанию — текущую)."""
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            SELECT points
+            FROM user_weekly_points
+            WHERE user_id = ? AND week_start = ?
+            ''',
+            (user_id, week_start or get_week_start_msk())
+        )
+        row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def get_user_weekly_history(user_id: int, limit: int = 8) -> list[tuple[str, int]]:
+    """Последние недельные корзины пользователя: (начало недели, баллы), новые первыми."""
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            SELECT week_start, points
+            FROM user_weekly_points
+            WHERE user_id = ?
+            ORDER BY week_start DESC
+            LIMIT ?
+            ''',
+            (user_id, limit)
+        )
+        return cursor.fetchall()
+
+
+def _bump_leaderboard_versions(
+    cursor: sqlite3.Cursor,
+    user_ids: Sequence[int],
+    include_friends: bool = False,
+):
+    """Увеличить версии рейтинга: закэшированные панели этих пользователей устарели."""
+    unique_ids = list(dict.fromkeys(user_ids))
+    if not unique_ids:
+        return
+    placeholders = ",".join("?" * len(unique_ids))
+    friends_part = (
+        f"UNION SELECT friend_id FROM user_friends WHERE user_id IN ({placeholders})"
+        if include_friends
+        else ""
+    )
+    cursor.execute(
+        f'''
+        INSERT INTO leaderboard_versions (user_id, version)
+        SELECT user_id, 1
+        FROM (
+            SELECT value AS user_id FROM json_each(?)
+            {friends_part}
+        )
+        WHERE true
+        ON CONFLICT(user_id) DO UPDATE SET version = version + 1
+        ''',
+        (json.dumps(unique_ids), *(unique_ids if include_friends else ()))
+    )
+
+
+def get_leaderboard_version(user_id: int) -> int:
+    """Версия данных рейтинга друзей пользователя (меняется при изменении баллов или друзей)."""
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT version FROM leaderboard_versions WHERE user_id = ?",
+            (user_id,)
+        )
+        row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def get_friends_leaderboard(user_id: int, week_start: str | None = None) -> list[dict]:
+    """
+    Вернуть баллы пользователя и всех его друзей одним запросом.
+
+    Первым идёт сам пользователь, затем друзья; у каждого — баллы за неделю
+    (корзина week_start, по умолчанию текущая) и за всё время.
+    """
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            WITH participants (user_id, is_self) AS (
+                SELECT ?, 1
+                UNION ALL
+                SELECT friend_id, 0 FROM user_friends WHERE user_id = ? AND friend_id != ?
+            )
+            SELECT participants.user_id,
+                   u.username,
+                   u.first_name,
+                   COALESCE(w.points, 0),
+                   COALESCE(s.total_points, 0)
+            FROM participants
+            LEFT JOIN users AS u ON u.user_id = participants.user_id
+            LEFT JOIN user_stats AS s ON s.user_id = participants.user_id
+            LEFT JOIN user_weekly_points AS w
+                   ON w.user_id = participants.user_id AND w.week_start = ?
+            ORDER BY participants.is_self DESC, participants.user_id ASC
+            ''',
+            (user_id, user_id, user_id, week_start or get_week_start_msk())
+        )
+        rows = cursor.fetchall()
+    return [
+        {
+            "user_id": row[0],
+            "username": row[1],
+            "first_name": row[2],
+            "weekly": row[3],
+            "total": row[4],
+        }
+        for row in rows
+    ]
+
+
+GLOBAL_LEADERBOARD_PERIODS = ("weekly", "all")
+
+
+def _ranking_source(period: str, week_start: str | None) -> tuple[str, str, list[str], tuple]:
+    """Таблица, колонка баллов и условия отбора для периода общего рейтинга."""
+    if period == "weekly":
+        return (
+            "user_weekly_points",
+            "points",
+            ["week_start = ?"],
+            (week_start or get_week_start_msk(),),
+        )
+    if period == "all":
+        return "user_stats", "total_points", [], ()
+    raise ValueError(f"Неизвестный период рейтинга: {period}")
+
+
+def get_global_leaderboard(
+    period: str = "weekly",
+    limit: int = 100,
+    week_start: str | None = None,
+) -> list[dict]:
+    """
+    Топ участников по баллам за неделю или за всё время.
+
+    Читает отсортированный индекс агрегатов (user_stats / user_weekly_points),
+    который обновляется при каждой проверке отчёта, поэтому запрос берёт
+    только первые ``limit`` строк. Одинаковые баллы делят одно место.
+    """
+    table, column, conditions, params = _ranking_source(period, week_start)
+    where = " AND ".join([*(f"r.{condition}" for condition in conditions), f"r.{column} > 0"])
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f'''
+            SELECT r.user_id, u.username, u.first_name, r.{column}
+            FROM {table} AS r
+            LEFT JOIN users AS u ON u.user_id = r.user_id
+            WHERE {where}
+            ORDER BY r.{column} DESC, r.user_id ASC
+            LIMIT ?
+            ''',
+            (*params, limit)
+        )
+        rows = cursor.fetchall()
+    leaderboard: list[dict] = []
+    for position, row in enumerate(rows, start=1):
+        if leaderboard and leaderboard[-1]["points"] == row[3]:
+            rank = leaderboard[-1]["rank"]
+        else:
+            rank = position
+        leaderboard.append(
+            {
+                "rank": rank,
+                "user_id": row[0],
+                "username": row[1],
+                "first_name": row[2],
+                "points": row[3],
+            }
+        )
+    return leaderboard
+
+
+def get_global_rank(
+    user_id: int,
+    period: str = "weekly",
+    week_start: str | None = None,
+) -> dict[str, int]:
+    """
+    Место пользователя в общем рейтинге.
+
+    Место = 1 + число участников с большим количеством баллов; считается по
+    диапазону индекса, без обхода всех отчётов. ``participants`` — сколько
+    пользователей набрали хотя бы один балл за период.
+    """
+    table, column, conditions, params = _ranking_source(period, week_start)
+    prefix = "".join(f"{condition} AND " for condition in conditions)
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT {column} FROM {table} WHERE {prefix}user_id = ?",
+            (*params, user_id)
+        )
+        row = cursor.fetchone()
+        points = row[0] if row else 0
+        cursor.execute(
+            f"SELECT COUNT(*) FROM {table} WHERE {prefix}{column} > ?",
+            (*params, points)
+        )
+        ahead = cursor.fetchone()[0]
+        cursor.execute(
+            f"SELECT COUNT(*) FROM {table} WHERE {prefix}{column} > 0",
+            params
+        )
+        participants = cursor.fetchone()[0]
+    return {
+        "rank": ahead + 1,
+        "points": points,
+        "participants": participants,
+    }
+
+
+def get_user_stats(user_id: int) -> dict[str, int | float]:
+    """Вернуть сводку пользователя: баллы, CO₂ и счётчики отчётов."""
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            SELECT total_points, total_co2, approved_count, rejected_count, pending_count
+            FROM user_stats
+            WHERE user_id = ?
+            ''',
+            (user_id,)
+        )
+        row = cursor.fetchone()
+    if not row:
+        row = (0, 0.0, 0, 0, 0)
+    return {
+        "total_points": row[0],
+        "total_co2": row[1],
+        "approved": row[2],
+        "rejected": row[3],
+        "pending": row[4],
+    }
+
+
+def get_user_review_summary(user_id: int) -> dict[str, int]:
+    """Сводка по статусам проверок пользователя."""
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            SELECT status, COALESCE(review_status, 'pending')
+            FROM user_challenges
+            WHERE user_id = ?
+            ''',
+            (user_id,)
+        )
+        rows = cursor.fetchall()
+        summary: dict[str, int] = {}
+        for status, review_status in rows:
+            if review_status in (None, 'pending'):
+                if status == 'submitted':
+                    summary['pending'] = summary.get('pending', 0) + 1
+            elif review_status in ('approved', 'rejected'):
+                summary[review_status] = summary.get(review_status, 0) + 1
+        return summary
+
+
+def get_user_awarded_points(user_id: int) -> list[tuple[str, int | None, str | None, float | None]]:
+    """Вернуть список одобренных отчётов с начисленными баллами и CO₂."""
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            SELECT challenge_id, points_awarded, reviewed_at, co2_saved
+            FROM user_challenges
+            WHERE user_id = ? AND review_status = 'approved'
+            ''',
+            (user_id,)
+        )
+        rows = cursor.fetchall()
+        return rows
+
+
+def get_user_challenge(user_id: int, challenge_id: str) -> tuple | None:
+    """Получить запись челленджа конкретного пользователя."""
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            SELECT user_id, challenge_id, status, accepted_at, submitted_at,
+                   photo_file_id, caption, review_status, review_comment, reviewed_at
+            FROM user_challenges
+            WHERE user_id = ? AND challenge_id = ?
+            ''',
+            (user_id, challenge_id)
+        )
+        row = cursor.fetchone()
+        return row
+
+
+def get_conversation_state(namespace: str, key: int, now: float) -> str | None:
+    """Значение состояния диалога в JSON или None, если его нет или оно истекло."""
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            SELECT value FROM conversation_state
+            WHERE namespace = ? AND key = ? AND expires_at > ?
+            ''',
+            (namespace, key, now)
+        )
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def set_conversation_state(namespace: str, key: int, value: str, expires_at: float):
+    with _connection() as conn:
+        conn.execute(
+            '''
+            INSERT INTO conversation_state (namespace, key, value, expires_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(namespace, key) DO UPDATE SET
+                value = excluded.value,
+                expires_at = excluded.expires_at
+            ''',
+            (namespace, key, value, expires_at)
+        )
+        conn.commit()
+
+
+def delete_conversation_state(namespace: str, key: int, now: float) -> str | None:
+    """Удалить состояние и вернуть его прежнее значение (None, если оно уже истекло)."""
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            DELETE FROM conversation_state WHERE namespace = ? AND key = ?
+            RETURNING value, expires_at
+            ''',
+            (namespace, key)
+        )
+        row = cursor.fetchone()
+        conn.commit()
+    return row[0] if row and row[1] > now else None
+
+
+def purge_expired_conversation_state(now: float) -> int:
+    """Удалить истёкшие состояния диалогов. Вернуть число удалённых строк."""
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM conversation_state WHERE expires_at <= ?", (now,))
+        deleted = cursor.rowcount
+        conn.commit()
+    return deleted
+
+
+def get_conversation_state_stats() -> dict[str, int]:
+    """Число записей и объём значений в таблице состояний."""
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM conversation_state")
+        entries, value_bytes = cursor.fetchone()
+    return {"entries": entries, "bytes": value_bytes}
+
+
+def get_media_file_id(content_hash: str) -> str | None:
+    """Сохранённый file_id файла с таким содержимым."""
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT file_id FROM media_assets WHERE content_hash = ?", (content_hash,))
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def save_media_file_id(content_hash: str, file_id: str, path: str | None = None):
+    with _connection() as conn:
+        conn.execute(
+            '''
+            INSERT INTO media_assets (content_hash, file_id, path, uploaded_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(content_hash) DO UPDATE SET
+                file_id = excluded.file_id,
+                path = excluded.path,
+                uploaded_at = excluded.uploaded_at
+            ''',
+            (content_hash, file_id, path, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        )
+        conn.commit()
+
+
+def forget_media_file_id(content_hash: str, file_id: str) -> bool:
+    """Забыть отвергнутый Telegram file_id (если его ещё не заменили новым)."""
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "DELETE FROM media_assets WHERE content_hash = ? AND file_id = ?",
+            (content_hash, file_id)
+        )
+        deleted = cursor.rowcount > 0
+        conn.commit()
+    return deleted
+
+
+SEND_BUCKET_GLOBAL = "global"
+
+
+def _refilled_tokens(row: tuple[float, float] | None, rate: float, capacity: float, now: float) -> float:
+    if row is None:
+        return capacity
+    tokens, updated_at = row
+    return min(capacity, tokens + max(0.0, now - updated_at) * rate)
+
+
+def reserve_send_tokens(now: float, rate: float, capacity: float, wanted: int) -> tuple[int, float]:
+    """
+    Взять до ``wanted`` токенов из общей корзины бота одной транзакцией.
+
+    Корзина лежит в ``send_rate_buckets``, поэтому лимит Telegram на токен
+    бота делят все процессы (бот, воркеры админ-панели). Возвращает
+    (сколько токенов выдано, сколько секунд ждать следующего, если не выдано ни одного).
+    """
+    with _connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT tokens, updated_at FROM send_rate_buckets WHERE bucket = ?",
+                (SEND_BUCKET_GLOBAL,)
+            )
+            tokens = _refilled_tokens(cursor.fetchone(), rate, capacity, now)
+            granted = min(wanted, int(tokens))
+            if granted < 1:
+                conn.rollback()
+                return 0, (1 - tokens) / rate
+            cursor.execute(
+                '''
+                INSERT INTO send_rate_buckets (bucket, tokens, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT(bucket) DO UPDATE SET
+                    tokens = excluded.tokens,
+                    updated_at = MAX(updated_at, excluded.updated_at)
+                ''',
+                (SEND_BUCKET_GLOBAL, tokens - granted, now)
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return granted, 0.0
+
+
+def record_dead_letter(chat_id: int, text: str, priority: int, attempts: int, error: str | None) -> int:
+    """Сохранить недоставленное сообщение и вернуть его ID."""
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            INSERT INTO outbound_dead_letters (chat_id, text, priority, attempts, error, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ''',
+            (chat_id, text, priority, attempts, error, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        )
+        conn.commit()
+        return cursor.lastrowid
+
+
+def get_dead_letters(limit: int = 50) -> list[dict]:
+    """Последние недоставленные сообщения."""
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            SELECT id, chat_id, text, priority, attempts, error, created_at
+            FROM outbound_dead_letters
+            ORDER BY id DESC
+            LIMIT ?
+            ''',
+            (limit,)
+        )
+        rows = cursor.fetchall()
+    return [
+        {
+            "id": row[0],
+            "chat_id": row[1],
+            "text": row[2],
+            "priority": row[3],
+            "attempts": row[4],
+            "error": row[5],
+            "created_at": row[6],
+        }
+        for row in rows
+    ]
+
+
+# Статусы рассылки: queued -> running -> completed; cancelled можно возобновить
+BROADCAST_ACTIVE_STATUSES = ("queued", "running")
+
+
+def create_broadcast_job(admin_id: int | None, message: str) -> int:
+    """Создать задание рассылки по всем пользователям и вернуть его ID."""
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            INSERT INTO broadcast_jobs (admin_id, message, status, total, created_at)
+            VALUES (?, ?, 'queued', (SELECT COUNT(*) FROM users), ?)
+            ''',
+            (admin_id, message, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        )
+        conn.commit()
+        return cursor.lastrowid
+
+
+def get_broadcast_job(job_id: int) -> dict | None:
+    """Задание рассылки вместе с числом ещё не обработанных получателей."""
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            SELECT id, admin_id, message, status, total, sent, failed, cursor_user_id,
+                   created_at, started_at, updated_at, finished_at,
+                   (SELECT COUNT(*) FROM users WHERE users.user_id > broadcast_jobs.cursor_user_id),
+                   owner, lease_until
+            FROM broadcast_jobs
+            WHERE id = ?
+            ''',
+            (job_id,)
+        )
+        row = cursor.fetchone()
+    if not row:
+        return None
+    return {
+        "id": row[0],
+        "admin_id": row[1],
+        "message": row[2],
+        "status": row[3],
+        "total": row[4],
+        "sent": row[5],
+        "failed": row[6],
+        "cursor": row[7],
+        "created_at": row[8],
+        "started_at": row[9],
+        "updated_at": row[10],
+        "finished_at": row[11],
+        "remaining": 0 if row[3] == "completed" else row[12],
+        "owner": row[13],
+        "lease_until": row[14],
+    }
+
+
+def get_active_broadcast_job_ids() -> list[int]:
+    """Рассылки, которые нужно (до)выполнить, например после перезапуска."""
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT id FROM broadcast_jobs WHERE status IN (?, ?) ORDER BY id",
+            BROADCAST_ACTIVE_STATUSES
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def get_broadcast_recipients(after_user_id: int, limit: int) -> list[int]:
+    """Следующая пачка получателей по возрастанию user_id."""
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?",
+            (after_user_id, limit)
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def claim_broadcast_job(job_id: int, owner: str, lease_seconds: float) -> bool:
+    """
+    Забрать рассылку на выполнение воркером ``owner``.
+
+    Удаётся, если задание ждёт в очереди, уже принадлежит ``owner`` или его
+    прежний владелец не продлевал аренду дольше ``lease_seconds`` (упал).
+    Одно условное UPDATE: из нескольких воркеров задание получит один.
+    """
+    now = time.time()
+    started_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            UPDATE broadcast_jobs
+            SET status = 'running',
+                owner = ?,
+                lease_until = ?,
+                started_at = COALESCE(started_at, ?),
+                finished_at = NULL,
+                updated_at = ?
+            WHERE id = ? AND (
+                status = 'queued'
+                OR (status = 'running' AND (owner = ? OR lease_until IS NULL OR lease_until < ?))
+            )
+            ''',
+            (owner, now + lease_seconds, started_at, started_at, job_id, owner, now)
+        )
+        claimed = cursor.rowcount > 0
+        conn.commit()
+        return claimed
+
+
+def advance_broadcast_job(
+    job_id: int,
+    owner: str,
+    cursor_user_id: int,
+    sent: int,
+    failed: int,
+    lease_seconds: float,
+) -> bool:
+    """Сдвинуть курсор рассылки после отправленной пачки и продлить аренду.
+
+    Пачку, отменённую на середине, тоже учитываем: сообщения уже ушли.
+    False — задание перешло к другому воркеру, продолжать нельзя.
+    """
+    now = time.time()
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            UPDATE broadcast_jobs
+            SET cursor_user_id = ?, sent = sent + ?, failed = failed + ?, updated_at = ?, lease_until = ?
+            WHERE id = ? AND owner = ? AND status IN ('queued', 'running', 'cancelled')
+            ''',
+            (
+                cursor_user_id,
+                sent,
+                failed,
+                datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                now + lease_seconds,
+                job_id,
+                owner,
+            )
+        )
+        updated = cursor.rowcount > 0
+        conn.commit()
+        return updated
+
+
+def set_broadcast_job_status(
+    job_id: int,
+    status: str,
+    from_statuses: Sequence[str],
+    owner: str | None = None,
+) -> bool:
+    """
+    Перевести рассылку в статус ``status``, если сейчас она в одном из ``from_statuses``.
+
+    С ``owner`` переход выполняется, только пока задание принадлежит этому
+    воркеру. В ``running`` задание переводит ``claim_broadcast_job``.
+    """
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    placeholders = ",".join("?" * len(from_statuses))
+    owner_condition = "AND owner = ?" if owner is not None else ""
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f'''
+            UPDATE broadcast_jobs
+            SET status = ?,
+                finished_at = CASE WHEN ? IN ('completed', 'cancelled') THEN ? ELSE NULL END,
+                lease_until = CASE WHEN ? = 'completed' THEN NULL ELSE lease_until END,
+                updated_at = ?
+            WHERE id = ? AND status IN ({placeholders}) {owner_condition}
+            ''',
+            (status, status, now, status, now, job_id, *from_statuses, *((owner,) if owner is not None else ()))
+        )
+        updated = cursor.rowcount > 0
+        conn.commit()
+        return updated
+
+
+def create_admin_session(token_hash: str, admin_id: int, expires_at: float):
+    """Сохранить сессию админ-панели (в БД хранится только хэш токена)."""
+    with _connection() as conn:
+        conn.execute(
+            "INSERT INTO admin_sessions (token_hash, admin_id, created_at, expires_at) VALUES (?, ?, ?, ?)",
+            (token_hash, admin_id, time.time(), expires_at)
+        )
+        conn.commit()
+
+
+def get_admin_session(token_hash: str, now: float) -> tuple[int, float] | None:
+    """(admin_id, expires_at) действующей сессии или None."""
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT admin_id, expires_at FROM admin_sessions WHERE token_hash = ? AND expires_at > ?",
+            (token_hash, now)
+        )
+        row = cursor.fetchone()
+        return (row[0], row[1]) if row else None
+
+
+def extend_admin_session(token_hash: str, expires_at: float, now: float) -> bool:
+    """Продлить ещё не истёкшую сессию до ``expires_at``."""
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE admin_sessions SET expires_at = ? WHERE token_hash = ? AND expires_at > ?",
+            (expires_at, token_hash, now)
+        )
+        updated = cursor.rowcount > 0
+        conn.commit()
+        return updated
+
+
+def delete_admin_session(token_hash: str) -> bool:
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM admin_sessions WHERE token_hash = ?", (token_hash,))
+        deleted = cursor.rowcount > 0
+        conn.commit()
+        return deleted
+
+
+def purge_expired_admin_sessions(now: float) -> int:
+    """Удалить истёкшие сессии; вернуть их число."""
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM admin_sessions WHERE expires_at <= ?", (now,))
+        deleted = cursor.rowcount
+        conn.commit()
+        return deleted
+
+
+def _enqueue_notifications(cursor: sqlite3.Cursor, notifications: Sequence[tuple[str, int | None, dict]]):
+    """Добавить уведомления (kind, chat_id, payload) в очередь в текущей транзакции."""
+    now = time.time()
+    cursor.executemany(
+        '''
+        INSERT INTO notification_outbox (kind, chat_id, payload, available_at, created_at)
+        VALUES (?, ?, ?, ?, ?)
+        ''',
+        [
+            (kind, chat_id, json.dumps(payload, ensure_ascii=False), now, now)
+            for kind, chat_id, payload in notifications
+        ]
+    )
+
+
+def enqueue_notifications(notifications: Sequence[tuple[str, int | None, dict]]) -> int:
+    """Поставить уведомления (kind, chat_id, payload) в ``notification_outbox``."""
+    if not notifications:
+        return 0
+    with _connection() as conn:
+        cursor = conn.cursor()
+        _enqueue_notifications(cursor, notifications)
+        conn.commit()
+    return len(notifications)
+
+
+def claim_notifications(limit: int, lease_seconds: float) -> list[dict]:
+    """
+    Забрать готовые уведомления на обработку.
+
+    Строка не удаляется, а откладывается на ``lease_seconds``: если обработчик
+    упадёт, её заберут снова. Несколько процессов не получат одну строку дважды.
+    """
+    now = time.time()
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            UPDATE notification_outbox
+            SET available_at = ?, attempts = attempts + 1
+            WHERE id IN (
+                SELECT id FROM notification_outbox
+                WHERE available_at <= ?
+                ORDER BY available_at, id
+                LIMIT ?
+            )
+            RETURNING id, kind, chat_id, payload, attempts
+            ''',
+            (now + lease_seconds, now, limit)
+        )
+        rows = cursor.fetchall()
+        conn.commit()
+    return [
+        {
+            "id": row[0],
+            "kind": row[1],
+            "chat_id": row[2],
+            "payload": json.loads(row[3]),
+            "attempts": row[4],
+        }
+        for row in sorted(rows)
+    ]
+
+
+def complete_notifications(outbox_ids: Sequence[int]) -> int:
+    """Удалить обработанные уведомления."""
+    if not outbox_ids:
+        return 0
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "DELETE FROM notification_outbox WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps(list(outbox_ids)),)
+        )
+        deleted = cursor.rowcount
+        conn.commit()
+        return deleted
+
+
+def defer_notifications(outbox_ids: Sequence[int], delay_seconds: float) -> int:
+    """
+    Перенести уведомления на ``delay_seconds`` от текущего момента.
+
+    Продлевает аренду строк, доставка которых ещё идёт, а с нулевой задержкой
+    возвращает строки в очередь сразу.
+    """
+    if not outbox_ids:
+        return 0
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE notification_outbox SET available_at = ? WHERE id IN (SELECT value FROM json_each(?))",
+            (time.time() + delay_seconds, json.dumps(list(outbox_ids)))
+        )
+        updated = cursor.rowcount
+        conn.commit()
+        return updated
+
+
+def replace_notification(
+    outbox_id: int,
+    notifications: Sequence[tuple[str, int | None, dict]],
+    digest_events: Sequence[tuple[int, dict]] = (),
+    digest_flush_at: float | None = None,
+) -> bool:
+    """
+    Заменить уведомление на производные (рассылку друзьям) одной транзакцией.
+
+    ``digest_events`` — пары (получатель, событие), которые копятся в сводке
+    получателя. Сводка уйдёт не раньше ``digest_flush_at``; окно отсчитывается
+    от первого накопленного события.
+    """
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM notification_outbox WHERE id = ?", (outbox_id,))
+        replaced = cursor.rowcount > 0
+        if replaced:
+            _enqueue_notifications(cursor, notifications)
+            if digest_events:
+                now = time.time()
+                cursor.executemany(
+                    "INSERT INTO friend_digest_events (recipient_id, payload, created_at) VALUES (?, ?, ?)",
+                    [
+                        (recipient_id, json.dumps(event, ensure_ascii=False), now)
+                        for recipient_id, event in digest_events
+                    ]
+                )
+                cursor.executemany(
+                    '''
+                    INSERT INTO friend_digest_due (recipient_id, flush_at) VALUES (?, ?)
+                    ON CONFLICT(recipient_id) DO NOTHING
+                    ''',
+                    [(recipient_id, digest_flush_at or now) for recipient_id, _ in digest_events]
+                )
+        conn.commit()
+        return replaced
+
+
+def count_pending_notifications() -> int:
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM notification_outbox")
+        return cursor.fetchone()[0]
+
+
+def get_friend_digest(user_id: int) -> bool:
+    """Включена ли у пользователя сводка о заданиях друзей."""
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT friend_digest FROM notification_settings WHERE user_id = ?", (user_id,))
+        row = cursor.fetchone()
+        return bool(row and row[0])
+
+
+def set_friend_digest(user_id: int, enabled: bool):
+    """
+    Включить или выключить сводку о заданиях друзей.
+
+    При выключении накопленные события уйдут при ближайшей выгрузке,
+    не дожидаясь конца окна.
+    """
+    now = time.time()
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            INSERT INTO notification_settings (user_id, friend_digest, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                friend_digest = excluded.friend_digest,
+                updated_at = excluded.updated_at
+            ''',
+            (user_id, int(enabled), now)
+        )
+        if not enabled:
+            cursor.execute(
+                "UPDATE friend_digest_due SET flush_at = ? WHERE recipient_id = ? AND flush_at > ?",
+                (now, user_id, now)
+            )
+        conn.commit()
+
+
+def get_friend_digest_recipients(user_ids: Sequence[int]) -> set[int]:
+    """Вернуть тех из ``user_ids``, кто получает задания друзей сводкой."""
+    if not user_ids:
+        return set()
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            SELECT user_id FROM notification_settings
+            WHERE user_id IN (SELECT value FROM json_each(?)) AND friend_digest = 1
+            ''',
+            (json.dumps(list(user_ids)),)
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+
+def flush_friend_digests(kind: str, now: float, limit: int) -> int:
+    """
+    Переложить созревшие сводки в ``notification_outbox``.
+
+    Накопленные события каждого получателя, чьё окно истекло к ``now``,
+    удаляются и становятся одним уведомлением ``kind`` с payload
+    ``{"events": [...]}`` — в одной транзакции, так что события не теряются
+    и не уходят дважды. Возвращает число поставленных сводок.
+    """
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            DELETE FROM friend_digest_due
+            WHERE recipient_id IN (
+                SELECT recipient_id FROM friend_digest_due
+                WHERE flush_at <= ?
+                ORDER BY flush_at
+                LIMIT ?
+            )
+            RETURNING recipient_id
+            ''',
+            (now, limit)
+        )
+        recipient_ids = [row[0] for row in cursor.fetchall()]
+        events: dict[int, list[dict]] = {}
+        if recipient_ids:
+            cursor.execute(
+                '''
+                DELETE FROM friend_digest_events
+                WHERE recipient_id IN (SELECT value FROM json_each(?))
+                RETURNING recipient_id, id, payload
+                ''',
+                (json.dumps(recipient_ids),)
+            )
+            for recipient_id, _, payload in sorted(cursor.fetchall()):
+                events.setdefault(recipient_id, []).append(json.loads(payload))
+            _enqueue_notifications(
+                cursor,
+                [(kind, recipient_id, {"events": items}) for recipient_id, items in events.items()]
+            )
+        conn.commit()
+        return len(events)
+
+
+def count_buffered_friend_digest_events(recipient_id: int) -> int:
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM friend_digest_events WHERE recipient_id = ?", (recipient_id,))
+        return cursor.fetchone()[0]
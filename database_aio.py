@@ -0,0 +1,69 @@
+"""
+Асинхронный фасад над database.py.
+
+Запросы к SQLite выполняются в ограниченном пуле потоков, чтобы обработчики
+aiogram и FastAPI не блокировали event loop. Любая публичная функция из
+database.py доступна здесь же как корутина:
+
+    import database_aio as db
+    friends = await db.get_friends(user_id)
+
+Для прочих синхронных функций, которые ходят в БД, есть ``run``.
+"""
+
+import asyncio
+import functools
+import os
+import threading
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, TypeVar
+
+import database
+
+DB_WORKERS = max(1, int(os.getenv("ECOSTEP_DB_WORKERS", str(database.DB_POOL_SIZE))))
+
+T = TypeVar("T")
+
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=DB_WORKERS,
+                    thread_name_prefix="ecostep-db",
+                )
+    return _executor
+
+
+async def run(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Выполнить синхронную функцию в пуле потоков БД."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), functools.partial(func, *args, **kwargs))
+
+
+def shutdown():
+    """Остановить пул потоков (при завершении процесса)."""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+def __getattr__(name: str):
+    target = getattr(database, name, None)
+    if name.startswith("_") or not callable(target) or getattr(target, "__module__", None) != database.__name__:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    @functools.wraps(target)
+    async def wrapper(*args: Any, **kwargs: Any):
+        return await run(target, *args, **kwargs)
+
+    globals()[name] = wrapper
+    return wrapper
@@ -1,15 +1,72 @@
 import asyncio
 import logging
+import os
 from aiogram.types import Message
+from aiohttp import web
 from bot_core import dp, bot
 from bot_routes import start, analytics
-from database import init_db, register_user
+import database_aio
+from database import close_connections, init_db
 from support_tools.bot_commands import setup_bot_commands
+from support_tools.send_queue import send_queue
+from support_tools.state_store import state_store
+from support_tools.user_registry import user_registry
+from support_tools.webhook import create_webhook_app
 
 # Подключаем обработчики
 dp.include_router(start.router)
 dp.include_router(analytics.router)
 
+STATE_SWEEP_SECONDS = max(1, int(os.getenv("ECOSTEP_STATE_SWEEP_SECONDS", "300")))
+
+# Режим получения обновлений: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv("ECOSTEP_BOT_MODE", "polling").strip().lower()
+WEBHOOK_URL = os.getenv("ECOSTEP_WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("ECOSTEP_WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET = os.getenv("ECOSTEP_WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("ECOSTEP_WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("ECOSTEP_WEBHOOK_PORT", "8080"))
+WEBHOOK_WORKERS = max(1, int(os.getenv("ECOSTEP_WEBHOOK_WORKERS", "8")))
+WEBHOOK_QUEUE_SIZE = max(1, int(os.getenv("ECOSTEP_WEBHOOK_QUEUE_SIZE", "1000")))
+
+
+async def state_store_maintenance():
+    """Периодически чистить истёкшие состояния и писать метрику хранилища в лог."""
+    while True:
+        await asyncio.sleep(STATE_SWEEP_SECONDS)
+        try:
+            removed = await state_store.sweep()
+            logging.info("Conversation state: %s, expired removed=%s", await state_store.stats(), removed)
+        except Exception:
+            logging.exception("Не удалось обслужить хранилище состояний")
+
+
+async def run_webhook():
+    """Принимать обновления через webhook, пока процесс не остановят."""
+    app = create_webhook_app(
+        dp,
+        bot,
+        WEBHOOK_SECRET,
+        path=WEBHOOK_PATH,
+        workers=WEBHOOK_WORKERS,
+        queue_size=WEBHOOK_QUEUE_SIZE,
+    )
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    try:
+        if WEBHOOK_URL:
+            await bot.set_webhook(
+                f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=dp.resolve_used_update_types(),
+            )
+        logging.info("Webhook listening on %s:%s%s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
 # Middleware для автоматической регистрации
 async def register_middleware(handler, event, data):
     """Middleware для регистрации пользователей"""
@@ -17,21 +74,35 @@ async def register_middleware(handler, event, data):
         user_id = event.from_user.id
         username = event.from_user.username or "неизвестно"
         first_name = event.from_user.first_name or "Пользователь"
-        register_user(user_id, username, first_name)
+        # Известные профили не трогают БД; новые пишутся сразу, изменённые — пачкой в фоне
+        await user_registry.note(user_id, username, first_name)
     
     return await handler(event, data)
 
 async def main():
+    logging.basicConfig(level=logging.INFO)
     # Инициализация базы данных
     init_db()
+    await user_registry.warm_up()
+    user_registry.start()
+    maintenance = asyncio.create_task(state_store_maintenance())
     await setup_bot_commands(bot)
     
     # Подключаем middleware для регистрации
     dp.message.middleware(register_middleware)
     
-    logging.basicConfig(level=logging.INFO)
     print("Bot is running...")
-    await dp.start_polling(bot)
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook()
+        else:
+            await dp.start_polling(bot)
+    finally:
+        maintenance.cancel()
+        await send_queue.stop()
+        await user_registry.stop()
+        database_aio.shutdown()
+        close_connections()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -1,54 +1,78 @@
-from database import fetch_custom_challenges, get_custom_challenge
+import threading
+from collections.abc import Mapping
+from types import MappingProxyType
 
-Challenge = dict[str, str | int | bool]
+from database import CHALLENGE_CATALOG_VERSION, fetch_custom_challenges, get_data_version
+
+# points — целое число баллов, co2_kg — число для расчётов (или None),
+# co2 — подпись экономии CO₂ для пользователя
+Challenge = Mapping[str, str | int | float | bool | None]
 
 
 DEFAULT_CHALLENGES: dict[str, Challenge] = {}
 
+# Неизменяемый снимок каталога: (версия из data_versions, челленджи).
+# Админка увеличивает версию при каждом изменении кастомных челленджей,
+# поэтому и бот, и админ-панель перечитывают каталог только после правок.
+_catalog_snapshot: tuple[int, Mapping[str, Challenge]] | None = None
+_catalog_lock = threading.Lock()
 
-def get_challenge(challenge_id: str) -> Challenge | None:
-    """Получить описание челленджа по его идентификатору."""
-    if challenge_id in DEFAULT_CHALLENGES:
-        challenge = DEFAULT_CHALLENGES[challenge_id].copy()
-        challenge.setdefault("co2_quantity_based", False)
-        return challenge
-
-    challenge = get_custom_challenge(challenge_id)
-    if not challenge or not challenge.get("active", True):
-        return None
-
-    points_value = challenge["points"]
-    quantity_based = bool(challenge.get("co2_quantity_based", False))
-    return {
-        "title": challenge["title"],
-        "description": challenge["description"],
-        "points": f"{points_value} баллов",
-        "points_value": points_value,
-        "co2": challenge["co2"],
-        "source": "custom",
-        "challenge_id": challenge_id,
-        "co2_quantity_based": quantity_based,
-    }
-
-
-def get_all_challenges() -> dict[str, Challenge]:
-    """Вернуть полный список челленджей."""
+
+def _build_catalog() -> dict[str, Challenge]:
     challenges: dict[str, Challenge] = {}
     for challenge_id, data in DEFAULT_CHALLENGES.items():
-        copy = data.copy()
+        copy = dict(data)
         copy.setdefault("co2_quantity_based", False)
-        challenges[challenge_id] = copy
+        challenges[challenge_id] = MappingProxyType(copy)
     for custom in fetch_custom_challenges(active_only=True):
         challenge_id = custom["challenge_id"]
-        points_value = custom["points"]
-        challenges[challenge_id] = {
+        challenges[challenge_id] = MappingProxyType({
             "title": custom["title"],
             "description": custom["description"],
-            "points": f"{points_value} баллов",
-            "points_value": points_value,
+            "points": custom["points"],
             "co2": custom["co2"],
+            "co2_kg": custom["co2_kg"],
             "source": "custom",
             "challenge_id": challenge_id,
             "co2_quantity_based": bool(custom.get("co2_quantity_based", False)),
-        }
+        })
     return challenges
+
+
+def _get_catalog() -> Mapping[str, Challenge]:
+    """Снимок активных челленджей; перестраивается, только если версия в БД изменилась."""
+    global _catalog_snapshot
+    # Версию читаем до выборки: снимок не может оказаться старее своей версии
+    version = get_data_version(CHALLENGE_CATALOG_VERSION)
+    snapshot = _catalog_snapshot
+    if snapshot is not None and snapshot[0] == version:
+        return snapshot[1]
+    with _catalog_lock:
+        snapshot = _catalog_snapshot
+        if snapshot is not None and snapshot[0] == version:
+            return snapshot[1]
+        catalog = MappingProxyType(_build_catalog())
+        _catalog_snapshot = (version, catalog)
+        return catalog
+
+
+def format_points(points: int) -> str:
+    """Подпись награды для сообщений бота."""
+    return f"{points} баллов"
+
+
+def invalidate_catalog():
+    """Сбросить снимок каталога (например, после замены файла БД)."""
+    global _catalog_snapshot
+    with _catalog_lock:
+        _catalog_snapshot = None
+
+
+def get_challenge(challenge_id: str) -> Challenge | None:
+    """Получить описание активного челленджа по его идентификатору."""
+    return _get_catalog().get(challenge_id)
+
+
+def get_all_challenges() -> Mapping[str, Challenge]:
+    """Вернуть полный список челленджей (только для чтения)."""
+    return _get_catalog()
@@ -0,0 +1,147 @@
+"""
+Сессии админ-панели, общие для всех воркеров uvicorn.
+
+* Токены хранятся в таблице ``admin_sessions`` только в виде SHA-256, так что
+  утечка базы не даёт войти в панель.
+* Сессия живёт ``ECOSTEP_ADMIN_SESSION_TTL_SECONDS`` с последнего обращения
+  (скользящее продление). Срок в БД продлевается не чаще раза в
+  ``ECOSTEP_ADMIN_SESSION_CACHE_SECONDS``, а не на каждый запрос.
+* Каждый воркер держит LRU недавно проверенных токенов
+  (``ECOSTEP_ADMIN_SESSION_CACHE_SIZE``) и ходит в БД не чаще раза в
+  ``ECOSTEP_ADMIN_SESSION_CACHE_SECONDS`` на токен. Выход в одном воркере
+  другие воркеры заметят не позже чем через этот интервал.
+* Истёкшие сессии удаляет фоновая задача раз в
+  ``ECOSTEP_ADMIN_SESSION_SWEEP_SECONDS`` (``start``/``stop``).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import os
+import secrets
+import time
+from collections import OrderedDict
+
+import database_aio
+
+logger = logging.getLogger(__name__)
+
+ADMIN_SESSION_TTL_SECONDS = max(60, int(os.getenv("ECOSTEP_ADMIN_SESSION_TTL_SECONDS", "43200")))
+ADMIN_SESSION_CACHE_SIZE = max(0, int(os.getenv("ECOSTEP_ADMIN_SESSION_CACHE_SIZE", "1000")))
+ADMIN_SESSION_CACHE_SECONDS = max(0, int(os.getenv("ECOSTEP_ADMIN_SESSION_CACHE_SECONDS", "30")))
+ADMIN_SESSION_SWEEP_SECONDS = max(1, int(os.getenv("ECOSTEP_ADMIN_SESSION_SWEEP_SECONDS", "600")))
+
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class _Validated:
+    __slots__ = ("admin_id", "expires_at", "checked_at")
+
+    def __init__(self, admin_id: int, expires_at: float, checked_at: float):
+        self.admin_id = admin_id
+        self.expires_at = expires_at
+        self.checked_at = checked_at
+
+
+class AdminSessionStore:
+    """Выдаёт и проверяет токены админ-панели."""
+
+    def __init__(
+        self,
+        ttl_seconds: int = ADMIN_SESSION_TTL_SECONDS,
+        cache_size: int = ADMIN_SESSION_CACHE_SIZE,
+        cache_seconds: int = ADMIN_SESSION_CACHE_SECONDS,
+        sweep_seconds: float = ADMIN_SESSION_SWEEP_SECONDS,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.cache_size = cache_size
+        self.cache_seconds = cache_seconds
+        self.sweep_seconds = sweep_seconds
+        self._sweeper: asyncio.Task | None = None
+        self.hits = 0
+        self.misses = 0
+        # Ключ — хэш токена, чтобы открытые токены не лежали в памяти дольше запроса
+        self._cache: OrderedDict[str, _Validated] = OrderedDict()
+
+    async def create(self, admin_id: int) -> str:
+        """Создать сессию и вернуть открытый токен (в БД попадает только хэш)."""
+        token = secrets.token_urlsafe(32)
+        now = time.time()
+        token_hash = hash_token(token)
+        expires_at = now + self.ttl_seconds
+        await database_aio.create_admin_session(token_hash, admin_id, expires_at)
+        self._remember(token_hash, _Validated(admin_id, expires_at, now))
+        return token
+
+    async def validate(self, token: str) -> int | None:
+        """admin_id действующей сессии (со скользящим продлением) или None."""
+        now = time.time()
+        token_hash = hash_token(token)
+        entry = self._cache.get(token_hash)
+        if entry is not None and now - entry.checked_at < self.cache_seconds and entry.expires_at > now:
+            self._cache.move_to_end(token_hash)
+            self.hits += 1
+            return entry.admin_id
+
+        self.misses += 1
+        session = await database_aio.get_admin_session(token_hash, now)
+        if session is None:
+            self._cache.pop(token_hash, None)
+            return None
+        admin_id, _ = session
+        expires_at = now + self.ttl_seconds
+        await database_aio.extend_admin_session(token_hash, expires_at, now)
+        self._remember(token_hash, _Validated(admin_id, expires_at, now))
+        return admin_id
+
+    async def revoke(self, token: str) -> bool:
+        token_hash = hash_token(token)
+        self._cache.pop(token_hash, None)
+        return await database_aio.delete_admin_session(token_hash)
+
+    def _remember(self, token_hash: str, entry: _Validated):
+        if self.cache_size <= 0:
+            return
+        self._cache[token_hash] = entry
+        self._cache.move_to_end(token_hash)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def sweep(self) -> int:
+        """Удалить истёкшие сессии из БД и из кэша воркера."""
+        now = time.time()
+        self._cache = OrderedDict(
+            (token_hash, entry) for token_hash, entry in self._cache.items() if entry.expires_at > now
+        )
+        return await database_aio.purge_expired_admin_sessions(now)
+
+    async def _sweep_forever(self):
+        while True:
+            await asyncio.sleep(self.sweep_seconds)
+            try:
+                removed = await self.sweep()
+                if removed:
+                    logger.info("Удалено истёкших сессий админ-панели: %s", removed)
+            except Exception:
+                logger.exception("Не удалось удалить истёкшие сессии админ-панели")
+
+    async def start(self):
+        """Запустить периодическую очистку истёкших сессий."""
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep_forever())
+
+    async def stop(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+
+    def stats(self) -> dict[str, int]:
+        return {"cached": len(self._cache), "hits": self.hits, "misses": self.misses}
+
+
+admin_sessions = AdminSessionStore()
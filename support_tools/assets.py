@@ -0,0 +1,101 @@
+"""
+Реестр баннеров: каждая картинка загружается в Telegram один раз.
+
+После первой отправки ``file_id`` из ответа Telegram сохраняется в таблице
+``media_assets`` по SHA-256 содержимого файла и дальше отправляется вместо
+файла. Изменился файл — изменился хэш, и баннер загрузится заново. Если
+Telegram отверг сохранённый ``file_id``, он забывается, а файл загружается
+повторно. Прочие ошибки отправки (разметка подписи, недоступный чат)
+пробрасываются как есть: сохранённый ``file_id`` в них не виноват.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import os
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, Message
+
+import database_aio
+
+logger = logging.getLogger(__name__)
+
+# Фрагменты текста TelegramBadRequest, по которым видно, что отвергнут именно file_id
+_REJECTED_FILE_ID_MARKERS = ("wrong file identifier", "file_id", "wrong remote file")
+
+
+def _file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(65536), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _file_id_rejected(error: TelegramBadRequest) -> bool:
+    text = error.message.lower()
+    return any(marker in text for marker in _REJECTED_FILE_ID_MARKERS)
+
+
+class AssetRegistry:
+    """Кэш file_id баннеров: в памяти процесса и в БД."""
+
+    def __init__(self):
+        # path -> (mtime_ns, size, хэш): файл перечитывается, только если он изменился
+        self._hashes: dict[str, tuple[int, int, str]] = {}
+        self._file_ids: dict[str, str] = {}
+        self._upload_locks: dict[str, asyncio.Lock] = {}
+
+    async def content_hash(self, path: str) -> str:
+        stat = os.stat(path)
+        cached = self._hashes.get(path)
+        if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+        content_hash = await asyncio.to_thread(_file_hash, path)
+        self._hashes[path] = (stat.st_mtime_ns, stat.st_size, content_hash)
+        return content_hash
+
+    async def _known_file_id(self, content_hash: str) -> str | None:
+        file_id = self._file_ids.get(content_hash)
+        if file_id is None:
+            file_id = await database_aio.get_media_file_id(content_hash)
+            if file_id is not None:
+                self._file_ids[content_hash] = file_id
+        return file_id
+
+    async def _forget(self, content_hash: str, file_id: str):
+        if self._file_ids.get(content_hash) == file_id:
+            del self._file_ids[content_hash]
+        await database_aio.forget_media_file_id(content_hash, file_id)
+
+    async def answer_photo(self, message: Message, path: str, **kwargs) -> Message:
+        """Ответить баннером ``path``, по возможности без повторной загрузки файла."""
+        content_hash = await self.content_hash(path)
+        file_id = await self._known_file_id(content_hash)
+        if file_id is not None:
+            try:
+                return await message.answer_photo(photo=file_id, **kwargs)
+            except TelegramBadRequest as error:
+                if not _file_id_rejected(error):
+                    raise
+                logger.warning("Telegram отверг file_id баннера %s (%s), загружаем заново", path, error)
+                await self._forget(content_hash, file_id)
+
+        lock = self._upload_locks.setdefault(content_hash, asyncio.Lock())
+        async with lock:
+            # Пока ждали, баннер мог загрузить параллельный обработчик
+            file_id = self._file_ids.get(content_hash)
+            if file_id is not None:
+                return await message.answer_photo(photo=file_id, **kwargs)
+            sent = await message.answer_photo(photo=FSInputFile(path), **kwargs)
+            if sent.photo:
+                file_id = sent.photo[-1].file_id
+                self._file_ids[content_hash] = file_id
+                await database_aio.save_media_file_id(content_hash, file_id, path)
+            return sent
+
+
+asset_registry = AssetRegistry()
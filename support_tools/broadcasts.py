@@ -0,0 +1,153 @@
+"""
+Фоновые рассылки из админ-панели.
+
+Задание хранится в таблице ``broadcast_jobs`` вместе с курсором по
+``users.user_id``. Обработчик берёт получателей пачками по
+``ECOSTEP_BROADCAST_BATCH_SIZE``, отправляет их через ``send_queue`` с
+приоритетом рассылки (не больше ``ECOSTEP_BROADCAST_CONCURRENCY``
+сообщений одновременно) и после каждой пачки сдвигает курсор и счётчики.
+
+Задание выполняет один воркер: он забирает его условным UPDATE
+(``claim_broadcast_job``) с арендой на ``ECOSTEP_BROADCAST_LEASE_SECONDS`` и
+продлевает аренду после каждой пачки. Остальные воркеры uvicorn задание не
+трогают, пока аренда не истечёт; после этого его подхватывает любой из них
+(``watch`` раз в срок аренды вызывает ``resume_pending``).
+
+Отмена проверяется между пачками. Задания в статусах ``queued``/``running``
+продолжаются с курсора после перезапуска; пачка, прерванная посередине, при
+этом отправляется повторно.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import secrets
+from datetime import datetime
+
+import database_aio
+from support_tools.send_queue import PRIORITY_BULK, send_queue
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_BATCH_SIZE = max(1, int(os.getenv("ECOSTEP_BROADCAST_BATCH_SIZE", "200")))
+BROADCAST_CONCURRENCY = max(1, int(os.getenv("ECOSTEP_BROADCAST_CONCURRENCY", "20")))
+BROADCAST_LEASE_SECONDS = max(5, int(os.getenv("ECOSTEP_BROADCAST_LEASE_SECONDS", "300")))
+
+
+class BroadcastRunner:
+    """Выполняет задания рассылки в фоновых задачах, по одной на задание."""
+
+    def __init__(
+        self,
+        sender=None,
+        batch_size: int = BROADCAST_BATCH_SIZE,
+        concurrency: int = BROADCAST_CONCURRENCY,
+        lease_seconds: float = BROADCAST_LEASE_SECONDS,
+    ):
+        self._sender = sender or send_queue
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        # Уникален для процесса и экземпляра: по нему воркер узнаёт свои задания
+        self.owner = f"{os.getpid()}:{secrets.token_hex(4)}"
+        self._tasks: dict[int, asyncio.Task] = {}
+        self._watcher: asyncio.Task | None = None
+
+    def start(self, job_id: int) -> asyncio.Task:
+        """Запустить обработку задания, если она ещё не идёт."""
+        task = self._tasks.get(job_id)
+        if task is None or task.done():
+            task = asyncio.create_task(self._run(job_id))
+            self._tasks[job_id] = task
+            task.add_done_callback(lambda _: self._forget(job_id, task))
+        return task
+
+    def _forget(self, job_id: int, task: asyncio.Task):
+        if self._tasks.get(job_id) is task:
+            del self._tasks[job_id]
+
+    async def resume_pending(self) -> list[int]:
+        """Попробовать забрать незавершённые задания (после перезапуска или падения воркера)."""
+        job_ids = await database_aio.get_active_broadcast_job_ids()
+        for job_id in job_ids:
+            self.start(job_id)
+        return job_ids
+
+    async def _watch_forever(self):
+        while True:
+            try:
+                await self.resume_pending()
+            except Exception:
+                logger.exception("Не удалось проверить незавершённые рассылки")
+            await asyncio.sleep(self.lease_seconds)
+
+    async def watch(self):
+        """Подхватывать незавершённые задания сейчас и раз в срок аренды."""
+        if self._watcher is None or self._watcher.done():
+            self._watcher = asyncio.create_task(self._watch_forever())
+
+    async def _run(self, job_id: int):
+        if not await database_aio.claim_broadcast_job(job_id, self.owner, self.lease_seconds):
+            return
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def deliver(user_id: int, text: str) -> bool:
+            async with semaphore:
+                return await self._sender.send_message(user_id, text, priority=PRIORITY_BULK) is not None
+
+        try:
+            while True:
+                job = await database_aio.get_broadcast_job(job_id)
+                if job is None or job["status"] not in ("queued", "running"):
+                    return
+                if job["status"] == "queued":
+                    # Отменили и возобновили, пока эта задача дорабатывала пачку
+                    if not await database_aio.claim_broadcast_job(job_id, self.owner, self.lease_seconds):
+                        return
+                elif job["owner"] != self.owner:
+                    return
+                recipients = await database_aio.get_broadcast_recipients(job["cursor"], self.batch_size)
+                if not recipients:
+                    await database_aio.set_broadcast_job_status(job_id, "completed", ("running",), self.owner)
+                    logger.info("Рассылка %s завершена: sent=%s, failed=%s", job_id, job["sent"], job["failed"])
+                    return
+                results = await asyncio.gather(*(deliver(user_id, job["message"]) for user_id in recipients))
+                sent = sum(results)
+                if not await database_aio.advance_broadcast_job(
+                    job_id, self.owner, recipients[-1], sent, len(results) - sent, self.lease_seconds
+                ):
+                    logger.warning("Рассылка %s перешла к другому воркеру", job_id)
+                    return
+        except Exception:
+            # Задание остаётся в статусе running и продолжится при следующем resume
+            logger.exception("Сбой рассылки %s", job_id)
+
+    async def stop(self):
+        """Остановить обработку; задания продолжатся с курсора при следующем запуске."""
+        if self._watcher is not None:
+            self._watcher.cancel()
+            await asyncio.gather(self._watcher, return_exceptions=True)
+            self._watcher = None
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+
+
+def broadcast_throughput(job: dict) -> float | None:
+    """Средняя скорость обработки получателей (сообщений в секунду)."""
+    if not job.get("started_at"):
+        return None
+    end = job.get("finished_at") or job.get("updated_at")
+    if not end:
+        return None
+    fmt = "%Y-%m-%d %H:%M:%S"
+    elapsed = (datetime.strptime(end, fmt) - datetime.strptime(job["started_at"], fmt)).total_seconds()
+    processed = job["sent"] + job["failed"]
+    return round(processed / max(elapsed, 1.0), 2)
+
+
+broadcast_runner = BroadcastRunner()
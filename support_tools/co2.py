@@ -25,3 +25,28 @@ def parse_co2_value(raw_value: str | None) -> float | None:
         return float(normalized)
     except ValueError:
         return None
+
+
+CO2_UNIT = "кг CO₂"
+
+
+def format_co2_amount(value: float | None) -> str:
+    """Format a kilogram amount without trailing zeros: 1.50 -> "1.5"."""
+    if not value or value <= 0:
+        return "0"
+    formatted = f"{value:.2f}"
+    if "." in formatted:
+        formatted = formatted.rstrip("0").rstrip(".")
+    return formatted
+
+
+def format_co2(co2_kg: float | None, quantity_based: bool = False) -> str:
+    """
+    Build the user-facing CO₂ label from the numeric value, e.g. "0.2 кг CO₂".
+
+    Quantity-based challenges get a per-unit suffix.
+    """
+    label = f"{format_co2_amount(co2_kg)} {CO2_UNIT}"
+    if quantity_based:
+        label += " за единицу"
+    return label
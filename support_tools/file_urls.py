@@ -0,0 +1,144 @@
+"""
+Ссылки на файлы отчётов для админ-панели.
+
+Чтобы получить URL файла, нужен ``bot.get_file`` — отдельный запрос к
+Telegram. Путь файла (``file_path``) Telegram гарантирует минимум на час,
+поэтому:
+
+* пути кэшируются в памяти по ``file_id`` на ``ECOSTEP_FILE_URL_TTL_SECONDS``;
+* найденный путь сохраняется в ``user_challenges.photo_file_path``, и после
+  перезапуска админ-панели свежие пути берутся из БД без запросов;
+* недостающие и устаревшие пути запрашиваются лениво, при показе отчётов,
+  параллельно, но не больше ``ECOSTEP_FILE_URL_CONCURRENCY`` запросов сразу.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+
+import database_aio
+
+logger = logging.getLogger(__name__)
+
+FILE_URL_TTL_SECONDS = max(0.0, float(os.getenv("ECOSTEP_FILE_URL_TTL_SECONDS", "3000")))
+FILE_URL_CONCURRENCY = max(1, int(os.getenv("ECOSTEP_FILE_URL_CONCURRENCY", "10")))
+_MAX_CACHED_PATHS = 5000
+
+
+class FileUrlResolver:
+    """Находит URL файлов Telegram с кэшем путей и ограничением параллельности."""
+
+    def __init__(
+        self,
+        bot=None,
+        ttl: float = FILE_URL_TTL_SECONDS,
+        concurrency: int = FILE_URL_CONCURRENCY,
+        max_entries: int = _MAX_CACHED_PATHS,
+    ):
+        self._bot = bot
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._semaphore = asyncio.Semaphore(concurrency)
+        # file_id -> (file_path, time.time() получения)
+        self._paths: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._pending: dict[str, asyncio.Future] = {}
+        self.lookups = 0
+
+    @property
+    def bot(self):
+        if self._bot is None:
+            from bot_core import bot
+
+            self._bot = bot
+        return self._bot
+
+    def file_url(self, file_path: str) -> str:
+        return f"https://api.telegram.org/file/bot{self.bot.token}/{file_path}"
+
+    def _cached(self, file_id: str, now: float) -> str | None:
+        entry = self._paths.get(file_id)
+        if entry is None:
+            return None
+        if now - entry[1] >= self.ttl:
+            del self._paths[file_id]
+            return None
+        self._paths.move_to_end(file_id)
+        return entry[0]
+
+    def _remember(self, file_id: str, file_path: str, resolved_at: float):
+        self._paths[file_id] = (file_path, resolved_at)
+        self._paths.move_to_end(file_id)
+        while len(self._paths) > self.max_entries:
+            self._paths.popitem(last=False)
+
+    async def _lookup(self, file_id: str) -> str | None:
+        future = self._pending.get(file_id)
+        if future is not None:
+            return await future
+        future = asyncio.get_running_loop().create_future()
+        self._pending[file_id] = future
+        file_path = None
+        try:
+            async with self._semaphore:
+                self.lookups += 1
+                telegram_file = await self.bot.get_file(file_id)
+            file_path = telegram_file.file_path
+        except Exception as error:
+            logger.warning("Не удалось получить путь файла %s: %s", file_id, error)
+        finally:
+            del self._pending[file_id]
+            future.set_result(file_path)
+        if file_path:
+            self._remember(file_id, file_path, time.time())
+        return file_path
+
+    async def resolve_reports(self, reports: list[dict]) -> dict[str, str]:
+        """
+        URL файлов для отчётов из ``get_pending_reports`` (file_id -> url).
+
+        Новые пути сохраняются в БД одним запросом.
+        """
+        now = time.time()
+        paths: dict[str, str] = {}
+        missing: dict[str, list[dict]] = {}
+        for report in reports:
+            file_id = report.get("photo_file_id")
+            if not file_id or file_id in paths:
+                continue
+            cached = self._cached(file_id, now)
+            if cached is None:
+                stored_at = report.get("photo_file_path_at")
+                if report.get("photo_file_path") and stored_at and now - stored_at < self.ttl:
+                    cached = report["photo_file_path"]
+                    self._remember(file_id, cached, stored_at)
+            if cached is not None:
+                paths[file_id] = cached
+            else:
+                missing.setdefault(file_id, []).append(report)
+
+        if missing:
+            file_ids = list(missing)
+            resolved = await asyncio.gather(*(self._lookup(file_id) for file_id in file_ids))
+            entries = []
+            for file_id, file_path in zip(file_ids, resolved):
+                if not file_path:
+                    continue
+                paths[file_id] = file_path
+                entries.extend(
+                    (report["user_id"], report["challenge_id"], file_id, file_path)
+                    for report in missing[file_id]
+                )
+            if entries:
+                await database_aio.save_report_file_paths(entries)
+
+        return {file_id: self.file_url(file_path) for file_id, file_path in paths.items()}
+
+    def stats(self) -> dict[str, int]:
+        return {"cached": len(self._paths), "lookups": self.lookups}
+
+
+file_url_resolver = FileUrlResolver()
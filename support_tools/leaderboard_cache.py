@@ -0,0 +1,71 @@
+"""
+LRU-кэш отрисованной панели рейтинга друзей.
+
+Запись хранится для каждого пользователя вместе с ключом, в который входит
+версия данных рейтинга из БД (``leaderboard_versions``) и текущая неделя.
+Версия увеличивается только когда у участника меняются одобренные баллы
+или меняется список друзей, поэтому устаревшая запись просто не совпадает
+по ключу и перестраивается. Версия хранится в БД, так что изменения из
+админ-панели (другой процесс) тоже сбрасывают кэш бота.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Hashable
+from typing import Any
+
+LEADERBOARD_CACHE_SIZE = max(0, int(os.getenv("ECOSTEP_LEADERBOARD_CACHE_SIZE", "1000")))
+
+
+class LeaderboardCache:
+    """Ограниченный по размеру кэш с вытеснением давно не использованных записей."""
+
+    def __init__(self, max_size: int = LEADERBOARD_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[int, tuple[Hashable, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int, key: Hashable) -> Any | None:
+        """Вернуть значение, если оно построено для того же ключа."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] != key:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, user_id: int, key: Hashable, value: Any):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[user_id] = (key, value)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int | None = None):
+        """Удалить запись пользователя или весь кэш."""
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+friends_leaderboard_cache = LeaderboardCache()
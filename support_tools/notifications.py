@@ -0,0 +1,343 @@
+"""
+Доставка уведомлений пользователям через таблицу ``notification_outbox``.
+
+Админ-панель пишет уведомления в ту же транзакцию, что и решение по отчёту,
+и сразу отвечает. Фоновый ``NotificationWorker`` забирает строки с арендой на
+``ECOSTEP_NOTIFY_LEASE_SECONDS`` (так что упавший процесс не теряет
+уведомления, а несколько воркеров uvicorn не шлют их дважды):
+
+* ``message`` — передать текст в ``send_queue``. Строка остаётся в очереди,
+  пока сообщение не доставлено: аренду таких строк воркер продлевает раз в
+  треть её срока, так что повторы после ``RetryAfter`` и ожидание за
+  рассылкой не отдают строку другому воркеру. Одновременно доставляется не
+  больше ``ECOSTEP_NOTIFY_CONCURRENCY`` сообщений. Доставленное или
+  записанное ``send_queue`` в ``outbound_dead_letters`` удаляется, при сбое
+  строка возвращается в очередь (до ``ECOSTEP_NOTIFY_MAX_ATTEMPTS`` попыток).
+  Если процесс остановится посреди доставки, строку заберут снова после
+  истечения аренды: уведомление может прийти дважды, но не потеряется;
+* ``friend_completion`` — найти друзей пользователя и заменить строку
+  сообщениями для каждого из них. Друзьям, включившим сводку, событие не
+  отправляется сразу, а копится в ``friend_digest_events``;
+* ``friend_digest`` — отправить одну сводку вместо накопленных событий.
+
+Сводки выгружает планировщик раз в ``ECOSTEP_FRIEND_DIGEST_FLUSH_SECONDS``:
+события получателя собираются в одно сообщение через
+``ECOSTEP_FRIEND_DIGEST_WINDOW_SECONDS`` после первого из них.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from html import escape
+
+import database_aio
+from support_tools.send_queue import PRIORITY_BULK, PRIORITY_USER, send_queue
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_MESSAGE = "message"
+NOTIFY_FRIEND_COMPLETION = "friend_completion"
+NOTIFY_FRIEND_DIGEST = "friend_digest"
+
+NOTIFY_BATCH_SIZE = max(1, int(os.getenv("ECOSTEP_NOTIFY_BATCH_SIZE", "50")))
+NOTIFY_CONCURRENCY = max(1, int(os.getenv("ECOSTEP_NOTIFY_CONCURRENCY", "8")))
+NOTIFY_LEASE_SECONDS = max(1.0, float(os.getenv("ECOSTEP_NOTIFY_LEASE_SECONDS", "60")))
+NOTIFY_POLL_SECONDS = max(0.05, float(os.getenv("ECOSTEP_NOTIFY_POLL_SECONDS", "2")))
+NOTIFY_MAX_ATTEMPTS = max(1, int(os.getenv("ECOSTEP_NOTIFY_MAX_ATTEMPTS", "5")))
+FRIEND_DIGEST_WINDOW_SECONDS = max(0, int(os.getenv("ECOSTEP_FRIEND_DIGEST_WINDOW_SECONDS", "3600")))
+FRIEND_DIGEST_FLUSH_SECONDS = max(1, int(os.getenv("ECOSTEP_FRIEND_DIGEST_FLUSH_SECONDS", "60")))
+
+
+def user_message(chat_id: int, text: str, priority: int = PRIORITY_USER) -> tuple[str, int, dict]:
+    """Строка очереди: отправить ``text`` пользователю."""
+    return NOTIFY_MESSAGE, chat_id, {"text": text, "priority": priority}
+
+
+def friend_completion(user_id: int, challenge_title: str, points: int | None) -> tuple[str, None, dict]:
+    """Строка очереди: рассказать друзьям пользователя о выполненном задании."""
+    return NOTIFY_FRIEND_COMPLETION, None, {
+        "user_id": user_id,
+        "challenge_title": challenge_title,
+        "points": points,
+    }
+
+
+def format_user_display(user_id: int, info: tuple | None) -> str:
+    if not info:
+        return f"ID {user_id}"
+    _, username, first_name, *_ = info
+    first_name = (first_name or "").strip()
+    username = (username or "").strip()
+    if first_name and username:
+        return f"{first_name} (@{username})"
+    if first_name:
+        return first_name
+    if username:
+        return f"@{username}"
+    return f"ID {user_id}"
+
+
+def friend_completion_text(user_display: str, challenge_title: str, points: int | None) -> str:
+    text = (
+        f"🎉 Ваш друг <b>{escape(user_display)}</b> выполнил задание "
+        f"<b>{escape(challenge_title)}</b>."
+    )
+    if points:
+        text += f"\n🏅 Он заработал {points} баллов."
+    return text
+
+
+def friend_digest_text(events: list[dict]) -> str:
+    if len(events) == 1:
+        (event,) = events
+        return friend_completion_text(event["display"], event["challenge_title"], event.get("points"))
+    lines = [f"📬 <b>Сводка:</b> ваши друзья выполнили заданий: {len(events)}\n"]
+    for event in events:
+        line = f"• <b>{escape(event['display'])}</b> — {escape(event['challenge_title'])}"
+        if event.get("points"):
+            line += f" (+{event['points']})"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+class NotificationWorker:
+    """Разбирает ``notification_outbox`` с ограниченной параллельностью."""
+
+    def __init__(
+        self,
+        sender=None,
+        batch_size: int = NOTIFY_BATCH_SIZE,
+        concurrency: int = NOTIFY_CONCURRENCY,
+        lease_seconds: float = NOTIFY_LEASE_SECONDS,
+        poll_seconds: float = NOTIFY_POLL_SECONDS,
+        max_attempts: int = NOTIFY_MAX_ATTEMPTS,
+        digest_window_seconds: float = FRIEND_DIGEST_WINDOW_SECONDS,
+        digest_flush_seconds: float = FRIEND_DIGEST_FLUSH_SECONDS,
+    ):
+        self._sender = sender or send_queue
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self.max_attempts = max_attempts
+        self.digest_window_seconds = digest_window_seconds
+        self.digest_flush_seconds = digest_flush_seconds
+        self._wakeup: asyncio.Event | None = None
+        self._slot_free: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        self._flusher: asyncio.Task | None = None
+        self._renewer: asyncio.Task | None = None
+        # id строки -> Future доставки из send_queue
+        self._in_flight: dict[int, asyncio.Future] = {}
+        self._finishing: set[asyncio.Task] = set()
+        self.sent = 0
+        self.failed = 0
+        self.expanded = 0
+        self.dropped = 0
+        self.buffered = 0
+        self.digests = 0
+
+    def wake(self):
+        """Разобрать очередь сейчас, не дожидаясь следующего опроса."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def start(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_forever())
+        if self._renewer is None or self._renewer.done():
+            self._renewer = asyncio.create_task(self._renew_forever())
+
+    async def stop(self):
+        """Остановить разбор очереди; недоставленные строки вернутся в неё по истечении аренды."""
+        for task in (self._flusher, self._task, self._renewer):
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self._task = None
+        self._flusher = None
+        self._renewer = None
+
+    async def join(self):
+        """Дождаться доставки переданных в ``send_queue`` сообщений и удаления их строк."""
+        while self._in_flight or self._finishing:
+            await asyncio.wait([*self._in_flight.values(), *self._finishing])
+
+    async def renew_leases(self) -> int:
+        """Продлить аренду строк, доставка которых ещё идёт."""
+        return await database_aio.defer_notifications(list(self._in_flight), self.lease_seconds)
+
+    async def _renew_forever(self):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await self.renew_leases()
+            except Exception:
+                logger.exception("Не удалось продлить аренду уведомлений")
+
+    async def flush_digests(self) -> int:
+        """Поставить в очередь сводки, у которых истекло окно."""
+        flushed = 0
+        while True:
+            count = await database_aio.flush_friend_digests(NOTIFY_FRIEND_DIGEST, time.time(), self.batch_size)
+            flushed += count
+            if count < self.batch_size:
+                break
+        if flushed:
+            self.wake()
+        return flushed
+
+    async def _flush_forever(self):
+        while True:
+            await asyncio.sleep(self.digest_flush_seconds)
+            try:
+                await self.flush_digests()
+            except Exception:
+                logger.exception("Не удалось выгрузить сводки уведомлений")
+
+    async def _run(self):
+        while True:
+            try:
+                claimed, limit = await self._drain()
+            except Exception:
+                logger.exception("Не удалось разобрать очередь уведомлений")
+                claimed, limit = 0, 1
+            if claimed < limit:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+    async def drain_once(self) -> int:
+        """Обработать одну пачку; вернуть число забранных строк."""
+        claimed, _ = await self._drain()
+        return claimed
+
+    async def _drain(self) -> tuple[int, int]:
+        # Забираем не больше строк, чем свободных мест для доставки
+        if self._slot_free is None:
+            self._slot_free = asyncio.Event()
+        while len(self._in_flight) >= self.concurrency:
+            self._slot_free.clear()
+            await self._slot_free.wait()
+        limit = min(self.batch_size, self.concurrency - len(self._in_flight))
+        items = await database_aio.claim_notifications(limit, self.lease_seconds)
+        if items:
+            await asyncio.gather(*(self._process_safely(item) for item in items))
+        return len(items), limit
+
+    async def _process_safely(self, item: dict):
+        try:
+            await self._process(item)
+        except Exception as error:
+            await self._retry_or_drop(item, error, release=False)
+
+    async def _retry_or_drop(self, item: dict, error: BaseException, release: bool):
+        if item["attempts"] < self.max_attempts:
+            logger.error("Ошибка уведомления %s, повторим позже", item["id"], exc_info=error)
+            if release:
+                await database_aio.defer_notifications([item["id"]], 0)
+            # Иначе строка вернётся в работу, когда истечёт аренда
+            return
+        logger.error("Уведомление %s отброшено после %s попыток", item["id"], item["attempts"], exc_info=error)
+        self.dropped += 1
+        await database_aio.complete_notifications([item["id"]])
+
+    async def _process(self, item: dict):
+        payload = item["payload"]
+        if item["kind"] == NOTIFY_MESSAGE:
+            self._hand_off(item, payload["text"], payload.get("priority", PRIORITY_USER))
+        elif item["kind"] == NOTIFY_FRIEND_COMPLETION:
+            await self._expand_friend_completion(item)
+        elif item["kind"] == NOTIFY_FRIEND_DIGEST:
+            self._hand_off(item, friend_digest_text(payload["events"]), PRIORITY_BULK)
+            self.digests += 1
+        else:
+            logger.error("Неизвестный тип уведомления %s: %s", item["id"], item["kind"])
+            await database_aio.complete_notifications([item["id"]])
+
+    def _hand_off(self, item: dict, text: str, priority: int):
+        # Строку удалит _finish, когда send_queue закончит с сообщением
+        delivery = self._sender.enqueue(item["chat_id"], text, priority=priority)
+        self._in_flight[item["id"]] = delivery
+        delivery.add_done_callback(lambda _: self._on_delivered(item, delivery))
+
+    def _on_delivered(self, item: dict, delivery: asyncio.Future):
+        self._in_flight.pop(item["id"], None)
+        if self._slot_free is not None:
+            self._slot_free.set()
+        self.wake()
+        if delivery.cancelled():
+            # Процесс останавливается: строка вернётся в очередь по истечении аренды
+            return
+        task = asyncio.create_task(self._finish(item, delivery))
+        self._finishing.add(task)
+        task.add_done_callback(self._finishing.discard)
+
+    async def _finish(self, item: dict, delivery: asyncio.Future):
+        try:
+            error = delivery.exception()
+            if error is not None:
+                await self._retry_or_drop(item, error, release=True)
+                return
+            if delivery.result() is None:
+                # send_queue уже исчерпал повторы и записал сообщение в outbound_dead_letters
+                self.failed += 1
+            else:
+                self.sent += 1
+            await database_aio.complete_notifications([item["id"]])
+        except Exception:
+            logger.exception("Не удалось завершить уведомление %s", item["id"])
+
+    async def _expand_friend_completion(self, item: dict):
+        payload = item["payload"]
+        user_id = payload["user_id"]
+        friend_ids = [friend_id for friend_id in await database_aio.get_friend_ids(user_id) if friend_id != user_id]
+        messages = []
+        digest_events = []
+        if friend_ids:
+            display = format_user_display(user_id, await database_aio.get_user_info(user_id))
+            digest_ids = await database_aio.get_friend_digest_recipients(friend_ids)
+            text = friend_completion_text(display, payload["challenge_title"], payload.get("points"))
+            messages = [
+                user_message(friend_id, text, PRIORITY_BULK)
+                for friend_id in friend_ids
+                if friend_id not in digest_ids
+            ]
+            event = {
+                "user_id": user_id,
+                "display": display,
+                "challenge_title": payload["challenge_title"],
+                "points": payload.get("points"),
+            }
+            digest_events = [(friend_id, event) for friend_id in friend_ids if friend_id in digest_ids]
+        await database_aio.replace_notification(
+            item["id"],
+            messages,
+            digest_events,
+            time.time() + self.digest_window_seconds,
+        )
+        self.expanded += 1
+        self.buffered += len(digest_events)
+        if messages:
+            self.wake()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "expanded": self.expanded,
+            "dropped": self.dropped,
+            "buffered": self.buffered,
+            "digests": self.digests,
+        }
+
+
+notification_worker = NotificationWorker()
@@ -0,0 +1,21 @@
+"""
+Пересборка материализованной сводки user_stats по всем отчётам.
+
+Запуск из корня проекта:
+    python -m support_tools.rebuild_stats
+"""
+
+import logging
+
+from database import init_db, rebuild_user_stats
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    init_db()
+    count = rebuild_user_stats()
+    print(f"Сводка пересобрана для пользователей: {count}")
+
+
+if __name__ == "__main__":
+    main()
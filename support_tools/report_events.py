@@ -0,0 +1,156 @@
+"""
+Поток изменений очереди модерации для админ-панели (SSE).
+
+Бот и админ-панель — разные процессы, поэтому события пишутся в таблицу
+``report_events`` в той же транзакции, что и отчёт (``mark_challenge_submitted``,
+``update_report_review``). В админ-панели одна фоновая задача читает новые
+строки раз в ``ECOSTEP_REPORT_EVENTS_POLL_MS`` и раздаёт их всем подключённым
+клиентам — сколько бы админов ни смотрело очередь, запрос к БД один.
+
+Клиент, который не успевает читать, отключается; EventSource переподключится
+с ``Last-Event-ID`` и дочитает пропущенное из таблицы.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+
+import database_aio
+
+logger = logging.getLogger(__name__)
+
+REPORT_EVENTS_POLL_MS = max(50, int(os.getenv("ECOSTEP_REPORT_EVENTS_POLL_MS", "500")))
+REPORT_EVENTS_KEEP = max(100, int(os.getenv("ECOSTEP_REPORT_EVENTS_KEEP", "10000")))
+_SUBSCRIBER_QUEUE_SIZE = 1000
+_BATCH_SIZE = 500
+# Как часто (в циклах опроса) подрезать старые события
+_PURGE_EVERY = 1000
+
+
+class Subscription:
+    """Очередь событий одного клиента."""
+
+    __slots__ = ("queue", "closed")
+
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=_SUBSCRIBER_QUEUE_SIZE)
+        self.closed = False
+
+
+class ReportEventHub:
+    """Читает ``report_events`` и рассылает события подписчикам."""
+
+    def __init__(self, poll_interval: float = REPORT_EVENTS_POLL_MS / 1000, keep: int = REPORT_EVENTS_KEEP):
+        self.poll_interval = poll_interval
+        self.keep = keep
+        self._subscribers: set[Subscription] = set()
+        self._task: asyncio.Task | None = None
+        self._last_id = 0
+
+    async def start(self):
+        """Запомнить текущий конец ленты и начать её читать (при запуске приложения)."""
+        if self._task is None or self._task.done():
+            self._last_id = await database_aio.get_last_report_event_id()
+            self._task = asyncio.create_task(self._tail())
+
+    def subscribe(self) -> Subscription:
+        subscription = Subscription()
+        self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        if subscription.closed:
+            return
+        subscription.closed = True
+        self._subscribers.discard(subscription)
+        try:
+            # Будим клиента, который ждёт следующего события
+            subscription.queue.put_nowait(None)
+        except asyncio.QueueFull:
+            pass
+
+    async def _tail(self):
+        polls = 0
+        while True:
+            events = []
+            try:
+                events = await database_aio.get_report_events(self._last_id, _BATCH_SIZE)
+                for event in events:
+                    self._publish(event)
+                if events:
+                    self._last_id = events[-1]["id"]
+                polls += 1
+                if polls % _PURGE_EVERY == 0:
+                    await database_aio.purge_report_events(self.keep)
+            except Exception:
+                logger.exception("Не удалось прочитать ленту событий модерации")
+            if len(events) < _BATCH_SIZE:
+                await asyncio.sleep(self.poll_interval)
+
+    def _publish(self, event: dict):
+        for subscription in list(self._subscribers):
+            try:
+                subscription.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                logger.warning("Клиент ленты модерации не успевает читать, отключаем")
+                self.unsubscribe(subscription)
+
+    async def stream(self, last_event_id: int | None = None, keepalive: float = 15.0):
+        """
+        Асинхронный генератор SSE-сообщений для одного клиента.
+
+        При ``last_event_id`` сначала дочитывает пропущенное из таблицы.
+        """
+        subscription = self.subscribe()
+        sent_id = last_event_id or 0
+        try:
+            if last_event_id is not None:
+                while True:
+                    missed = await database_aio.get_report_events(sent_id, _BATCH_SIZE)
+                    for event in missed:
+                        yield format_event(event)
+                        sent_id = event["id"]
+                    if len(missed) < _BATCH_SIZE:
+                        break
+            while not subscription.closed:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    # Комментарий не даёт прокси закрыть простаивающее соединение
+                    yield ": keepalive\n\n"
+                    continue
+                if event is None:
+                    break
+                if event["id"] <= sent_id:
+                    continue
+                yield format_event(event)
+                sent_id = event["id"]
+        finally:
+            self.unsubscribe(subscription)
+
+    async def stop(self):
+        for subscription in list(self._subscribers):
+            self.unsubscribe(subscription)
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> dict[str, int]:
+        return {"subscribers": len(self._subscribers), "last_id": self._last_id}
+
+
+def format_event(event: dict) -> str:
+    data = {
+        "user_id": event["user_id"],
+        "challenge_id": event["challenge_id"],
+        "review_status": event["review_status"],
+        "submitted_at": event["submitted_at"],
+    }
+    return f"id: {event['id']}\nevent: {event['kind']}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+report_event_hub = ReportEventHub()
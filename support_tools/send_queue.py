@@ -0,0 +1,324 @@
+"""
+Общая очередь исходящих сообщений бота с учётом лимитов Telegram.
+
+* Token bucket на весь бот (``ECOSTEP_SEND_GLOBAL_RATE`` сообщений в секунду)
+  и на каждый чат (``ECOSTEP_SEND_CHAT_RATE``). Корзина бота хранится в
+  таблице ``send_rate_buckets``, так что лимит на токен бота делят все
+  процессы: бот, админ-панель и каждый её воркер uvicorn. Чтобы не открывать
+  пишущую транзакцию на каждое сообщение, процесс берёт токены пачкой (не
+  больше ``ECOSTEP_SEND_TOKEN_BATCH`` и не больше, чем сообщений ждёт в
+  очереди) и раздаёт их из локального счётчика. Взятые, но не потраченные
+  за секунду токены сгорают: другой процесс в это время может недобрать
+  лимит, но превысить его процессы не могут. Пока общая корзина пуста,
+  процесс ждёт рассчитанное время, не обращаясь к БД.
+* Корзины чатов — в памяти процесса. Если два процесса одновременно пишут
+  в один чат, они могут вместе превысить ``ECOSTEP_SEND_CHAT_RATE``; такое
+  редко и закрывается повтором после ``TelegramRetryAfter``.
+* Две полосы приоритета: ответы пользователям (``PRIORITY_USER``) уходят
+  раньше массовых рассылок (``PRIORITY_BULK``).
+* ``TelegramRetryAfter`` — повтор через указанное Telegram время, сетевые и
+  серверные ошибки — повтор с экспоненциальной задержкой.
+* Сообщения, которые так и не удалось доставить (бот заблокирован, чат не
+  найден, исчерпаны попытки), записываются в ``outbound_dead_letters``.
+
+Все отправки ``bot.send_message`` идут через ``send_queue``::
+
+    send_queue.enqueue(chat_id, text)                # не ждать доставки
+    message = await send_queue.send_message(chat_id, text, priority=PRIORITY_BULK)
+"""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import logging
+import os
+import time
+from typing import Any
+
+from aiogram.exceptions import (
+    RestartingTelegram,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+from aiogram.types import Message
+
+import database_aio
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_USER = 0
+PRIORITY_BULK = 1
+
+SEND_GLOBAL_RATE = max(1.0, float(os.getenv("ECOSTEP_SEND_GLOBAL_RATE", "30")))
+SEND_CHAT_RATE = max(0.1, float(os.getenv("ECOSTEP_SEND_CHAT_RATE", "1")))
+SEND_CHAT_BURST = max(1, int(os.getenv("ECOSTEP_SEND_CHAT_BURST", "3")))
+SEND_WORKERS = max(1, int(os.getenv("ECOSTEP_SEND_WORKERS", "4")))
+SEND_MAX_ATTEMPTS = max(1, int(os.getenv("ECOSTEP_SEND_MAX_ATTEMPTS", "5")))
+SEND_TOKEN_BATCH = max(1, int(os.getenv("ECOSTEP_SEND_TOKEN_BATCH", "10")))
+
+# Временные сбои, после которых есть смысл повторить отправку
+_TRANSIENT_ERRORS = (TelegramNetworkError, TelegramServerError, RestartingTelegram)
+_MAX_BACKOFF_SECONDS = 60.0
+# Сколько полных (давно не использованных) корзин чатов держать в памяти
+_MAX_CHAT_BUCKETS = 10000
+# Сколько живут взятые из общей корзины, но не потраченные токены
+_RESERVATION_SECONDS = 1.0
+
+
+class TokenBucket:
+    """Корзина токенов: ``rate`` токенов в секунду, не больше ``capacity``."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float | None = None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Сколько секунд ждать до следующего токена (0 — можно отправлять)."""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Job:
+    __slots__ = ("chat_id", "text", "kwargs", "priority", "attempts", "future")
+
+    def __init__(self, chat_id: int, text: str, kwargs: dict[str, Any], priority: int, future: asyncio.Future):
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs
+        self.priority = priority
+        self.attempts = 0
+        self.future = future
+
+
+class SendQueue:
+    """Очередь отправки с лимитами, приоритетами, повторами и dead-letter."""
+
+    def __init__(
+        self,
+        bot=None,
+        global_rate: float = SEND_GLOBAL_RATE,
+        chat_rate: float = SEND_CHAT_RATE,
+        chat_burst: int = SEND_CHAT_BURST,
+        workers: int = SEND_WORKERS,
+        max_attempts: int = SEND_MAX_ATTEMPTS,
+        backoff_base: float = 1.0,
+        token_batch: int = SEND_TOKEN_BATCH,
+    ):
+        self._bot = bot
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.token_batch = token_batch
+        self._chats: dict[int, TokenBucket] = {}
+        # Токены общей корзины, уже взятые из БД этим процессом
+        self._reserved = 0
+        self._reserved_until = 0.0
+        # До этого момента общая корзина пуста — в БД не ходим
+        self._global_blocked_until = 0.0
+        self._token_lock: asyncio.Lock | None = None
+        self._queue: asyncio.PriorityQueue | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._sequence = itertools.count()
+        self._delayed = 0
+        self._unresolved = 0
+        self.sent = 0
+        self.retried = 0
+        self.dead = 0
+
+    @property
+    def bot(self):
+        if self._bot is None:
+            from bot_core import bot
+
+            self._bot = bot
+        return self._bot
+
+    def _ensure_started(self):
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def enqueue(self, chat_id: int, text: str, *, priority: int = PRIORITY_USER, **kwargs: Any) -> asyncio.Future:
+        """Поставить сообщение в очередь. Future получит Message или None, если доставить не удалось."""
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        self._unresolved += 1
+        self._put(_Job(chat_id, text, kwargs, priority, future))
+        return future
+
+    async def send_message(
+        self,
+        chat_id: int,
+        text: str,
+        *,
+        priority: int = PRIORITY_USER,
+        **kwargs: Any,
+    ) -> Message | None:
+        """Отправить через очередь и дождаться результата."""
+        return await self.enqueue(chat_id, text, priority=priority, **kwargs)
+
+    def _put(self, job: _Job):
+        self._queue.put_nowait((job.priority, next(self._sequence), job))
+
+    def _put_later(self, job: _Job, delay: float):
+        self._delayed += 1
+
+        def release():
+            self._delayed -= 1
+            self._put(job)
+
+        asyncio.get_running_loop().call_later(delay, release)
+
+    def _chat_bucket(self, chat_id: int, now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= _MAX_CHAT_BUCKETS:
+                self._chats = {
+                    key: value for key, value in self._chats.items() if not value.is_full(now)
+                }
+            bucket = TokenBucket(self.chat_rate, self.chat_burst, now)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def _take_tokens(self, chat_id: int) -> tuple[float, float]:
+        """Взять токен чата и бота; вернуть (ожидание чата, ожидание бота) в секундах."""
+        if self._token_lock is None:
+            self._token_lock = asyncio.Lock()
+        # По одному запросу за раз: токены достаются сообщениям в порядке очереди
+        async with self._token_lock:
+            now = time.monotonic()
+            bucket = self._chat_bucket(chat_id, now)
+            chat_wait = bucket.wait_time(now)
+            if chat_wait > 0:
+                return chat_wait, 0.0
+            global_wait = await self._take_global_token()
+            if global_wait > 0:
+                return 0.0, global_wait
+            bucket.consume(now)
+            return 0.0, 0.0
+
+    async def _take_global_token(self) -> float:
+        # Время стены, а не monotonic: корзина общая для процессов
+        now = time.time()
+        if self._reserved and now < self._reserved_until:
+            self._reserved -= 1
+            return 0.0
+        if now < self._global_blocked_until:
+            return self._global_blocked_until - now
+        wanted = min(self.token_batch, 1 + (self._queue.qsize() if self._queue is not None else 0))
+        granted, wait = await database_aio.reserve_send_tokens(now, self.global_rate, self.global_rate, wanted)
+        if not granted:
+            self._global_blocked_until = now + wait
+            return wait
+        self._reserved = granted - 1
+        self._reserved_until = now + _RESERVATION_SECONDS
+        return 0.0
+
+    async def _worker(self):
+        while True:
+            _, _, job = await self._queue.get()
+            try:
+                await self._deliver(job)
+            except Exception:
+                logger.exception("Сбой очереди отправки для чата %s", job.chat_id)
+                self._resolve(job, None)
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, job: _Job):
+        while True:
+            chat_wait, global_wait = await self._take_tokens(job.chat_id)
+            if chat_wait > 0:
+                # Не занимаем обработчик: чат подождёт, остальные сообщения пойдут дальше
+                self._put_later(job, chat_wait)
+                return
+            if global_wait <= 0:
+                break
+            await asyncio.sleep(global_wait)
+
+        job.attempts += 1
+        try:
+            message = await self.bot.send_message(job.chat_id, job.text, **job.kwargs)
+        except TelegramRetryAfter as error:
+            if job.attempts < self.max_attempts:
+                self.retried += 1
+                self._put_later(job, float(error.retry_after))
+                return
+            await self._dead_letter(job, error)
+        except _TRANSIENT_ERRORS as error:
+            if job.attempts < self.max_attempts:
+                self.retried += 1
+                delay = min(_MAX_BACKOFF_SECONDS, self.backoff_base * 2 ** (job.attempts - 1))
+                self._put_later(job, delay)
+                return
+            await self._dead_letter(job, error)
+        except Exception as error:
+            # Бот заблокирован, чат не найден, неверная разметка — повтор не поможет
+            await self._dead_letter(job, error)
+        else:
+            self.sent += 1
+            self._resolve(job, message)
+
+    async def _dead_letter(self, job: _Job, error: Exception):
+        self.dead += 1
+        logger.warning("Сообщение в чат %s не доставлено после %s попыток: %s", job.chat_id, job.attempts, error)
+        try:
+            await database_aio.record_dead_letter(
+                job.chat_id,
+                job.text,
+                job.priority,
+                job.attempts,
+                f"{type(error).__name__}: {error}",
+            )
+        finally:
+            self._resolve(job, None)
+
+    def _resolve(self, job: _Job, message: Message | None):
+        if not job.future.done():
+            self._unresolved -= 1
+            job.future.set_result(message)
+
+    async def stop(self, timeout: float = 10.0):
+        """Дождаться отправки очереди (не дольше ``timeout``) и остановить обработчики."""
+        deadline = time.monotonic() + timeout
+        while self._unresolved and self._tasks and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "delayed": self._delayed,
+            "sent": self.sent,
+            "retried": self.retried,
+            "dead": self.dead,
+        }
+
+
+send_queue = SendQueue()
@@ -0,0 +1,162 @@
+"""
+Хранилище состояния диалогов бота (выбранное задание для отчёта, ввод друга).
+
+Два бэкенда с одинаковым асинхронным API:
+
+* ``memory`` — словарь в памяти процесса с TTL и ограничением размера
+  (давно не использованные записи вытесняются);
+* ``sqlite`` — таблица ``conversation_state``: состояние переживает
+  перезапуск и общее для нескольких экземпляров бота.
+
+Бэкенд выбирается переменной ``ECOSTEP_STATE_BACKEND``. Значения должны
+сериализоваться в JSON (строки, числа, словари, списки).
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+from typing import Any
+
+import database_aio
+
+STATE_BACKEND = os.getenv("ECOSTEP_STATE_BACKEND", "memory").strip().lower()
+STATE_TTL_SECONDS = max(1, int(os.getenv("ECOSTEP_STATE_TTL_SECONDS", "86400")))
+STATE_MAX_ENTRIES = max(1, int(os.getenv("ECOSTEP_STATE_MAX_ENTRIES", "10000")))
+
+
+def _deep_size(value: Any) -> int:
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_deep_size(key) + _deep_size(item) for key, item in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(_deep_size(item) for item in value)
+    return size
+
+
+class _Entry:
+    __slots__ = ("value", "expires_at")
+
+    def __init__(self, value: Any, expires_at: float):
+        self.value = value
+        self.expires_at = expires_at
+
+
+class MemoryStateStore:
+    """Состояния в памяти процесса с TTL и вытеснением по размеру."""
+
+    backend = "memory"
+
+    def __init__(self, ttl_seconds: int = STATE_TTL_SECONDS, max_entries: int = STATE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.evicted = 0
+        self._entries: OrderedDict[tuple[str, int], _Entry] = OrderedDict()
+
+    async def get(self, namespace: str, key: int) -> Any | None:
+        entry = self._entries.get((namespace, key))
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            del self._entries[(namespace, key)]
+            return None
+        # Активные диалоги не должны вытесняться первыми
+        self._entries.move_to_end((namespace, key))
+        return entry.value
+
+    async def set(self, namespace: str, key: int, value: Any):
+        now = time.monotonic()
+        self._entries[(namespace, key)] = _Entry(value, now + self.ttl_seconds)
+        self._entries.move_to_end((namespace, key))
+        if len(self._entries) > self.max_entries:
+            self._purge_expired(now)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evicted += 1
+
+    async def pop(self, namespace: str, key: int) -> Any | None:
+        entry = self._entries.pop((namespace, key), None)
+        if entry is None or entry.expires_at <= time.monotonic():
+            return None
+        return entry.value
+
+    def _purge_expired(self, now: float) -> int:
+        expired = [key for key, entry in self._entries.items() if entry.expires_at <= now]
+        for key in expired:
+            del self._entries[key]
+        return len(expired)
+
+    async def sweep(self) -> int:
+        """Удалить истёкшие записи."""
+        return self._purge_expired(time.monotonic())
+
+    async def stats(self) -> dict[str, Any]:
+        """Число записей и приблизительный объём памяти в байтах."""
+        size = sys.getsizeof(self._entries) + sum(
+            _deep_size(key) + sys.getsizeof(entry) + _deep_size(entry.value)
+            for key, entry in self._entries.items()
+        )
+        return {
+            "backend": self.backend,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "evicted": self.evicted,
+            "bytes": size,
+        }
+
+
+class SQLiteStateStore:
+    """Состояния в таблице conversation_state общей БД."""
+
+    backend = "sqlite"
+
+    # Как часто попутно удалять истёкшие строки при записи
+    SWEEP_INTERVAL_SECONDS = 300
+
+    def __init__(self, ttl_seconds: int = STATE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._last_sweep = 0.0
+
+    async def get(self, namespace: str, key: int) -> Any | None:
+        raw = await database_aio.get_conversation_state(namespace, key, time.time())
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, namespace: str, key: int, value: Any):
+        now = time.time()
+        await database_aio.set_conversation_state(
+            namespace,
+            key,
+            json.dumps(value, ensure_ascii=False),
+            now + self.ttl_seconds,
+        )
+        if now - self._last_sweep >= self.SWEEP_INTERVAL_SECONDS:
+            await self.sweep()
+
+    async def pop(self, namespace: str, key: int) -> Any | None:
+        raw = await database_aio.delete_conversation_state(namespace, key, time.time())
+        return json.loads(raw) if raw is not None else None
+
+    async def sweep(self) -> int:
+        self._last_sweep = time.time()
+        return await database_aio.purge_expired_conversation_state(self._last_sweep)
+
+    async def stats(self) -> dict[str, Any]:
+        stats = await database_aio.get_conversation_state_stats()
+        return {"backend": self.backend, **stats}
+
+
+StateStore = MemoryStateStore | SQLiteStateStore
+
+
+def create_state_store(backend: str = STATE_BACKEND) -> StateStore:
+    if backend == "memory":
+        return MemoryStateStore()
+    if backend == "sqlite":
+        return SQLiteStateStore()
+    raise ValueError(f"Неизвестный бэкенд состояний: {backend!r} (ожидается memory или sqlite)")
+
+
+state_store = create_state_store()
@@ -0,0 +1,117 @@
+"""
+Регистрация пользователей из middleware без похода в БД на каждое сообщение.
+
+Известные профили хранятся в ограниченном LRU-словаре и прогреваются при
+старте. Пользователь, которого воркер ещё не видел, записывается в БД сразу,
+до обработчика: бот ищет друзей по username и принимает отчёты прямо из БД.
+Изменившиеся профили (username, имя) уже известных пользователей копятся в
+очереди и раз в ``ECOSTEP_REGISTRATION_FLUSH_MS`` миллисекунд записываются
+одной пачкой через ``upsert_users``.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+
+import database_aio
+
+logger = logging.getLogger(__name__)
+
+KNOWN_USERS_LIMIT = max(1, int(os.getenv("ECOSTEP_KNOWN_USERS_LIMIT", "100000")))
+REGISTRATION_FLUSH_MS = max(10, int(os.getenv("ECOSTEP_REGISTRATION_FLUSH_MS", "500")))
+
+Profile = tuple[str, str]
+
+
+class UserRegistry:
+    """Кэш известных профилей и очередь записи изменённых."""
+
+    def __init__(
+        self,
+        max_known: int = KNOWN_USERS_LIMIT,
+        flush_interval_ms: int = REGISTRATION_FLUSH_MS,
+    ):
+        self.max_known = max_known
+        self.flush_interval = flush_interval_ms / 1000
+        self._known: OrderedDict[int, Profile] = OrderedDict()
+        self._pending: dict[int, Profile] = {}
+        self._task: asyncio.Task | None = None
+
+    def _remember(self, user_id: int, profile: Profile):
+        self._known[user_id] = profile
+        self._known.move_to_end(user_id)
+        while len(self._known) > self.max_known:
+            self._known.popitem(last=False)
+
+    async def warm_up(self) -> int:
+        """Загрузить последних зарегистрированных пользователей из БД."""
+        rows = await database_aio.get_recent_user_profiles(self.max_known)
+        # Самые свежие должны оказаться в конце LRU
+        for user_id, username, first_name in reversed(rows):
+            self._remember(user_id, (username, first_name))
+        return len(rows)
+
+    async def note(self, user_id: int, username: str, first_name: str) -> bool:
+        """Отметить профиль из входящего сообщения. True — если он записан или поставлен в очередь."""
+        profile = (username, first_name)
+        known = self._known.get(user_id)
+        if known == profile:
+            self._known.move_to_end(user_id)
+            return False
+        if known is None:
+            # Новый пользователь должен оказаться в БД до того, как его запрос обработают
+            self._pending.pop(user_id, None)
+            try:
+                await database_aio.upsert_users([(user_id, username, first_name)])
+            except Exception:
+                logger.exception("Не удалось зарегистрировать пользователя %s, повторим позже", user_id)
+                self._pending[user_id] = profile
+            self._remember(user_id, profile)
+            return True
+        self._pending[user_id] = profile
+        self._remember(user_id, profile)
+        return True
+
+    async def flush(self) -> int:
+        """Записать накопленные профили одной пачкой."""
+        if not self._pending:
+            return 0
+        batch, self._pending = self._pending, {}
+        try:
+            return await database_aio.upsert_users(
+                [(user_id, username, first_name) for user_id, (username, first_name) in batch.items()]
+            )
+        except Exception:
+            logger.exception("Не удалось сохранить %s профилей, повторим позже", len(batch))
+            # Более свежие профили, пришедшие во время записи, важнее
+            self._pending = {**batch, **self._pending}
+            return 0
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановить фоновую запись и сохранить остаток очереди."""
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+
+    def stats(self) -> dict[str, int]:
+        return {"known": len(self._known), "pending": len(self._pending)}
+
+
+user_registry = UserRegistry()
@@ -0,0 +1,91 @@
+"""
+Приём обновлений Telegram через webhook (альтернатива long polling).
+
+aiohttp-эндпоинт проверяет секрет из заголовка
+``X-Telegram-Bot-Api-Secret-Token``, кладёт обновление в ограниченную
+очередь и сразу отвечает 200. Обновления обрабатывают ``workers`` фоновых
+задач через ``Dispatcher.feed_update``. Если очередь заполнена, эндпоинт
+отвечает 503, и Telegram повторит доставку позже.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hmac
+import logging
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+from pydantic import ValidationError
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+_QUEUE_KEY = web.AppKey("update_queue", asyncio.Queue)
+_WORKERS_KEY = web.AppKey("update_workers", list)
+
+
+async def _process_updates(dp: Dispatcher, bot: Bot, queue: asyncio.Queue):
+    while True:
+        update = await queue.get()
+        try:
+            await dp.feed_update(bot, update)
+        except Exception:
+            logger.exception("Ошибка обработки обновления %s", update.update_id)
+        finally:
+            queue.task_done()
+
+
+def create_webhook_app(
+    dp: Dispatcher,
+    bot: Bot,
+    secret_token: str,
+    path: str = "/telegram/webhook",
+    workers: int = 8,
+    queue_size: int = 1000,
+) -> web.Application:
+    """Собрать aiohttp-приложение с webhook-эндпоинтом и пулом обработчиков."""
+    if not secret_token:
+        raise ValueError("Для webhook нужен секретный токен")
+
+    async def handle_update(request: web.Request) -> web.Response:
+        received = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(received.encode(), secret_token.encode()):
+            return web.Response(status=401)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": bot})
+        except (ValueError, ValidationError):
+            return web.Response(status=400)
+        try:
+            request.app[_QUEUE_KEY].put_nowait(update)
+        except asyncio.QueueFull:
+            logger.warning("Очередь обновлений заполнена, отвечаем 503")
+            return web.Response(status=503, headers={"Retry-After": "1"})
+        return web.Response(status=200)
+
+    async def on_startup(app: web.Application):
+        queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        app[_QUEUE_KEY] = queue
+        app[_WORKERS_KEY] = [
+            asyncio.create_task(_process_updates(dp, bot, queue))
+            for _ in range(max(1, workers))
+        ]
+
+    async def on_cleanup(app: web.Application):
+        queue = app[_QUEUE_KEY]
+        # Дообрабатываем принятые обновления: Telegram уже получил на них 200
+        try:
+            await asyncio.wait_for(queue.join(), timeout=10)
+        except asyncio.TimeoutError:
+            logger.warning("Не дождались обработки %s обновлений", queue.qsize())
+        for task in app[_WORKERS_KEY]:
+            task.cancel()
+        await asyncio.gather(*app[_WORKERS_KEY], return_exceptions=True)
+
+    app = web.Application()
+    app.router.add_post(path, handle_update)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
@@ -0,0 +1,69 @@
+"""
+Бенчмарк рейтинга друзей: время построения панели в зависимости от числа друзей.
+
+Запуск из корня проекта (использует отдельную временную БД):
+    python tests/bench_friends_leaderboard.py > bench_output.txt
+
+Ожидаемый результат — число запросов к БД на панель остаётся равным одному,
+а время растёт только за счёт сортировки и отрисовки строк рейтинга
+(раньше на каждого друга уходило отдельное подключение и запрос).
+Колонка cached — повторное открытие панели из кэша без изменений данных.
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+FRIEND_COUNTS = (1, 10, 50, 200, 1000)
+REPEATS = 50
+
+
+def _seed(owner_id: int, friends_count: int):
+    database.register_user(owner_id, f"owner{owner_id}", "Owner")
+    for offset in range(1, friends_count + 1):
+        friend_id = owner_id + offset
+        database.register_user(friend_id, f"user{friend_id}", "Friend")
+        database.add_friend(owner_id, friend_id)
+        challenge_id = f"bench_{friend_id}"
+        database.accept_challenge(friend_id, challenge_id)
+        database.mark_challenge_submitted(friend_id, challenge_id, f"file_{friend_id}")
+        database.update_report_review(friend_id, challenge_id, "approved", awarded_points=offset % 50)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database.DB_NAME = os.path.join(tmp_dir, "bench.db")
+        database.init_db()
+
+        from bot_routes.analytics import _build_friends_panel, _render_friends_panel
+
+        print(f"{'friends':>8} {'queries':>8} {'ms/panel':>10} {'cached':>10}")
+        for index, friends_count in enumerate(FRIEND_COUNTS):
+            owner_id = (index + 1) * 1_000_000
+            _seed(owner_id, friends_count)
+            statements: list[str] = []
+            with database._connection() as conn:
+                pass
+            conn.set_trace_callback(statements.append)
+            _render_friends_panel(owner_id)
+            conn.set_trace_callback(None)
+            started = time.perf_counter()
+            for _ in range(REPEATS):
+                _render_friends_panel(owner_id)
+            elapsed_ms = (time.perf_counter() - started) * 1000 / REPEATS
+            _build_friends_panel(owner_id)
+            started = time.perf_counter()
+            for _ in range(REPEATS):
+                _build_friends_panel(owner_id)
+            cached_ms = (time.perf_counter() - started) * 1000 / REPEATS
+            print(f"{friends_count:>8} {len(statements):>8} {elapsed_ms:>10.3f} {cached_ms:>10.3f}")
+        database.close_connections()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+import pytest
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import database
+import database_aio
+
+
+@pytest.fixture(autouse=True)
+def isolated_db(tmp_path, monkeypatch):
+    """Каждый тест работает с отдельной БД во временном каталоге, а не с рабочей ecostep.db"""
+    monkeypatch.setattr(database, "DB_NAME", str(tmp_path / "ecostep.db"))
+    database.init_db()
+    yield
+    database_aio.shutdown()
+    database.close_connections()
@@ -0,0 +1,86 @@
+import asyncio
+import time
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database import _connection, get_admin_session
+from support_tools.admin_sessions import AdminSessionStore, hash_token
+
+
+def _stored_rows() -> list[tuple]:
+    with _connection() as conn:
+        return conn.execute("SELECT token_hash, admin_id, expires_at FROM admin_sessions").fetchall()
+
+
+class TestAdminSessions:
+    """Тесты общего хранилища сессий админ-панели"""
+
+    def test_token_shared_between_workers_and_stored_hashed(self):
+        """Тест: токен из одного воркера принимает другой, в БД только хэш"""
+
+        async def scenario():
+            first, second = AdminSessionStore(), AdminSessionStore()
+            token = await first.create(42)
+            return token, await second.validate(token), await second.validate("forged")
+
+        token, admin_id, forged = asyncio.run(scenario())
+        assert (admin_id, forged) == (42, None)
+        ((token_hash, stored_admin, _),) = _stored_rows()
+        assert token_hash == hash_token(token) != token
+        assert stored_admin == 42
+
+    def test_validated_tokens_are_cached(self):
+        """Тест: повторная проверка берётся из LRU воркера без запроса к БД"""
+
+        async def scenario():
+            store = AdminSessionStore(cache_seconds=60)
+            token = await AdminSessionStore().create(7)
+            results = [await store.validate(token) for _ in range(5)]
+            return results, store.stats()
+
+        results, stats = asyncio.run(scenario())
+        assert results == [7] * 5
+        assert (stats["misses"], stats["hits"]) == (1, 4)
+
+    def test_logout_reaches_other_workers_after_cache_interval(self):
+        """Тест: выход в одном воркере виден другому, когда истекает кэш проверки"""
+
+        async def scenario():
+            first = AdminSessionStore(cache_seconds=60)
+            second = AdminSessionStore(cache_seconds=0)
+            token = await first.create(5)
+            assert await second.validate(token) == 5
+            assert await first.revoke(token)
+            return await first.validate(token), await second.validate(token)
+
+        assert asyncio.run(scenario()) == (None, None)
+
+    def test_sliding_expiry_and_sweep(self):
+        """Тест: обращение продлевает сессию, истёкшие сессии не принимаются и удаляются"""
+
+        async def scenario():
+            store = AdminSessionStore(ttl_seconds=3600, cache_seconds=0)
+            active = await store.create(1)
+            stale = await store.create(2)
+            with _connection() as conn:
+                conn.execute(
+                    "UPDATE admin_sessions SET expires_at = ? WHERE token_hash = ?",
+                    (time.time() + 5, hash_token(active)),
+                )
+                conn.execute(
+                    "UPDATE admin_sessions SET expires_at = ? WHERE token_hash = ?",
+                    (time.time() - 1, hash_token(stale)),
+                )
+                conn.commit()
+            return (
+                active,
+                await store.validate(active),
+                await store.validate(stale),
+                await store.sweep(),
+            )
+
+        active, admin_id, stale_admin, removed = asyncio.run(scenario())
+        assert (admin_id, stale_admin, removed) == (1, None, 1)
+        _, expires_at = get_admin_session(hash_token(active), time.time())
+        assert expires_at > time.time() + 3000
+        assert len(_stored_rows()) == 1
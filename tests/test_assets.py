@@ -0,0 +1,103 @@
+import asyncio
+import pytest
+import sys
+import os
+from types import SimpleNamespace
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile
+from database import get_media_file_id, save_media_file_id
+from support_tools.assets import AssetRegistry
+
+
+class FakeMessage:
+    """Имитация Message: запоминает отправленные фото и выдаёт file_id при загрузке"""
+
+    def __init__(self, rejected: set[str] | None = None):
+        self.sent: list[object] = []
+        self.rejected = rejected or set()
+        self.uploads = 0
+
+    async def answer_photo(self, photo, **kwargs):
+        self.sent.append(photo)
+        if isinstance(photo, FSInputFile):
+            self.uploads += 1
+            return SimpleNamespace(photo=[SimpleNamespace(file_id=f"uploaded_{self.uploads}")])
+        if photo in self.rejected:
+            raise TelegramBadRequest(method=None, message="Bad Request: wrong file identifier/HTTP URL specified")
+        if "<b>" in kwargs.get("caption", "") and "</b>" not in kwargs["caption"]:
+            raise TelegramBadRequest(method=None, message="Bad Request: can't parse entities: unclosed tag")
+        return SimpleNamespace(photo=[SimpleNamespace(file_id=photo)])
+
+
+class TestAssetRegistry:
+    """Тесты реестра баннеров"""
+
+    @pytest.fixture(autouse=True)
+    def setup_data(self, tmp_path):
+        self.banner = tmp_path / "banner.jpg"
+        self.banner.write_bytes(b"banner-v1")
+
+    def test_uploads_once_and_reuses_file_id(self):
+        """Тест: файл загружается один раз, дальше отправляется file_id — и после перезапуска"""
+        message = FakeMessage()
+
+        async def scenario():
+            registry = AssetRegistry()
+            await registry.answer_photo(message, str(self.banner), caption="hi")
+            await registry.answer_photo(message, str(self.banner), caption="hi")
+            # Новый процесс берёт file_id из БД
+            await AssetRegistry().answer_photo(message, str(self.banner))
+            return await registry.content_hash(str(self.banner))
+
+        content_hash = asyncio.run(scenario())
+        assert message.uploads == 1
+        assert message.sent[1:] == ["uploaded_1", "uploaded_1"]
+        assert get_media_file_id(content_hash) == "uploaded_1"
+
+    def test_reuploads_changed_asset(self):
+        """Тест: изменённый файл загружается заново"""
+        message = FakeMessage()
+
+        async def scenario():
+            registry = AssetRegistry()
+            await registry.answer_photo(message, str(self.banner))
+            self.banner.write_bytes(b"banner-v2-longer")
+            await registry.answer_photo(message, str(self.banner))
+
+        asyncio.run(scenario())
+        assert message.uploads == 2
+
+    def test_reuploads_rejected_file_id(self):
+        """Тест: отвергнутый Telegram file_id заменяется новой загрузкой"""
+        message = FakeMessage()
+
+        async def scenario():
+            registry = AssetRegistry()
+            await registry.answer_photo(message, str(self.banner))
+            message.rejected.add("uploaded_1")
+            await registry.answer_photo(message, str(self.banner))
+            await registry.answer_photo(message, str(self.banner))
+            return await registry.content_hash(str(self.banner))
+
+        content_hash = asyncio.run(scenario())
+        assert message.uploads == 2
+        assert message.sent[-1] == "uploaded_2"
+        assert get_media_file_id(content_hash) == "uploaded_2"
+
+    def test_keeps_file_id_on_unrelated_bad_request(self):
+        """Тест: ошибка в подписи пробрасывается, сохранённый file_id не забывается и файл не загружается"""
+        message = FakeMessage()
+
+        async def scenario():
+            registry = AssetRegistry()
+            content_hash = await registry.content_hash(str(self.banner))
+            save_media_file_id(content_hash, "cached", str(self.banner))
+            with pytest.raises(TelegramBadRequest):
+                await registry.answer_photo(message, str(self.banner), caption="<b>broken")
+            return content_hash
+
+        content_hash = asyncio.run(scenario())
+        assert message.uploads == 0
+        assert message.sent == ["cached"]
+        assert get_media_file_id(content_hash) == "cached"
@@ -0,0 +1,138 @@
+import asyncio
+import pytest
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database import (
+    advance_broadcast_job,
+    claim_broadcast_job,
+    create_broadcast_job,
+    get_broadcast_job,
+    set_broadcast_job_status,
+    upsert_users,
+)
+import database_aio
+from support_tools.broadcasts import BroadcastRunner
+from support_tools.send_queue import PRIORITY_BULK
+
+
+class FakeSender:
+    """Очередь отправки: запоминает получателей и считает одновременные отправки"""
+
+    def __init__(self, failing: set[int] | None = None, gate: asyncio.Event | None = None):
+        self.failing = failing or set()
+        self.gate = gate
+        self.sent: list[int] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def send_message(self, chat_id: int, text: str, *, priority: int):
+        assert priority == PRIORITY_BULK
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.001)
+            if self.gate is not None:
+                await self.gate.wait()
+            if chat_id in self.failing:
+                return None
+            self.sent.append(chat_id)
+            return {"chat_id": chat_id}
+        finally:
+            self.in_flight -= 1
+
+
+class TestBroadcasts:
+    """Тесты фоновых рассылок"""
+
+    @pytest.fixture(autouse=True)
+    def setup_data(self):
+        upsert_users([(user_id, f"user{user_id}", "User") for user_id in range(1, 26)])
+
+    def test_job_runs_in_batches_with_bounded_concurrency(self):
+        """Тест: все получатели обработаны, одновременно не больше concurrency отправок"""
+        sender = FakeSender(failing={3, 17})
+        job_id = create_broadcast_job(1, "hello")
+
+        async def scenario():
+            await BroadcastRunner(sender, batch_size=10, concurrency=4).start(job_id)
+
+        asyncio.run(scenario())
+        job = get_broadcast_job(job_id)
+        assert job["status"] == "completed"
+        assert (job["total"], job["sent"], job["failed"], job["remaining"]) == (25, 23, 2, 0)
+        assert job["cursor"] == 25
+        assert sorted(sender.sent) == [user_id for user_id in range(1, 26) if user_id not in (3, 17)]
+        assert sender.max_in_flight <= 4
+
+    def test_cancel_and_resume_continue_from_cursor(self):
+        """Тест: отмена останавливает рассылку после пачки, возобновление не повторяет отправленное"""
+        sender = FakeSender()
+        job_id = create_broadcast_job(1, "hello")
+
+        async def scenario():
+            gate = asyncio.Event()
+            sender.gate = gate
+            runner = BroadcastRunner(sender, batch_size=10, concurrency=10)
+            task = runner.start(job_id)
+            await asyncio.sleep(0.05)
+            assert await database_aio.set_broadcast_job_status(job_id, "cancelled", ("queued", "running"))
+            gate.set()
+            await task
+            cancelled = await database_aio.get_broadcast_job(job_id)
+
+            assert await database_aio.set_broadcast_job_status(job_id, "queued", ("cancelled",))
+            await runner.start(job_id)
+            return cancelled
+
+        cancelled = asyncio.run(scenario())
+        assert cancelled["status"] == "cancelled"
+        assert (cancelled["sent"], cancelled["remaining"]) == (10, 15)
+        job = get_broadcast_job(job_id)
+        assert job["status"] == "completed"
+        assert job["sent"] == 25
+        assert sorted(sender.sent) == list(range(1, 26))
+
+    def test_resume_pending_after_restart(self):
+        """Тест: прерванное задание продолжается новым процессом с сохранённого курсора"""
+        job_id = create_broadcast_job(1, "hello")
+        # Упавший воркер успел разослать 20 получателям, и его аренда истекла
+        assert claim_broadcast_job(job_id, "crashed", 60)
+        assert advance_broadcast_job(job_id, "crashed", 20, 20, 0, -1)
+        sender = FakeSender()
+
+        async def scenario():
+            runner = BroadcastRunner(sender, batch_size=10)
+            assert await runner.resume_pending() == [job_id]
+            await runner.start(job_id)
+
+        asyncio.run(scenario())
+        assert sorted(sender.sent) == [21, 22, 23, 24, 25]
+        job = get_broadcast_job(job_id)
+        assert (job["status"], job["sent"]) == ("completed", 25)
+
+    def test_workers_share_one_job(self):
+        """Тест: несколько воркеров с одним заданием — каждому получателю одно сообщение"""
+        sender = FakeSender()
+        job_id = create_broadcast_job(1, "hello")
+
+        async def scenario():
+            runners = [BroadcastRunner(sender, batch_size=5, concurrency=5) for _ in range(3)]
+            for runner in runners:
+                assert await runner.resume_pending() == [job_id]
+            await asyncio.gather(*(runner.start(job_id) for runner in runners))
+
+        asyncio.run(scenario())
+        assert sorted(sender.sent) == list(range(1, 26))
+        job = get_broadcast_job(job_id)
+        assert (job["status"], job["sent"], job["failed"]) == ("completed", 25, 0)
+
+    def test_live_lease_is_not_taken_over(self):
+        """Тест: задание с действующей арендой другой воркер не забирает"""
+        job_id = create_broadcast_job(1, "hello")
+        assert claim_broadcast_job(job_id, "alive", 60)
+        assert not claim_broadcast_job(job_id, "other", 60)
+        assert not advance_broadcast_job(job_id, "other", 25, 25, 0, 60)
+        assert not set_broadcast_job_status(job_id, "completed", ("running",), "other")
+        assert claim_broadcast_job(job_id, "alive", 60)
+        assert get_broadcast_job(job_id)["owner"] == "alive"
@@ -1,28 +1,16 @@
+import asyncio
+from datetime import datetime
 import pytest
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from database import *
-from database import _get_connection
+from database import _connection, _get_connection, _migrate_custom_challenge_co2_kg
+import database_aio
 
 class TestDatabase:
     """Тесты для базы данных бота"""
     
-    @pytest.fixture(autouse=True)
-    def setup_and_teardown(self):
-        """Создаем и очищаем базу перед каждым тестом"""
-        global DB_NAME
-        DB_NAME = 'test_ecostep.db'
-        
-        init_db()
-
-        db_file = get_db_path()
-        yield
-        
-        # Очистка после теста
-        if os.path.exists(db_file):
-            os.remove(db_file)
-    
     def test_db_connection(self):
         """Тест подключения к БД"""
         conn = _get_connection()
@@ -35,6 +23,142 @@ class TestDatabase:
         assert result[0] == 1
         conn.close()
     
+    def test_pooled_connection_reused(self):
+        """Тест повторного использования подключений из пула"""
+        with _connection() as first:
+            pass
+        with _connection() as second:
+            assert second is first
+            # Вложенный вызов получает отдельное подключение
+            with _connection() as nested:
+                assert nested is not second
+
+    def test_pool_reconnects_after_file_replaced(self):
+        """Тест переподключения, если файл БД удалили"""
+        register_user(321, "pool_user", "Pool")
+        with _connection() as stale:
+            pass
+        db_file = get_db_path()
+        for path in (db_file, f"{db_file}-wal", f"{db_file}-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+        init_db()
+        with _connection() as conn:
+            assert conn is not stale
+        assert get_user_info(321) is None
+
+    def test_storage_profile(self):
+        """Тест применения профиля хранения к подключениям"""
+        report = get_storage_report()
+        assert report["journal_mode"] == "wal"
+        assert report["synchronous"] == "NORMAL"
+        assert report["temp_store"] == "MEMORY"
+        assert report["busy_timeout"] == STORAGE_PROFILE["busy_timeout"]
+
+    def test_schema_version(self):
+        """Тест версии схемы после миграций"""
+        assert get_schema_version() == SCHEMA_VERSION
+
+    def test_migrations_run_once(self):
+        """Тест того, что повторный init_db не трогает данные"""
+        register_user(808, "user8", "User Eight")
+        accept_challenge(808, "challenge_8")
+        with _connection() as conn:
+            conn.execute("UPDATE user_challenges SET review_status = NULL WHERE user_id = 808")
+            conn.commit()
+
+        init_db()
+
+        with _connection() as conn:
+            row = conn.execute(
+                "SELECT review_status FROM user_challenges WHERE user_id = 808"
+            ).fetchone()
+        assert row[0] is None
+
+    def test_legacy_database_migrated(self):
+        """Тест миграции базы, созданной до появления версий схемы"""
+        close_connections()
+        db_file = get_db_path()
+        for path in (db_file, f"{db_file}-wal", f"{db_file}-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+        conn = _get_connection()
+        conn.execute(
+            '''
+            CREATE TABLE user_challenges (
+                user_id INTEGER,
+                challenge_id TEXT,
+                status TEXT,
+                accepted_at TEXT,
+                submitted_at TEXT,
+                photo_file_id TEXT,
+                caption TEXT,
+                PRIMARY KEY (user_id, challenge_id)
+            )
+            '''
+        )
+        conn.execute(
+            "INSERT INTO user_challenges (user_id, challenge_id, status) VALUES (1, 'old', 'submitted')"
+        )
+        conn.commit()
+        conn.close()
+
+        init_db()
+
+        assert get_schema_version() == SCHEMA_VERSION
+        pending = get_pending_reports()
+        assert len(pending) == 1
+        assert pending[0]["attachment_type"] == "photo"
+        assert get_user_review_statuses(1) == {"old": "pending"}
+
+    def test_upsert_users(self):
+        """Тест пакетной регистрации: новые добавляются, изменённые обновляются"""
+        register_user(700, "old_name", "Old")
+        registered_at = get_user_info(700)[3]
+
+        written = upsert_users([(700, "new_name", "Old"), (701, "fresh", "Fresh"), (701, "fresher", "Fresh")])
+        assert written == 2
+        assert get_user_info(700)[1:] == ("new_name", "Old", registered_at)
+        assert get_user_info(701)[1] == "fresher"
+        assert upsert_users([(700, "new_name", "Old")]) == 0
+
+    def test_user_registry_coalesces_writes(self):
+        """Тест реестра пользователей: новые пишутся сразу, изменения известных уходят пачкой"""
+        from support_tools.user_registry import UserRegistry
+
+        register_user(710, "known", "Known")
+        register_user(712, "another", "Another")
+
+        async def scenario():
+            registry = UserRegistry(max_known=3)
+            assert await registry.warm_up() >= 2
+            assert not await registry.note(710, "known", "Known")
+            assert await registry.note(711, "newbie", "New")
+            # Новичка сразу видно в БД, без ожидания пачки
+            assert (await database_aio.find_user_by_username("newbie"))[0] == 711
+            assert await registry.note(710, "renamed", "Known")
+            assert await registry.note(712, "renamed_too", "Another")
+            assert registry.stats() == {"known": 3, "pending": 2}
+            assert (await database_aio.get_user_info(710))[1] == "known"
+            written = await registry.flush()
+            await registry.stop()
+            return written
+
+        assert asyncio.run(scenario()) == 2
+        assert get_user_info(710)[1] == "renamed"
+        assert get_user_info(712)[1] == "renamed_too"
+
+    def test_async_facade(self):
+        """Тест асинхронной обёртки над функциями БД"""
+        async def scenario():
+            await database_aio.register_user(654, "async_user", "Async")
+            return await database_aio.get_user_info(654)
+
+        user_info = asyncio.run(scenario())
+        assert user_info[1] == "async_user"
+        with pytest.raises(AttributeError):
+            database_aio._get_connection
+
     def test_tables_created(self):
         """Тест создания таблиц"""
         conn = _get_connection()
@@ -167,8 +291,55 @@ class TestDatabase:
         assert challenges[0]["title"] == "Test Challenge"
         assert challenges[0]["points"] == 100
         assert challenges[0]["co2_quantity_based"] is True
+        assert challenges[0]["co2_kg"] == 10.0
         print("Кастомные челленджи работают")
-    
+
+    def test_custom_challenge_co2_kg_backfilled(self):
+        """Тест миграции: co2_kg заполняется из текстовой подписи один раз"""
+        explicit_id = create_custom_challenge("Explicit", "Explicit CO2", 5, "около стакана", co2_kg=0.3)
+        assert get_custom_challenge(explicit_id)["co2_kg"] == 0.3
+
+        legacy_id = create_custom_challenge("Legacy CO2", "Old row", 5, "0,25 кг CO₂")
+        with _connection() as conn:
+            conn.execute("UPDATE custom_challenges SET co2_kg = NULL")
+            _migrate_custom_challenge_co2_kg(conn.cursor())
+            conn.commit()
+        assert get_custom_challenge(legacy_id)["co2_kg"] == 0.25
+        assert get_custom_challenge(explicit_id)["co2_kg"] is None
+
+    def test_custom_challenge_co2_label_from_template(self):
+        """Тест: без подписи CO₂ она строится из co2_kg по шаблону"""
+        plain_id = create_custom_challenge("Template", "Label from number", 5, None, co2_kg=0.50)
+        per_unit_id = create_custom_challenge("Per unit", "Label from number", 5, "", True, 1.25)
+        assert get_custom_challenge(plain_id)["co2"] == "0.5 кг CO₂"
+        assert get_custom_challenge(per_unit_id)["co2"] == "1.25 кг CO₂ за единицу"
+
+    def test_challenge_catalog_snapshot(self):
+        """Тест кэша каталога: снимок переиспользуется и обновляется после правок админки"""
+        from settings import challenges as catalog
+
+        catalog.invalidate_catalog()
+        version = get_data_version(CHALLENGE_CATALOG_VERSION)
+        first = catalog.get_all_challenges()
+        assert catalog.get_all_challenges() is first
+
+        challenge_id = create_custom_challenge("Catalog", "Snapshot test", 15, "1 кг")
+        assert get_data_version(CHALLENGE_CATALOG_VERSION) == version + 1
+        refreshed = catalog.get_all_challenges()
+        assert refreshed is not first
+        assert catalog.get_challenge(challenge_id)["points"] == 15
+        with pytest.raises(TypeError):
+            refreshed[challenge_id]["title"] = "changed"
+
+        assert set_custom_challenge_active(challenge_id, False)
+        assert catalog.get_challenge(challenge_id) is None
+        assert not set_custom_challenge_active("custom_999999", False)
+        assert get_data_version(CHALLENGE_CATALOG_VERSION) == version + 2
+
+        assert delete_custom_challenge(challenge_id)
+        assert get_data_version(CHALLENGE_CATALOG_VERSION) == version + 3
+        catalog.invalidate_catalog()
+
     def test_admin_logs(self):
         """Тест логов администратора"""
         # Сначала очистим логи
@@ -270,6 +441,286 @@ class TestDatabase:
         assert summary.get("rejected", 0) == 1
 
 
+    def test_user_stats_ledger(self):
+        """Тест сводки баллов и CO₂, которую поддерживает модерация"""
+        register_user(888, "user8", "User Eight")
+        for challenge_id in ("c_approved", "c_rejected", "c_pending"):
+            accept_challenge(888, challenge_id)
+            mark_challenge_submitted(888, challenge_id, f"file_{challenge_id}")
+        assert get_user_stats(888)["pending"] == 3
+
+        update_report_review(888, "c_approved", "approved", awarded_points=40, co2_saved=2.5)
+        update_report_review(888, "c_rejected", "rejected")
+
+        stats = get_user_stats(888)
+        assert stats == {
+            "total_points": 40,
+            "total_co2": 2.5,
+            "approved": 1,
+            "rejected": 1,
+            "pending": 1,
+        }
+        assert stats["approved"] == get_user_review_summary(888)["approved"]
+
+        # Повторное принятие отклонённого задания убирает его из отклонённых
+        accept_challenge(888, "c_rejected")
+        assert get_user_stats(888)["rejected"] == 0
+        assert get_user_stats(999_999)["total_points"] == 0
+
+    def test_rebuild_user_stats_backfills_legacy_reports(self):
+        """Тест пересборки сводки для старых отчётов без баллов"""
+        register_user(889, "user9", "User Nine")
+        challenge_id = create_custom_challenge("Legacy", "Legacy task", 15, "1,5 кг CO₂")
+        accept_challenge(889, challenge_id)
+        mark_challenge_submitted(889, challenge_id, "file_legacy")
+        with _connection() as conn:
+            conn.execute(
+                "UPDATE user_challenges SET review_status = 'approved' WHERE user_id = 889"
+            )
+            conn.execute("DELETE FROM user_stats")
+            conn.commit()
+
+        assert rebuild_user_stats() >= 1
+        stats = get_user_stats(889)
+        assert stats["total_points"] == 15
+        assert stats["total_co2"] == 1.5
+        assert stats["pending"] == 0
+
+
+    def test_week_start_msk(self):
+        """Тест границы недели: понедельник 00:01 по Мск"""
+        assert get_week_start_msk(datetime(2026, 10, 14, 12, 0)) == "2026-10-12"
+        assert get_week_start_msk(datetime(2026, 10, 12, 0, 1)) == "2026-10-12"
+        assert get_week_start_msk(datetime(2026, 10, 12, 0, 0, 30)) == "2026-10-05"
+
+    def test_weekly_points_buckets(self):
+        """Тест недельных корзин баллов"""
+        register_user(890, "user10", "User Ten")
+        for challenge_id in ("week_old", "week_boundary", "week_new"):
+            accept_challenge(890, challenge_id)
+            mark_challenge_submitted(890, challenge_id, f"file_{challenge_id}")
+            update_report_review(890, challenge_id, "approved", awarded_points=10)
+        reviewed = {
+            "week_old": "2025-10-01 10:00:00",
+            "week_boundary": "2025-10-13 00:00:30",
+            "week_new": "2025-10-13 00:05:00",
+        }
+        with _connection() as conn:
+            for challenge_id, reviewed_at in reviewed.items():
+                conn.execute(
+                    "UPDATE user_challenges SET reviewed_at = ? WHERE user_id = 890 AND challenge_id = ?",
+                    (reviewed_at, challenge_id),
+                )
+            conn.commit()
+        rebuild_user_stats()
+
+        history = get_user_weekly_history(890)
+        assert history == [("2025-10-13", 10), ("2025-10-06", 10), ("2025-09-29", 10)]
+        assert get_user_weekly_points(890, "2025-10-06") == 10
+        assert get_user_weekly_points(890, "2025-10-20") == 0
+
+        # Одобрение сразу попадает в корзину по дате проверки
+        accept_challenge(890, "week_now")
+        mark_challenge_submitted(890, "week_now", "file_now")
+        update_report_review(890, "week_now", "approved", awarded_points=7)
+        reviewed_at = get_user_challenge(890, "week_now")[9]
+        week_start = get_week_start_msk(datetime.strptime(reviewed_at, "%Y-%m-%d %H:%M:%S"))
+        assert get_user_weekly_points(890, week_start) == 7
+
+
+    def test_friends_leaderboard_single_query(self):
+        """Тест рейтинга друзей одним запросом независимо от числа друзей"""
+        register_user(900, "owner", "Owner")
+        for friend_id in range(901, 951):
+            register_user(friend_id, f"friend{friend_id}", "Friend")
+            add_friend(900, friend_id)
+        accept_challenge(901, "lb_challenge")
+        mark_challenge_submitted(901, "lb_challenge", "file_lb")
+        update_report_review(901, "lb_challenge", "approved", awarded_points=25)
+
+        statements: list[str] = []
+        with _connection() as conn:
+            pass
+        conn.set_trace_callback(statements.append)
+        try:
+            rows = get_friends_leaderboard(900)
+        finally:
+            conn.set_trace_callback(None)
+
+        assert len(statements) == 1
+        assert len(rows) == 51
+        assert rows[0]["user_id"] == 900
+        by_id = {row["user_id"]: row for row in rows}
+        assert by_id[901]["total"] == 25
+        assert by_id[902]["total"] == 0
+
+    def test_global_leaderboard(self):
+        """Тест общего рейтинга: порядок, общие места при равенстве и место пользователя"""
+        for user_id, points in ((980, 30), (981, 50), (982, 30), (983, 10)):
+            register_user(user_id, f"global{user_id}", "Global")
+            accept_challenge(user_id, "global_challenge")
+            mark_challenge_submitted(user_id, "global_challenge", f"file_{user_id}")
+            update_report_review(user_id, "global_challenge", "approved", awarded_points=points)
+        register_user(984, "idle", "Idle")
+
+        for period in GLOBAL_LEADERBOARD_PERIODS:
+            top = get_global_leaderboard(period)
+            assert [(entry["user_id"], entry["rank"]) for entry in top] == [
+                (981, 1), (980, 2), (982, 2), (983, 4)
+            ]
+            assert top[0]["username"] == "global981"
+            assert get_global_rank(982, period) == {"rank": 2, "points": 30, "participants": 4}
+            assert get_global_rank(984, period)["rank"] == 5
+            assert len(get_global_leaderboard(period, limit=2)) == 2
+
+        # Прошлая неделя не попадает в недельный рейтинг
+        assert get_global_leaderboard("weekly", week_start="2000-01-03") == []
+
+        accept_challenge(983, "global_bonus")
+        mark_challenge_submitted(983, "global_bonus", "file_bonus")
+        update_report_review(983, "global_bonus", "approved", awarded_points=45)
+        assert get_global_rank(983, "all")["rank"] == 1
+        assert get_global_rank(983, "weekly")["rank"] == 1
+
+    def test_leaderboard_version_invalidation(self):
+        """Тест версии рейтинга: меняется только при изменении баллов или друзей"""
+        register_user(960, "viewer", "Viewer")
+        register_user(961, "buddy", "Buddy")
+        register_user(962, "stranger", "Stranger")
+        assert get_leaderboard_version(960) == 0
+
+        add_friend(960, 961)
+        after_friend = get_leaderboard_version(960)
+        assert after_friend > 0
+        assert get_leaderboard_version(961) > 0
+
+        # Отправка отчёта и отклонение не меняют баллы
+        accept_challenge(961, "lb_version")
+        mark_challenge_submitted(961, "lb_version", "file_v")
+        update_report_review(961, "lb_version", "rejected")
+        assert get_leaderboard_version(960) == after_friend
+
+        mark_challenge_submitted(961, "lb_version", "file_v2")
+        update_report_review(961, "lb_version", "approved", awarded_points=5)
+        after_approve = get_leaderboard_version(960)
+        assert after_approve > after_friend
+
+        # Баллы постороннего не затрагивают рейтинг
+        accept_challenge(962, "lb_version")
+        mark_challenge_submitted(962, "lb_version", "file_s")
+        update_report_review(962, "lb_version", "approved", awarded_points=5)
+        assert get_leaderboard_version(960) == after_approve
+
+        remove_friend(960, 961)
+        assert get_leaderboard_version(960) > after_approve
+
+    def test_friends_panel_cache(self):
+        """Тест кэша панели рейтинга друзей: попадания и перестроение после изменений"""
+        from bot_routes.analytics import _build_friends_panel
+        from support_tools.leaderboard_cache import friends_leaderboard_cache
+
+        friends_leaderboard_cache.invalidate()
+        register_user(970, "cached", "Cached")
+        register_user(971, "pal", "Pal")
+        add_friend(970, 971)
+
+        hits = friends_leaderboard_cache.hits
+        first, has_friends = _build_friends_panel(970)
+        assert has_friends
+        assert _build_friends_panel(970)[0] == first
+        assert friends_leaderboard_cache.hits == hits + 1
+
+        accept_challenge(971, "lb_cache")
+        mark_challenge_submitted(971, "lb_cache", "file_c")
+        update_report_review(971, "lb_cache", "approved", awarded_points=12)
+        refreshed, _ = _build_friends_panel(970)
+        assert refreshed != first
+        assert "12" in refreshed
+
+    def test_leaderboard_cache_is_bounded(self):
+        """Тест вытеснения старых записей из LRU-кэша"""
+        from support_tools.leaderboard_cache import LeaderboardCache
+
+        cache = LeaderboardCache(max_size=2)
+        cache.put(1, "k", "one")
+        cache.put(2, "k", "two")
+        assert cache.get(1, "k") == "one"
+        cache.put(3, "k", "three")
+        assert cache.get(2, "k") is None
+        assert cache.get(1, "k") == "one"
+        assert cache.get(1, "other") is None
+        assert cache.stats() == {"size": 2, "max_size": 2, "hits": 2, "misses": 2}
+
+    def test_pending_reports_keyset_pages(self):
+        """Тест постраничной очереди модерации: курсор, фильтры и счётчик"""
+        for user_id in (981, 982, 983):
+            register_user(user_id, f"queue{user_id}", "Queue")
+            for challenge_id in ("q_a", "q_b"):
+                accept_challenge(user_id, challenge_id)
+                mark_challenge_submitted(user_id, challenge_id, f"file_{user_id}_{challenge_id}")
+        with _connection() as conn:
+            # Одинаковое время у части отчётов: порядок решают user_id и challenge_id
+            conn.execute("UPDATE user_challenges SET submitted_at = '2024-05-01 10:00:00' WHERE user_id IN (981, 982)")
+            conn.execute("UPDATE user_challenges SET submitted_at = '2024-05-03 10:00:00' WHERE user_id = 983")
+            conn.commit()
+
+        keys = []
+        after = None
+        while True:
+            page = get_pending_reports(limit=4, after=after)
+            if not page:
+                break
+            keys.extend((r["submitted_at"], r["user_id"], r["challenge_id"]) for r in page)
+            after = keys[-1]
+        assert keys == sorted(keys)
+        assert len(keys) == len(set(keys)) == 6
+        assert count_pending_reports() == 6
+
+        only_b = get_pending_reports(limit=10, challenge_id="q_b")
+        assert [r["user_id"] for r in only_b] == [981, 982, 983]
+        assert count_pending_reports(challenge_id="q_b") == 3
+        early = get_pending_reports(submitted_since="2024-05-01", submitted_until="2024-05-02")
+        assert {r["user_id"] for r in early} == {981, 982}
+        assert count_pending_reports(submitted_since="2024-05-02") == 2
+
+        # Счётчик следит за выходом из очереди и повторной отправкой
+        update_report_review(981, "q_a", "approved", awarded_points=5)
+        update_report_review(982, "q_a", "rejected")
+        assert count_pending_reports() == 4
+        assert count_pending_reports(challenge_id="q_a") == 1
+        accept_challenge(982, "q_a")
+        mark_challenge_submitted(982, "q_a", "file_again")
+        assert count_pending_reports(challenge_id="q_a") == 2
+        assert count_pending_reports() == len(get_pending_reports())
+
+    def test_resolve_reports_batch(self):
+        """Тест пакетной модерации: одна транзакция, результат по каждому отчёту и журнал"""
+        for user_id in (991, 992):
+            register_user(user_id, f"batch{user_id}", "Batch")
+            accept_challenge(user_id, "batch_task")
+            mark_challenge_submitted(user_id, "batch_task", f"file_{user_id}")
+
+        results = resolve_reports_batch(
+            7,
+            [
+                {"user_id": 991, "challenge_id": "batch_task", "review_status": "approved", "awarded_points": 4},
+                {"user_id": 992, "challenge_id": "batch_task", "review_status": "rejected", "review_comment": "нет фото"},
+                {"user_id": 993, "challenge_id": "batch_task", "review_status": "approved"},
+            ],
+        )
+        assert results == [True, True, False]
+        assert get_user_review_statuses(991) == {"batch_task": "approved"}
+        assert get_user_awarded_points(991)[0][:2] == ("batch_task", 4)
+        assert get_user_review_statuses(992) == {"batch_task": "rejected"}
+        assert count_pending_reports() == 0
+        logs = [entry for entry in get_admin_logs(limit=None) if entry["action"] == "resolve_report"]
+        assert sorted(entry["details"] for entry in logs) == [
+            "991:batch_task:approved",
+            "992:batch_task:rejected",
+        ]
+        assert {entry["admin_id"] for entry in logs} == {7}
+
+
 # Дополнительные утилиты для тестирования
 def run_all_tests():
     """Запуск всех тестов"""
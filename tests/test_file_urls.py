@@ -0,0 +1,99 @@
+import asyncio
+import pytest
+import sys
+import os
+from types import SimpleNamespace
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from aiogram.exceptions import TelegramBadRequest
+from database import (
+    accept_challenge,
+    get_pending_reports,
+    mark_challenge_submitted,
+    upsert_users,
+)
+from support_tools.file_urls import FileUrlResolver
+
+
+class FakeBot:
+    """Бот с get_file: считает запросы и одновременные обращения"""
+
+    token = "42:TEST"
+
+    def __init__(self, missing: set[str] | None = None):
+        self.missing = missing or set()
+        self.calls: list[str] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def get_file(self, file_id: str):
+        self.calls.append(file_id)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            if file_id in self.missing:
+                raise TelegramBadRequest(method=None, message="file not found")
+            return SimpleNamespace(file_path=f"photos/{file_id}.jpg")
+        finally:
+            self.in_flight -= 1
+
+
+class TestFileUrlResolver:
+    """Тесты получения ссылок на файлы отчётов"""
+
+    @pytest.fixture(autouse=True)
+    def setup_data(self):
+        upsert_users([(user_id, f"user{user_id}", "User") for user_id in range(1, 9)])
+        for user_id in range(1, 9):
+            accept_challenge(user_id, "eco_bag")
+            mark_challenge_submitted(user_id, "eco_bag", f"file{user_id}")
+
+    def test_resolves_concurrently_and_caches(self):
+        """Тест: пути запрашиваются параллельно с ограничением и дальше берутся из кэша"""
+        bot = FakeBot(missing={"file8"})
+
+        async def scenario():
+            resolver = FileUrlResolver(bot, concurrency=3)
+            first = await resolver.resolve_reports(get_pending_reports())
+            second = await resolver.resolve_reports(get_pending_reports())
+            return first, second
+
+        first, second = asyncio.run(scenario())
+        assert len(bot.calls) == 8 + 1  # повторно спрашиваем только файл, который не нашёлся
+        assert bot.max_in_flight == 3
+        assert first["file1"] == "https://api.telegram.org/file/bot42:TEST/photos/file1.jpg"
+        assert "file8" not in first
+        assert first == second
+
+    def test_persisted_paths_survive_restart_and_expire(self):
+        """Тест: свежие пути берутся из БД, устаревшие запрашиваются заново"""
+        bot = FakeBot()
+
+        async def scenario():
+            await FileUrlResolver(bot).resolve_reports(get_pending_reports())
+            reports = get_pending_reports()
+            assert {report["photo_file_path"] for report in reports} == {
+                f"photos/file{user_id}.jpg" for user_id in range(1, 9)
+            }
+            # Новый процесс: путей в памяти нет, но в БД они свежие
+            await FileUrlResolver(bot).resolve_reports(reports)
+            calls_after_restart = len(bot.calls)
+            # Путь устарел по TTL — один запрос на файл при следующем показе
+            await FileUrlResolver(bot, ttl=0).resolve_reports(reports)
+            return calls_after_restart
+
+        assert asyncio.run(scenario()) == 8
+        assert len(bot.calls) == 16
+
+    def test_resubmitted_report_drops_stored_path(self):
+        """Тест: новый файл в отчёте сбрасывает сохранённый путь"""
+        bot = FakeBot()
+
+        async def scenario():
+            await FileUrlResolver(bot).resolve_reports(get_pending_reports())
+
+        asyncio.run(scenario())
+        mark_challenge_submitted(1, "eco_bag", "file1_new")
+        report = next(report for report in get_pending_reports() if report["user_id"] == 1)
+        assert report["photo_file_id"] == "file1_new"
+        assert report["photo_file_path"] is None
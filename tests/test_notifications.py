@@ -0,0 +1,256 @@
+import asyncio
+import pytest
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database import (
+    accept_challenge,
+    add_friend,
+    claim_notifications,
+    complete_notifications,
+    count_buffered_friend_digest_events,
+    count_pending_notifications,
+    enqueue_notifications,
+    get_friend_digest,
+    mark_challenge_submitted,
+    register_user,
+    resolve_reports_batch,
+    set_friend_digest,
+)
+import database_aio
+from support_tools.notifications import (
+    NotificationWorker,
+    friend_completion,
+    user_message,
+)
+from support_tools.send_queue import PRIORITY_BULK, PRIORITY_USER
+
+
+class FakeSender:
+    """Очередь отправки: доставляет с задержкой, может падать или не отвечать на заданных чатах"""
+
+    def __init__(
+        self,
+        failing: set[int] | None = None,
+        undeliverable: set[int] | None = None,
+        broken: set[int] | None = None,
+        stuck: set[int] | None = None,
+    ):
+        self.failing = failing or set()
+        self.undeliverable = undeliverable or set()
+        self.broken = broken or set()
+        self.stuck = stuck or set()
+        self.sent: list[tuple[int, str, int]] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def enqueue(self, chat_id: int, text: str, *, priority: int) -> asyncio.Future:
+        if chat_id in self.failing:
+            raise RuntimeError("queue unavailable")
+        self.sent.append((chat_id, text, priority))
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if chat_id in self.stuck:
+            return future
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+        def resolve():
+            self.in_flight -= 1
+            if chat_id in self.broken:
+                future.set_exception(RuntimeError("delivery crashed"))
+            else:
+                future.set_result(None if chat_id in self.undeliverable else object())
+
+        loop.call_later(0.01, resolve)
+        return future
+
+
+class TestNotificationOutbox:
+    """Тесты очереди уведомлений"""
+
+    @pytest.fixture(autouse=True)
+    def setup_data(self):
+        register_user(1, "alice", "Alice")
+        for friend_id in range(2, 8):
+            register_user(friend_id, f"friend{friend_id}", "Friend")
+            add_friend(1, friend_id)
+
+    def test_claim_is_leased(self):
+        """Тест аренды: забранную строку не получит второй обработчик, пока аренда не истекла"""
+        enqueue_notifications([user_message(1, "hi"), user_message(2, "hello")])
+
+        first = claim_notifications(10, lease_seconds=60)
+        assert [item["chat_id"] for item in first] == [1, 2]
+        assert claim_notifications(10, lease_seconds=60) == []
+        assert complete_notifications([first[0]["id"]]) == 1
+
+        enqueue_notifications([user_message(3, "later")])
+        expired = claim_notifications(10, lease_seconds=0)
+        again = claim_notifications(10, lease_seconds=60)
+        assert [item["chat_id"] for item in expired] == [3]
+        assert [(item["chat_id"], item["attempts"]) for item in again] == [(3, 2)]
+        assert count_pending_notifications() == 2
+
+    def test_review_writes_notifications_only_when_applied(self):
+        """Тест: уведомления пишутся в той же транзакции и только для применённых решений"""
+        accept_challenge(1, "outbox_task")
+        mark_challenge_submitted(1, "outbox_task", "file_1")
+        results = resolve_reports_batch(
+            9,
+            [
+                {
+                    "user_id": 1,
+                    "challenge_id": "outbox_task",
+                    "review_status": "approved",
+                    "notifications": [user_message(1, "ok"), friend_completion(1, "Task", 3)],
+                },
+                {
+                    "user_id": 2,
+                    "challenge_id": "outbox_task",
+                    "review_status": "approved",
+                    "notifications": [user_message(2, "never")],
+                },
+            ],
+        )
+        assert results == [True, False]
+        assert [item["kind"] for item in claim_notifications(10, 60)] == ["message", "friend_completion"]
+
+    def test_worker_expands_friend_fanout(self):
+        """Тест: обработчик раскрывает рассылку друзьям и доставляет с ограничением параллельности"""
+        enqueue_notifications([user_message(1, "approved"), friend_completion(1, "Эко-сумка", 5)])
+        sender = FakeSender()
+
+        async def scenario():
+            worker = NotificationWorker(sender, concurrency=2)
+            while await worker.drain_once():
+                pass
+            await worker.join()
+            return worker.stats()
+
+        stats = asyncio.run(scenario())
+        assert stats == {"sent": 7, "failed": 0, "expanded": 1, "dropped": 0, "buffered": 0, "digests": 0}
+        assert sender.sent[0] == (1, "approved", PRIORITY_USER)
+        friends = sorted(chat_id for chat_id, _, _ in sender.sent[1:])
+        assert friends == list(range(2, 8))
+        _, text, priority = sender.sent[-1]
+        assert "Alice (@alice)" in text and "Эко-сумка" in text and "5 баллов" in text
+        assert priority == PRIORITY_BULK
+        assert sender.max_in_flight <= 2
+        assert count_pending_notifications() == 0
+
+    def test_undelivered_row_stays_leased(self):
+        """Тест: пока send_queue не доставил сообщение, строка остаётся в очереди и её аренда продлевается"""
+        enqueue_notifications([user_message(5, "slow")])
+        sender = FakeSender(stuck={5})
+
+        async def scenario():
+            worker = NotificationWorker(sender, lease_seconds=0.3, poll_seconds=0.05)
+            await worker.start()
+            await asyncio.sleep(0.6)
+            claimed_elsewhere = await database_aio.claim_notifications(10, 60)
+            await worker.stop()
+            return claimed_elsewhere, worker.stats()
+
+        claimed_elsewhere, stats = asyncio.run(scenario())
+        assert claimed_elsewhere == []
+        assert sender.sent == [(5, "slow", PRIORITY_USER)]
+        assert (stats["sent"], stats["dropped"]) == (0, 0)
+        assert count_pending_notifications() == 1
+
+    def test_delivery_outcome_settles_row(self):
+        """Тест: недоставленное (dead letter) удаляется, а сбой доставки возвращает строку в очередь"""
+        enqueue_notifications([user_message(5, "blocked"), user_message(6, "crash")])
+        sender = FakeSender(undeliverable={5}, broken={6})
+
+        async def scenario():
+            worker = NotificationWorker(sender)
+            await worker.drain_once()
+            await worker.join()
+            return worker.stats()
+
+        stats = asyncio.run(scenario())
+        assert (stats["sent"], stats["failed"], stats["dropped"]) == (0, 1, 0)
+        retried = claim_notifications(10, 60)
+        assert [(item["chat_id"], item["attempts"]) for item in retried] == [(6, 2)]
+
+    def test_rows_completed_without_waiting_for_batch(self):
+        """Тест: готовая строка удаляется сразу, даже если соседняя по пачке ещё обрабатывается"""
+        enqueue_notifications([friend_completion(1, "Эко-сумка", 5), user_message(1, "approved")])
+        sender = FakeSender()
+
+        async def scenario():
+            worker = NotificationWorker(sender)
+            release = asyncio.Event()
+            expand = worker._expand_friend_completion
+
+            async def slow_expand(item):
+                await release.wait()
+                await expand(item)
+
+            worker._expand_friend_completion = slow_expand
+            drain = asyncio.create_task(worker.drain_once())
+            await asyncio.sleep(0.1)
+            pending_while_blocked = await database_aio.count_pending_notifications()
+            release.set()
+            await drain
+            await worker.join()
+            return pending_while_blocked
+
+        assert asyncio.run(scenario()) == 1
+        assert sender.sent == [(1, "approved", PRIORITY_USER)]
+
+    def test_failed_processing_retried_then_dropped(self):
+        """Тест: сбой обработки оставляет строку для повтора, после лимита попыток она удаляется"""
+        enqueue_notifications([user_message(5, "flaky")])
+        sender = FakeSender(failing={5})
+
+        async def scenario():
+            worker = NotificationWorker(sender, lease_seconds=0, max_attempts=2)
+            await worker.drain_once()
+            remaining = await database_aio.count_pending_notifications()
+            await worker.drain_once()
+            return remaining, worker.stats()
+
+        remaining, stats = asyncio.run(scenario())
+        assert remaining == 1
+        assert stats["dropped"] == 1
+        assert count_pending_notifications() == 0
+
+    def test_digest_recipients_get_one_summary(self):
+        """Тест: включившие сводку друзья получают одно сообщение за окно, остальные — сразу"""
+        set_friend_digest(2, True)
+        set_friend_digest(3, True)
+        set_friend_digest(3, False)
+        assert (get_friend_digest(2), get_friend_digest(3)) == (True, False)
+        enqueue_notifications([
+            friend_completion(1, "Эко-сумка", 5),
+            friend_completion(1, "Без пластика", 3),
+        ])
+        sender = FakeSender()
+
+        async def scenario():
+            worker = NotificationWorker(sender, digest_window_seconds=3600)
+            while await worker.drain_once():
+                pass
+            await worker.join()
+            before_window = await worker.flush_digests()
+            immediate = list(sender.sent)
+            worker.digest_window_seconds = 0
+            await database_aio.set_friend_digest(2, False)
+            flushed = await worker.flush_digests()
+            while await worker.drain_once():
+                pass
+            await worker.join()
+            return before_window, immediate, flushed, worker.stats()
+
+        before_window, immediate, flushed, stats = asyncio.run(scenario())
+        assert before_window == 0
+        assert sorted(chat_id for chat_id, _, _ in immediate) == sorted(list(range(3, 8)) * 2)
+        assert flushed == 1
+        assert (stats["buffered"], stats["digests"]) == (2, 1)
+        chat_id, text, priority = sender.sent[-1]
+        assert chat_id == 2 and priority == PRIORITY_BULK
+        assert "Сводка" in text and "Эко-сумка" in text and "Без пластика" in text and "+5" in text
+        assert count_buffered_friend_digest_events(2) == 0
+        assert count_pending_notifications() == 0
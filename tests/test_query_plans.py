@@ -0,0 +1,113 @@
+import pytest
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database import *
+from database import _connection, _get_pending_friend_request_between
+
+
+def _capture_queries(func, *args, **kwargs) -> list[str]:
+    """Выполнить функцию БД и вернуть читающие запросы с подставленными параметрами."""
+    statements: list[str] = []
+    # Пул отдаёт последнее возвращённое подключение, поэтому функция получит именно его
+    with _connection() as conn:
+        pass
+    conn.set_trace_callback(statements.append)
+    try:
+        func(*args, **kwargs)
+    finally:
+        conn.set_trace_callback(None)
+    return [sql for sql in statements if sql.lstrip().upper().startswith(("SELECT", "WITH"))]
+
+
+def _query_plan(sql: str) -> list[str]:
+    with _connection() as conn:
+        return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()]
+
+
+def _full_scans(plan: list[str]) -> list[str]:
+    """Строки плана с полным проходом по таблице без индекса."""
+    # Проход по CTE/подзапросу, константной строке и json_each таблицу не читает
+    derived = {
+        step.split(" ", 1)[1]
+        for step in plan
+        if step.startswith(("CO-ROUTINE ", "MATERIALIZE "))
+    }
+    return [
+        step
+        for step in plan
+        if step.startswith("SCAN ")
+        and " USING " not in step
+        and step != "SCAN CONSTANT ROW"
+        and " VIRTUAL TABLE " not in step
+        and step[len("SCAN "):] not in derived
+    ]
+
+
+class TestQueryPlans:
+    """Горячие запросы не должны деградировать до полного SCAN таблицы"""
+
+    @pytest.fixture(autouse=True)
+    def setup_data(self):
+        register_user(1, "Alice", "Alice")
+        register_user(2, "bob", "Bob")
+        accept_challenge(1, "challenge_1")
+        mark_challenge_submitted(1, "challenge_1", "file_1")
+        create_friend_request(1, 2)
+        log_admin_action(1, "login")
+
+    @pytest.mark.parametrize(
+        "func, args",
+        [
+            (get_pending_reports, ()),
+            (get_pending_reports, (50, ("2024-01-01 00:00:00", 1, "challenge_1"))),
+            (get_pending_reports, (50, None, "challenge_1", "2024-01-01")),
+            (count_pending_reports, ("challenge_1",)),
+            (count_pending_reports, (None, "2024-01-01", "2024-02-01")),
+            (get_report_events, (0,)),
+            (get_admin_session, ("hash", 0.0)),
+            (find_user_by_username, ("ALICE",)),
+            (get_user_registration_counts, ()),
+            (get_recent_user_profiles, (100,)),
+            (upsert_users, ([(1, "alice_new", "Alice")],)),
+            (_get_pending_friend_request_between, (1, 2)),
+            (get_friend_request, (1,)),
+            (get_friends, (1,)),
+            (get_friends_leaderboard, (1,)),
+            (get_global_leaderboard, ("weekly",)),
+            (get_global_leaderboard, ("all",)),
+            (get_global_rank, (1, "weekly")),
+            (get_global_rank, (1, "all")),
+            (get_friend_ids, (1,)),
+            (get_friend_digest, (1,)),
+            (get_friend_digest_recipients, ([1, 2],)),
+            (count_buffered_friend_digest_events, (1,)),
+            (get_user_challenge_statuses, (1,)),
+            (get_submitted_challenges, (1,)),
+            (get_user_awarded_points, (1,)),
+            (get_admin_logs, (10,)),
+            (get_conversation_state, ("report", 1, 0.0)),
+            (reserve_send_tokens, (0.0, 30.0, 30.0, 10)),
+        ],
+        ids=lambda value: getattr(value, "__name__", None),
+    )
+    def test_no_full_scans(self, func, args):
+        queries = _capture_queries(func, *args)
+        assert queries
+        for sql in queries:
+            plan = _query_plan(sql)
+            # COUNT(*) по всей таблице допустим, если идёт по покрывающему индексу
+            assert not _full_scans(plan), f"{func.__name__}: {plan}"
+
+    def test_pending_reports_use_partial_index(self):
+        (sql,) = _capture_queries(get_pending_reports)
+        plan = _query_plan(sql)
+        assert any("idx_user_challenges_pending" in step for step in plan), plan
+        assert not any("TEMP B-TREE" in step for step in plan), plan
+
+    @pytest.mark.parametrize("period", GLOBAL_LEADERBOARD_PERIODS)
+    def test_global_leaderboard_reads_sorted_index(self, period):
+        (sql,) = _capture_queries(get_global_leaderboard, period)
+        plan = _query_plan(sql)
+        assert any("_ranking" in step for step in plan), plan
+        assert not any("TEMP B-TREE" in step for step in plan), plan
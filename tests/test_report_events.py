@@ -0,0 +1,96 @@
+import asyncio
+import json
+import pytest
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database import (
+    accept_challenge,
+    get_report_events,
+    mark_challenge_submitted,
+    purge_report_events,
+    register_user,
+    update_report_review,
+)
+import database_aio
+from support_tools.report_events import ReportEventHub
+
+
+def _parse(message: str) -> tuple[int, str, dict]:
+    fields = dict(line.split(": ", 1) for line in message.strip().splitlines())
+    return int(fields["id"]), fields["event"], json.loads(fields["data"])
+
+
+def _submit(user_id: int, challenge_id: str):
+    accept_challenge(user_id, challenge_id)
+    mark_challenge_submitted(user_id, challenge_id, f"file_{user_id}_{challenge_id}")
+
+
+class TestReportEvents:
+    """Тесты ленты изменений очереди модерации"""
+
+    @pytest.fixture(autouse=True)
+    def setup_data(self):
+        register_user(1, "alice", "Alice")
+        register_user(2, "bob", "Bob")
+
+    def test_outbox_written_with_report_changes(self):
+        """Тест: отправка и проверка отчёта пишут события, неудачная проверка — нет"""
+        _submit(1, "outbox")
+        update_report_review(1, "outbox", "approved", awarded_points=5)
+        update_report_review(2, "outbox", "approved")
+
+        events = get_report_events(0)
+        assert [(e["kind"], e["user_id"], e["review_status"]) for e in events] == [
+            ("added", 1, "pending"),
+            ("resolved", 1, "approved"),
+        ]
+        assert events[0]["submitted_at"]
+        assert get_report_events(events[0]["id"]) == events[1:]
+        assert purge_report_events(keep_last=1) == 1
+        assert get_report_events(0) == events[1:]
+
+    def test_hub_fans_out_to_all_clients(self):
+        """Тест: одно чтение ленты доходит до всех подключённых админов"""
+
+        async def scenario():
+            hub = ReportEventHub(poll_interval=0.01)
+            await hub.start()
+            first, second = hub.stream(keepalive=1), hub.stream(keepalive=1)
+            pending = [asyncio.ensure_future(anext(first)), asyncio.ensure_future(anext(second))]
+            await asyncio.sleep(0.02)
+            assert hub.stats()["subscribers"] == 2
+            await database_aio.run(_submit, 2, "fanout")
+            messages = await asyncio.wait_for(asyncio.gather(*pending), timeout=2)
+            await first.aclose()
+            await second.aclose()
+            stats = hub.stats()
+            await hub.stop()
+            return messages, stats
+
+        messages, stats = asyncio.run(scenario())
+        assert messages[0] == messages[1]
+        _, kind, data = _parse(messages[0])
+        assert (kind, data["user_id"], data["challenge_id"]) == ("added", 2, "fanout")
+        assert stats["subscribers"] == 0
+
+    def test_reconnect_replays_missed_events(self):
+        """Тест: клиент с Last-Event-ID получает пропущенные события без повторов"""
+        _submit(1, "missed")
+        (seen,) = get_report_events(0)
+        update_report_review(1, "missed", "rejected", review_comment="blurry")
+        _submit(2, "missed")
+
+        async def scenario():
+            hub = ReportEventHub(poll_interval=0.01)
+            await hub.start()
+            stream = hub.stream(last_event_id=seen["id"], keepalive=1)
+            messages = [await anext(stream), await anext(stream)]
+            await stream.aclose()
+            await hub.stop()
+            return messages
+
+        parsed = [_parse(message) for message in asyncio.run(scenario())]
+        assert [(kind, data["user_id"]) for _, kind, data in parsed] == [("resolved", 1), ("added", 2)]
+        assert parsed[0][2]["review_status"] == "rejected"
+        assert parsed[0][0] > seen["id"]
@@ -0,0 +1,145 @@
+import asyncio
+import time
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from aiogram.exceptions import TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter
+import database_aio
+from database import get_dead_letters
+from support_tools.send_queue import PRIORITY_BULK, PRIORITY_USER, SendQueue
+
+
+class FakeBot:
+    """Бот, который запоминает отправки и по очереди выбрасывает заданные ошибки"""
+
+    def __init__(self, errors: dict[int, list[Exception]] | None = None):
+        self.errors = errors or {}
+        self.sent: list[tuple[int, str, float]] = []
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        pending = self.errors.get(chat_id)
+        if pending:
+            raise pending.pop(0)
+        self.sent.append((chat_id, text, time.monotonic()))
+        return {"chat_id": chat_id, "text": text}
+
+
+class TestSendQueue:
+    """Тесты очереди исходящих сообщений"""
+
+    def test_user_messages_overtake_bulk(self):
+        """Тест приоритета: ответы пользователям уходят раньше рассылки"""
+        bot = FakeBot()
+
+        async def scenario():
+            queue = SendQueue(bot, global_rate=1000, chat_burst=10, workers=1)
+            futures = [queue.enqueue(chat_id, "bulk", priority=PRIORITY_BULK) for chat_id in (1, 2, 3)]
+            futures.append(queue.enqueue(4, "reply", priority=PRIORITY_USER))
+            results = await asyncio.gather(*futures)
+            await queue.stop()
+            return results
+
+        results = asyncio.run(scenario())
+        assert all(result is not None for result in results)
+        assert [text for _, text, _ in bot.sent] == ["reply", "bulk", "bulk", "bulk"]
+
+    def test_per_chat_rate_limit(self):
+        """Тест лимита на чат: второе сообщение в тот же чат ждёт токен, другие чаты — нет"""
+        bot = FakeBot()
+
+        async def scenario():
+            queue = SendQueue(bot, global_rate=1000, chat_rate=5, chat_burst=1, workers=2)
+            await asyncio.gather(
+                queue.send_message(1, "first"),
+                queue.send_message(1, "second"),
+                queue.send_message(2, "other"),
+            )
+            await queue.stop()
+
+        asyncio.run(scenario())
+        times = {text: sent_at for _, text, sent_at in bot.sent}
+        assert times["second"] - times["first"] >= 0.15
+        assert times["other"] - times["first"] < 0.1
+
+    def test_retry_after_is_respected(self):
+        """Тест повтора после RetryAfter"""
+        bot = FakeBot({7: [TelegramRetryAfter(method=None, message="Flood control", retry_after=0)]})
+
+        async def scenario():
+            queue = SendQueue(bot, global_rate=1000, workers=1)
+            result = await queue.send_message(7, "hello")
+            await queue.stop()
+            return result, queue.stats()
+
+        result, stats = asyncio.run(scenario())
+        assert result == {"chat_id": 7, "text": "hello"}
+        assert stats["retried"] == 1
+        assert stats["dead"] == 0
+
+    def test_undeliverable_messages_are_dead_lettered(self):
+        """Тест dead-letter: заблокированный чат и исчерпанные попытки"""
+        bot = FakeBot(
+            {
+                8: [TelegramForbiddenError(method=None, message="bot was blocked by the user")],
+                9: [TelegramNetworkError(method=None, message="timeout") for _ in range(3)],
+            }
+        )
+
+        async def scenario():
+            queue = SendQueue(bot, global_rate=1000, workers=2, max_attempts=2, backoff_base=0.01)
+            results = await asyncio.gather(
+                queue.send_message(8, "blocked"),
+                queue.send_message(9, "flaky", priority=PRIORITY_BULK),
+            )
+            await queue.stop()
+            return results
+
+        assert asyncio.run(scenario()) == [None, None]
+        letters = {letter["chat_id"]: letter for letter in get_dead_letters()}
+        assert letters[8]["attempts"] == 1
+        assert letters[8]["error"].startswith("TelegramForbiddenError")
+        assert letters[9]["attempts"] == 2
+        assert letters[9]["priority"] == PRIORITY_BULK
+
+    def test_queues_share_one_budget(self):
+        """Тест: очереди разных процессов делят один лимит бота через БД"""
+        bot = FakeBot()
+
+        async def scenario():
+            queues = [SendQueue(bot, global_rate=20, chat_burst=10, workers=4) for _ in range(2)]
+            await asyncio.gather(*(
+                queue.send_message(index * 100 + chat_id, "hello")
+                for index, queue in enumerate(queues)
+                for chat_id in range(20)
+            ))
+            for queue in queues:
+                await queue.stop()
+
+        asyncio.run(scenario())
+        times = sorted(sent_at for _, _, sent_at in bot.sent)
+        assert len(times) == 40
+        # Запас корзины — 20 сообщений, остальные 20 идут со скоростью 20 в секунду
+        assert times[-1] - times[0] >= 0.8
+        assert sum(1 for sent_at in times if sent_at - times[0] < 0.5) <= 32
+
+    def test_global_tokens_reserved_in_batches(self, monkeypatch):
+        """Тест: токены общего лимита берутся из БД пачками, а не транзакцией на каждое сообщение"""
+        bot = FakeBot()
+        reserve = database_aio.reserve_send_tokens
+        calls: list[int] = []
+
+        async def counting_reserve(now, rate, capacity, wanted):
+            calls.append(wanted)
+            return await reserve(now, rate, capacity, wanted)
+
+        monkeypatch.setattr(database_aio, "reserve_send_tokens", counting_reserve)
+
+        async def scenario():
+            queue = SendQueue(bot, global_rate=1000, workers=2, token_batch=10)
+            await asyncio.gather(*(queue.send_message(chat_id, "hello") for chat_id in range(30)))
+            await queue.stop()
+
+        asyncio.run(scenario())
+        assert len(bot.sent) == 30
+        assert len(calls) <= 4
+        assert max(calls) == 10
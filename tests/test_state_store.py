@@ -0,0 +1,70 @@
+import asyncio
+import pytest
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from support_tools.state_store import MemoryStateStore, SQLiteStateStore, create_state_store
+
+
+class TestStateStore:
+    """Тесты хранилища состояний диалогов"""
+
+    @pytest.mark.parametrize("store_factory", [MemoryStateStore, SQLiteStateStore])
+    def test_roundtrip(self, store_factory):
+        """Тест записи, чтения и удаления состояния в обоих бэкендах"""
+        async def scenario():
+            store = store_factory(ttl_seconds=60)
+            state = {"challenge_id": "custom_1", "payload": {"file_id": "f", "caption": None}}
+            await store.set("report", 1, state)
+            assert await store.get("report", 1) == state
+            assert await store.get("friend", 1) is None
+            assert await store.pop("report", 1) == state
+            assert await store.get("report", 1) is None
+            await store.set("friend", 2, {"stage": "await_username"})
+            stats = await store.stats()
+            assert stats["entries"] == 1
+            assert stats["bytes"] > 0
+
+        asyncio.run(scenario())
+
+    @pytest.mark.parametrize("store_factory", [MemoryStateStore, SQLiteStateStore])
+    def test_expired_state_is_dropped(self, store_factory):
+        """Тест TTL: истёкшее состояние не возвращается и удаляется при чистке"""
+        async def scenario():
+            store = store_factory(ttl_seconds=60)
+            await store.set("friend", 3, {"stage": "await_username"})
+            store.ttl_seconds = -1
+            await store.set("friend", 4, {"stage": "await_username"})
+            assert await store.sweep() == 1
+            assert await store.get("friend", 4) is None
+            assert await store.get("friend", 3) == {"stage": "await_username"}
+            await store.set("friend", 5, {"stage": "await_username"})
+            assert await store.pop("friend", 5) is None
+
+        asyncio.run(scenario())
+
+    def test_memory_store_is_bounded(self):
+        """Тест вытеснения давно не использованных состояний"""
+        async def scenario():
+            store = MemoryStateStore(ttl_seconds=60, max_entries=2)
+            for user_id in (1, 2, 3):
+                await store.set("report", user_id, {"challenge_id": f"c{user_id}"})
+            assert await store.get("report", 1) is None
+            assert await store.get("report", 3) == {"challenge_id": "c3"}
+            stats = await store.stats()
+            assert stats["entries"] == 2
+            assert stats["evicted"] == 1
+
+            # Прочитанное состояние становится самым свежим и не вытесняется следующим
+            await store.get("report", 2)
+            await store.set("report", 4, {"challenge_id": "c4"})
+            assert await store.get("report", 2) == {"challenge_id": "c2"}
+            assert await store.get("report", 3) is None
+
+        asyncio.run(scenario())
+
+    def test_backend_selection(self):
+        assert create_state_store("memory").backend == "memory"
+        assert create_state_store("sqlite").backend == "sqlite"
+        with pytest.raises(ValueError):
+            create_state_store("redis")
@@ -0,0 +1,104 @@
+import asyncio
+import json
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from aiogram import Bot, Dispatcher, Router
+from aiogram.types import Message
+from aiohttp.test_utils import TestClient, TestServer
+from support_tools.webhook import SECRET_HEADER, create_webhook_app
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+SECRET = "test-secret"
+
+
+def _recorded_update(update_id: int | None = None) -> dict:
+    with open(os.path.join(FIXTURES, "update_start.json"), encoding="utf-8") as file:
+        update = json.load(file)
+    if update_id is not None:
+        update["update_id"] = update_id
+    return update
+
+
+def _dispatcher(received: list[str], gate: asyncio.Event | None = None) -> Dispatcher:
+    router = Router()
+
+    @router.message()
+    async def record(message: Message):
+        if gate is not None:
+            await gate.wait()
+        received.append(message.text)
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    return dp
+
+
+class TestWebhook:
+    """Тесты webhook-эндпоинта на записанных обновлениях Telegram"""
+
+    def test_recorded_update_is_dispatched(self):
+        """Тест: обновление с верным секретом доходит до обработчика"""
+        received: list[str] = []
+
+        async def scenario():
+            app = create_webhook_app(_dispatcher(received), Bot("42:TEST"), SECRET, workers=2)
+            async with TestClient(TestServer(app)) as client:
+                response = await client.post(
+                    "/telegram/webhook",
+                    json=_recorded_update(),
+                    headers={SECRET_HEADER: SECRET},
+                )
+                assert response.status == 200
+            return received
+
+        assert asyncio.run(scenario()) == ["/start"]
+
+    def test_rejects_wrong_secret_and_bad_payload(self):
+        """Тест проверки секрета и формата обновления"""
+        received: list[str] = []
+
+        async def scenario():
+            app = create_webhook_app(_dispatcher(received), Bot("42:TEST"), SECRET)
+            async with TestClient(TestServer(app)) as client:
+                missing = await client.post("/telegram/webhook", json=_recorded_update())
+                wrong = await client.post(
+                    "/telegram/webhook",
+                    json=_recorded_update(),
+                    headers={SECRET_HEADER: "nope"},
+                )
+                broken = await client.post(
+                    "/telegram/webhook",
+                    data="not json",
+                    headers={SECRET_HEADER: SECRET},
+                )
+                return missing.status, wrong.status, broken.status
+
+        assert asyncio.run(scenario()) == (401, 401, 400)
+        assert received == []
+
+    def test_full_queue_returns_503(self):
+        """Тест обратного давления: при заполненной очереди Telegram получает 503"""
+        received: list[str] = []
+
+        async def scenario():
+            gate = asyncio.Event()
+            app = create_webhook_app(
+                _dispatcher(received, gate), Bot("42:TEST"), SECRET, workers=1, queue_size=1
+            )
+            async with TestClient(TestServer(app)) as client:
+                statuses = []
+                for update_id in range(1, 4):
+                    response = await client.post(
+                        "/telegram/webhook",
+                        json=_recorded_update(update_id),
+                        headers={SECRET_HEADER: SECRET},
+                    )
+                    statuses.append(response.status)
+                    # Даём обработчику забрать первое обновление из очереди
+                    await asyncio.sleep(0.05)
+                gate.set()
+            return statuses
+
+        assert asyncio.run(scenario()) == [200, 200, 503]
+        assert received == ["/start", "/start"]